@@ -6,110 +6,209 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+import cache
 import database
-
-app = Flask(__name__)
-app.config['MONGO_URI'] = os.getenv('MONGO_URI')
-database.init_app(app)
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['SECRET_KEY'] = os.getenv('JWT_SECRET', os.getenv('SECRET_KEY', 'a_default_secret_key'))
-
-# Mail configuration (use free Gmail SMTP for dev). Set these in .env
-app.config['MAIL_SERVER'] = os.getenv('SMTP_HOST', 'smtp.gmail.com')
-app.config['MAIL_PORT'] = int(os.getenv('SMTP_PORT', '587'))
-app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', 'true').lower() == 'true'
-app.config['MAIL_USERNAME'] = os.getenv('SMTP_EMAIL', '')
-app.config['MAIL_PASSWORD'] = os.getenv('SMTP_PASSWORD', '')
-app.config['MAIL_DEFAULT_SENDER'] = os.getenv('FROM_EMAIL', os.getenv('SMTP_EMAIL', ''))
-
-mail = Mail(app)
-
-# Middleware
-allowed_origins = [
-  'http://localhost:3000',
-  'http://127.0.0.1:3000',
-  'http://localhost:3001',
-  'https://loopr-1.onrender.com',
-  'https://major-project-btech-1.onrender.com',
-  'https://major-project-btech.onrender.com',
-  'https://major-project-btech-backend.onrender.com',
-  'https://fintrack-dashboard.netlify.app',
-  'https://fintrack-app.vercel.app'
-]
-
-# If a public base URL is set (e.g., http://192.168.1.60:5000),
-# also allow that origin and its :3000 counterpart for the client.
-public_base = os.getenv('APP_PUBLIC_BASE_URL')
-if public_base:
-    allowed_origins.append(public_base)
-    try:
-        # Derive LAN host to allow :3000 frontend
-        import urllib.parse as _urlparse
-        parsed = _urlparse.urlparse(public_base)
-        if parsed.scheme and parsed.hostname:
-            allowed_origins.append(f"{parsed.scheme}://{parsed.hostname}:3000")
-    except Exception:
-        pass
-
-# Add Render frontend URL from environment variable
-frontend_url = os.getenv('FRONTEND_URL')
-if frontend_url:
-    allowed_origins.append(frontend_url)
-
-# Enable CORS with specific allowed origins
-CORS(app, 
-     origins=allowed_origins,
-     methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
-     allow_headers=['Content-Type', 'Authorization', 'Access-Control-Allow-Credentials'],
-     supports_credentials=True,
-     expose_headers=['Content-Range', 'X-Content-Range']
-)
-
-# Handle preflight requests
-@app.before_request
-def handle_preflight():
-    if request.method == "OPTIONS":
-        response = make_response()
-        response.headers.add("Access-Control-Allow-Origin", "*")
-        response.headers.add('Access-Control-Allow-Headers', "*")
-        response.headers.add('Access-Control-Allow-Methods', "*")
-        return response
-
-# Health check route
-@app.route('/')
-def index():
-    return 'Financial Analytics Dashboard API'
-
-# Register blueprints
-from routes.auth import auth_bp
-from routes.dashboard import dashboard_bp
-from routes.transactions import transactions_bp
-from routes.export import export_bp
-from routes.analytics import analytics_bp
-from routes.settings import settings_bp
-from routes.users import users_bp
-from routes.wallet import wallet_bp
-from routes.forecast import forecast_bp
-
-# Initialize blueprints with database connection
-from database import get_db as get_db_func
-from routes.forecast import init_app as init_forecast
-init_forecast(get_db_func)
-
-app.register_blueprint(auth_bp)
-app.register_blueprint(dashboard_bp)
-app.register_blueprint(transactions_bp)
-app.register_blueprint(export_bp)
-app.register_blueprint(analytics_bp)
-app.register_blueprint(users_bp)
-app.register_blueprint(wallet_bp)
-app.register_blueprint(forecast_bp)
-
-from flask import send_from_directory
-
-@app.route('/uploads/<filename>')
-def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+import json_provider
+import singleflight
+
+
+def create_app():
+    """Build the Flask app: config, extensions, blueprints and CLI commands."""
+    app = Flask(__name__)
+    # ObjectId/datetime/NumPy aware jsonify (orjson when installed)
+    json_provider.init_app(app)
+    app.config['MONGO_URI'] = os.getenv('MONGO_URI')
+    app.config['MONGO_AUTO_MIGRATE'] = os.getenv('MONGO_AUTO_MIGRATE', 'false').lower() == 'true'
+    database.init_app(app)
+    app.config['UPLOAD_FOLDER'] = 'uploads'
+    # Background upload processing (see jobs.py)
+    app.config['INGEST_ASYNC'] = os.getenv('INGEST_ASYNC', 'false').lower() == 'true'
+    app.config['INGEST_WORKERS'] = int(os.getenv('INGEST_WORKERS', '0'))
+    # insert | upsert | update (upsert/update also skip rows without a source id
+    # whose fields match a row already uploaded)
+    app.config['INGEST_MODE'] = os.getenv('INGEST_MODE', 'insert')
+    # Result cache for dashboard/analytics/forecast reads (see cache.py)
+    app.config['RESULT_CACHE_BACKEND'] = os.getenv('RESULT_CACHE_BACKEND', 'memory')
+    app.config['RESULT_CACHE_TTL'] = int(os.getenv('RESULT_CACHE_TTL', '300'))
+    app.config['RESULT_CACHE_MAX_BYTES'] = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+    app.config['SINGLE_FLIGHT_TIMEOUT'] = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', '60'))
+    app.config['FORECAST_MODEL_CACHE_BYTES'] = int(os.getenv('FORECAST_MODEL_CACHE_BYTES', str(64 * 1024 * 1024)))
+    # Out-of-process LSTM training (see forecast_pool.py); 0 trains in the request
+    app.config['FORECAST_WORKERS'] = int(os.getenv('FORECAST_WORKERS', '0'))
+    app.config['FORECAST_QUEUE_SIZE'] = int(os.getenv('FORECAST_QUEUE_SIZE', '8'))
+    app.config['FORECAST_TIMEOUT'] = float(os.getenv('FORECAST_TIMEOUT', '120'))
+    app.config['FORECAST_WORKER_MAX_RSS_MB'] = int(os.getenv('FORECAST_WORKER_MAX_RSS_MB', '1024'))
+    # Forecast model: auto (backtest FORECAST_CANDIDATES, see forecasters.py) | lstm | <name>
+    app.config['FORECAST_MODEL'] = os.getenv('FORECAST_MODEL', 'auto')
+    app.config['FORECAST_CANDIDATES'] = os.getenv('FORECAST_CANDIDATES', 'moving_average,exponential_smoothing,holt_winters,arima')
+    app.config['FORECAST_TOLERANCE'] = float(os.getenv('FORECAST_TOLERANCE', '0.1'))
+    # Load the forecasting stack in the background after boot (see startup.py)
+    app.config['FORECAST_WARMUP'] = os.getenv('FORECAST_WARMUP', 'false').lower() == 'true'
+    app.config['REDIS_URL'] = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    app.config['SECRET_KEY'] = os.getenv('JWT_SECRET', os.getenv('SECRET_KEY', 'a_default_secret_key'))
+
+    # Mail configuration (use free Gmail SMTP for dev). Set these in .env
+    app.config['MAIL_SERVER'] = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+    app.config['MAIL_PORT'] = int(os.getenv('SMTP_PORT', '587'))
+    app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', 'true').lower() == 'true'
+    app.config['MAIL_USERNAME'] = os.getenv('SMTP_EMAIL', '')
+    app.config['MAIL_PASSWORD'] = os.getenv('SMTP_PASSWORD', '')
+    app.config['MAIL_DEFAULT_SENDER'] = os.getenv('FROM_EMAIL', os.getenv('SMTP_EMAIL', ''))
+
+    mail = Mail(app)
+
+    # Middleware
+    allowed_origins = [
+      'http://localhost:3000',
+      'http://127.0.0.1:3000',
+      'http://localhost:3001',
+      'https://loopr-1.onrender.com',
+      'https://major-project-btech-1.onrender.com',
+      'https://major-project-btech.onrender.com',
+      'https://major-project-btech-backend.onrender.com',
+      'https://fintrack-dashboard.netlify.app',
+      'https://fintrack-app.vercel.app'
+    ]
+
+    # If a public base URL is set (e.g., http://192.168.1.60:5000),
+    # also allow that origin and its :3000 counterpart for the client.
+    public_base = os.getenv('APP_PUBLIC_BASE_URL')
+    if public_base:
+        allowed_origins.append(public_base)
+        try:
+            # Derive LAN host to allow :3000 frontend
+            import urllib.parse as _urlparse
+            parsed = _urlparse.urlparse(public_base)
+            if parsed.scheme and parsed.hostname:
+                allowed_origins.append(f"{parsed.scheme}://{parsed.hostname}:3000")
+        except Exception:
+            pass
+
+    # Add Render frontend URL from environment variable
+    frontend_url = os.getenv('FRONTEND_URL')
+    if frontend_url:
+        allowed_origins.append(frontend_url)
+
+    # Enable CORS with specific allowed origins
+    CORS(app, 
+         origins=allowed_origins,
+         methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
+         allow_headers=['Content-Type', 'Authorization', 'Access-Control-Allow-Credentials', 'If-None-Match'],
+         supports_credentials=True,
+         expose_headers=['Content-Range', 'X-Content-Range', 'ETag']
+    )
+
+    # Handle preflight requests
+    @app.before_request
+    def handle_preflight():
+        if request.method == "OPTIONS":
+            response = make_response()
+            response.headers.add("Access-Control-Allow-Origin", "*")
+            response.headers.add('Access-Control-Allow-Headers', "*")
+            response.headers.add('Access-Control-Allow-Methods', "*")
+            return response
+
+    # Health check route
+    @app.route('/')
+    def index():
+        return 'Financial Analytics Dashboard API'
+
+    # Database health and connection pool statistics for this worker
+    @app.route('/health/db')
+    def db_health():
+        report = database.db_health()
+        return jsonify(report), (200 if report['status'] == 'ok' else 503)
+
+    # Result cache statistics for this worker
+    @app.route('/health/cache')
+    def cache_health():
+        results = cache.get_cache(app)
+        flights = singleflight.get_flights(app)
+        return jsonify({
+            'cache': results.info() if results else {'backend': 'none'},
+            'singleflight': flights.info() if flights else None
+        })
+
+    # Memory and heavy modules loaded by this worker
+    @app.route('/health/startup')
+    def startup_health():
+        import startup
+        return jsonify(startup.info())
+
+    # Register blueprints
+    from routes.auth import auth_bp
+    from routes.dashboard import dashboard_bp
+    from routes.transactions import transactions_bp
+    from routes.export import export_bp
+    from routes.analytics import analytics_bp
+    from routes.settings import settings_bp
+    from routes.users import users_bp
+    from routes.wallet import wallet_bp
+    from routes.forecast import forecast_bp
+
+    # Initialize blueprints with database connection
+    from database import get_db as get_db_func
+    from routes.forecast import init_app as init_forecast
+    init_forecast(get_db_func)
+
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(dashboard_bp)
+    app.register_blueprint(transactions_bp)
+    app.register_blueprint(export_bp)
+    app.register_blueprint(analytics_bp)
+    app.register_blueprint(users_bp)
+    app.register_blueprint(wallet_bp)
+    app.register_blueprint(forecast_bp)
+
+    # Index/data migrations (CLI: flask --app app db-migrate / db-explain)
+    import migrations
+    migrations.init_app(app)
+
+    # Upload job queue workers (CLI: flask --app app ingest-worker)
+    import jobs
+    jobs.init_app(app)
+
+    # Per-user columnar snapshots (CLI: flask --app app snapshot-rebuild)
+    import snapshots
+    snapshots.init_app(app)
+
+    # Monthly dashboard rollups (CLI: flask --app app rollup-rebuild)
+    import rollups
+    rollups.init_app(app)
+
+    # Per-worker result cache, optionally backed by a shared store, and
+    # coalescing of concurrent identical reads
+    cache.init_app(app)
+    singleflight.init_app(app)
+
+    # Trained forecast models on disk, keyed by series and config
+    import model_store
+    model_store.init_app(app)
+    import forecast_pool
+    forecast_pool.init_app(app)
+
+    # Stored per-user forecasts (CLI: flask --app app forecast-batch, run nightly)
+    import forecasts
+    forecasts.init_app(app)
+
+    # Startup profile (CLI: flask --app app startup-profile) and forecast warm-up
+    import startup
+    startup.init_app(app)
+
+    from flask import send_from_directory
+
+    @app.route('/uploads/<filename>')
+    def uploaded_file(filename):
+        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+
+    return app
+
+
+# Forecast pool processes are started with spawn, which re-runs the main
+# script (``python app.py``) as __mp_main__ in every child; they need none of
+# the app, its database connection, migrations or worker pools
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
@@ -0,0 +1,149 @@
+"""Round trips and server time of GET /api/analytics: five pipelines vs one $facet.
+
+Seeds a synthetic user into a scratch database, then runs the previous
+implementation (five aggregations over ``transactions``) and the current one
+(rollup check plus a single ``$facet`` over ``monthly_rollups``), counting
+commands and summing their reported durations with a command listener.
+It needs a real MongoDB server; no results have been recorded for the
+$facet change yet, so it makes no claim about which is faster.
+
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/analytics_bench.py [transactions] [repeats]
+"""
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dateutil.relativedelta import relativedelta  # noqa: E402
+from pymongo import MongoClient, monitoring  # noqa: E402
+
+import classify  # noqa: E402
+import rollups  # noqa: E402
+from routes.analytics import PANELS, analytics_facets  # noqa: E402
+
+DB_NAME = 'analytics_bench'
+USER_ID = 'bench-user'
+MONTH_NAMES = [None, 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+class Commands(monitoring.CommandListener):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.micros = 0
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if event.command_name in ('aggregate', 'find', 'getMore'):
+            self.count += 1
+            self.micros += event.duration_micros
+
+    def failed(self, event):
+        pass
+
+
+def seed(db, n):
+    db.transactions.delete_many({'user_id': USER_ID})
+    db[rollups.ROLLUPS].delete_many({'user_id': USER_ID})
+    db[rollups.STATUS].delete_one({'_id': USER_ID})
+    rng = random.Random(7)
+    start = datetime.datetime.utcnow() - datetime.timedelta(days=730)
+    categories = classify.EXPENSE_CATEGORIES[:10] + ['salary', 'freelance', 'wallet_add']
+    docs = [classify.classify({
+        'user_id': USER_ID,
+        'amount': round(rng.uniform(1, 500), 2),
+        'date': start + datetime.timedelta(minutes=rng.randrange(730 * 24 * 60)),
+        'category': rng.choice(categories),
+        'status': rng.choice(['completed', 'pending']),
+    }) for _ in range(n)]
+    for i in range(0, n, 10000):
+        db.transactions.insert_many(docs[i:i + 10000])
+    db.transactions.create_index([('user_id', 1), ('date', -1)])
+    db.transactions.create_index([('user_id', 1), ('category', 1), ('date', -1)])
+    rollups.rebuild(db, USER_ID)
+
+
+def legacy_analytics(db):
+    """The previous implementation: five aggregations over transactions."""
+    expense = classify.EXPENSE_CATEGORIES
+    months = {'$let': {'vars': {'months': MONTH_NAMES}, 'in': {'$arrayElemAt': ['$$months', '$_id.month']}}}
+    list(db.transactions.aggregate([
+        {'$match': {'user_id': USER_ID}},
+        {'$group': {
+            '_id': {'year': {'$year': '$date'}, 'month': {'$month': '$date'}},
+            'revenue': {'$sum': {'$cond': [{'$not': [{'$in': ['$category', expense]}]}, '$amount', 0]}},
+            'expense': {'$sum': {'$cond': [{'$in': ['$category', expense]}, '$amount', 0]}}
+        }},
+        {'$sort': {'_id.year': 1, '_id.month': 1}},
+        {'$project': {'month': {'$concat': [months, ' ', {'$toString': '$_id.year'}]},
+                      'revenue': 1, 'expense': 1, '_id': 0}}
+    ]))
+    list(db.transactions.aggregate([
+        {'$match': {'user_id': USER_ID}},
+        {'$group': {'_id': '$category', 'amount': {'$sum': '$amount'}}},
+    ]))
+    today = datetime.datetime.utcnow()
+    start_of_month = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    start_of_last_month = start_of_month - relativedelta(months=1)
+    list(db.transactions.aggregate([
+        {'$match': {'user_id': USER_ID, 'date': {'$gte': start_of_month}, 'category': {'$in': expense}}},
+        {'$group': {'_id': '$category', 'amount': {'$sum': '$amount'}}},
+        {'$sort': {'amount': -1}},
+        {'$limit': 5},
+    ]))
+    for lo, hi in ((start_of_month, None), (start_of_last_month, start_of_month)):
+        date = {'$gte': lo, **({'$lt': hi} if hi else {})}
+        list(db.transactions.aggregate([
+            {'$match': {'user_id': USER_ID, 'date': date, 'category': {'$in': expense}}},
+            {'$group': {'_id': None, 'total': {'$sum': '$amount'}}},
+        ]))
+
+
+def facet_analytics(db, panels=PANELS):
+    pipeline = [
+        {'$match': rollups.ensure(db, USER_ID)},
+        {'$facet': analytics_facets(panels, datetime.datetime.utcnow())},
+    ]
+    return next(db[rollups.ROLLUPS].aggregate(pipeline), {})
+
+
+def measure(listener, fn, repeats):
+    best = None
+    for _ in range(repeats):
+        listener.reset()
+        started = time.perf_counter()
+        fn()
+        wall = time.perf_counter() - started
+        run = (listener.count, listener.micros / 1000, wall * 1000)
+        if best is None or run[2] < best[2]:
+            best = run
+    return best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    listener = Commands()
+    client = MongoClient(os.getenv('MONGO_URI', 'mongodb://localhost:27017'), event_listeners=[listener])
+    db = client[DB_NAME]
+    seed(db, n)
+    print(f'{n} transactions, best of {repeats}')
+    for label, fn in (
+        ('five pipelines', lambda: legacy_analytics(db)),
+        ('$facet, all panels', lambda: facet_analytics(db)),
+        ('$facet, spendChange only', lambda: facet_analytics(db, ['spendChange'])),
+    ):
+        commands, server_ms, wall_ms = measure(listener, fn, repeats)
+        print(f'{label:26} round trips {commands:2}  command time {server_ms:8.2f} ms  wall {wall_ms:8.2f} ms')
+    client.drop_database(DB_NAME)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Time and memory of preparing the monthly expense series for /forecast.
+
+For each size, builds synthetic transactions shaped like the documents the
+route used to fetch and compares, with the best wall time of ``repeats`` runs
+and the peak of tracemalloc:
+
+- legacy loop: the previous per-row preparation (``pd.to_datetime``/``float``
+  per row, list of dicts, DataFrame, groupby) over rows already in memory
+- rollup build: ``rollups.summarize`` over the same rows, the Python side of
+  the one-time rebuild on a user's first read
+- monthly_expenses: the shipped ``forecasts.monthly_expenses`` reading those
+  rollup rows. Without ``MONGO_URI`` it runs against mongomock (if
+  installed), so its time is in-process only and says nothing about a server.
+
+With ``MONGO_URI`` set it instead seeds a scratch database and compares
+fetching every row for the legacy loop against a ``$group`` over
+``transactions``, the rollup rebuild and ``monthly_expenses``.
+
+    [MONGO_URI=mongodb://localhost:27017] python benchmarks/forecast_prep_bench.py [rows,...] [repeats]
+"""
+import datetime
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import classify  # noqa: E402
+import forecasts  # noqa: E402
+import rollups  # noqa: E402
+
+DB_NAME = 'forecast_prep_bench'
+USER_ID = 'bench-user'
+PROJECTION = {'date': 1, 'amount': 1, '_id': 0, 'category': 1, 'type': 1, 'is_expense': 1}
+CATEGORIES = np.array(classify.EXPENSE_CATEGORIES[:10] + ['salary', 'freelance', 'wallet_add'], dtype=object)
+
+
+def make_rows(n, seed=7):
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2021-01-01T00:00')
+    dates = (start + rng.integers(0, 3 * 365 * 24 * 60, n).astype('timedelta64[m]')).astype(datetime.datetime)
+    amounts = np.round(rng.uniform(-500, 500, n), 2)
+    categories = CATEGORIES[rng.integers(0, len(CATEGORIES), n)]
+    return [classify.classify({'date': d, 'amount': float(a), 'category': c, 'type': None})
+            for d, a, c in zip(dates, amounts, categories)]
+
+
+def legacy(transactions):
+    """The per-row preparation /forecast used before the rollup aggregation."""
+    normalized = []
+    for tx in transactions:
+        try:
+            date_val = pd.to_datetime(tx.get('date'))
+        except Exception:
+            continue
+        try:
+            amt_val = float(tx.get('amount'))
+        except Exception:
+            continue
+        normalized.append({'date': date_val, 'amount': amt_val, 'is_expense': classify.stored_is_expense(tx)})
+    if not normalized:
+        return pd.Series(dtype=float)
+    df = pd.DataFrame(normalized)
+    df['date'] = pd.to_datetime(df['date'])
+    df['month'] = df['date'].dt.to_period('M')
+    df = df[df['is_expense']]
+    df['amount'] = df['amount'].abs()
+    return df.groupby('month')['amount'].sum()
+
+
+def seed_rollups(db, rows):
+    """Store rollups for ``rows`` the way a rebuild does, without inserting the rows."""
+    db[rollups.ROLLUPS].delete_many({'user_id': USER_ID})
+    db[rollups.ROLLUPS].insert_many([
+        {**rollups._row_id(USER_ID, 1, key), 'revenue': revenue, 'expenses': expenses, 'count': count}
+        for key, (revenue, expenses, count) in rollups.summarize(rows).items()
+    ])
+    db[rollups.STATUS].replace_one({'_id': USER_ID}, {'_id': USER_ID, 'ready': True, 'gen': 1}, upsert=True)
+
+
+def transactions_group(db):
+    """A $group over the raw transactions, for comparison with the rollups."""
+    rows = list(db.transactions.aggregate([
+        {'$match': {'user_id': USER_ID, 'is_expense': True, 'date': {'$type': 'date'}}},
+        {'$group': {'_id': {'year': {'$year': '$date'}, 'month': {'$month': '$date'}},
+                    'expenses': {'$sum': {'$abs': '$amount'}}}},
+        {'$sort': {'_id.year': 1, '_id.month': 1}},
+    ]))
+    index = pd.PeriodIndex([pd.Period(year=r['_id']['year'], month=r['_id']['month'], freq='M') for r in rows])
+    return pd.Series([r['expenses'] for r in rows], index=index, dtype=float)
+
+
+def measure(fn, repeats):
+    """(best seconds, peak MB, result); memory is measured on a separate run."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def report(label, seconds, peak, baseline=None):
+    speedup = f'  {baseline / seconds:7.1f}x' if baseline else ''
+    print(f'  {label:28} {seconds * 1000:10.1f} ms  peak {peak:8.1f} MB{speedup}')
+
+
+def check(expected, actual, label):
+    if list(expected.index) != list(actual.index) or not np.allclose(expected.to_numpy(), actual.to_numpy()):
+        sys.exit(f'{label} does not match the legacy series')
+
+
+def bench_mongo(db, rows, repeats):
+    db.transactions.delete_many({'user_id': USER_ID})
+    db[rollups.ROLLUPS].delete_many({'user_id': USER_ID})
+    db[rollups.STATUS].delete_one({'_id': USER_ID})
+    for i in range(0, len(rows), 10000):
+        db.transactions.insert_many([{**row, 'user_id': USER_ID} for row in rows[i:i + 10000]])
+    db.transactions.create_index([('user_id', 1), ('date', -1)])
+
+    legacy_s, legacy_mb, expected = measure(
+        lambda: legacy(db.transactions.find({'user_id': USER_ID}, PROJECTION)), repeats)
+    report('find + legacy loop', legacy_s, legacy_mb)
+    seconds, peak, series = measure(lambda: transactions_group(db), repeats)
+    check(expected, series, '$group over transactions')
+    report('$group over transactions', seconds, peak, legacy_s)
+    start = time.perf_counter()
+    rollups.rebuild(db, USER_ID)
+    print(f'  {"rollup rebuild (first read)":28} {(time.perf_counter() - start) * 1000:10.1f} ms')
+    seconds, peak, series = measure(lambda: forecasts.monthly_expenses(db, USER_ID), repeats)
+    check(expected, series, 'monthly_expenses')
+    report('monthly_expenses (rollups)', seconds, peak, legacy_s)
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [10000, 100000, 1000000]
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    mongo_uri = os.getenv('MONGO_URI')
+    client = None
+    if mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri)
+    else:
+        try:
+            import mongomock
+            local_db = mongomock.MongoClient()[DB_NAME]
+        except ImportError:
+            local_db = None
+    for n in sizes:
+        rows = make_rows(n)
+        print(f'{n} transactions, best of {repeats}')
+        if client is not None:
+            bench_mongo(client[DB_NAME], rows, repeats)
+            continue
+        legacy_s, legacy_mb, expected = measure(lambda: legacy(rows), repeats)
+        report('legacy loop', legacy_s, legacy_mb)
+        seconds, peak, _ = measure(lambda: rollups.summarize(rows), repeats)
+        report('rollup build (first read)', seconds, peak, legacy_s)
+        if local_db is None:
+            print('  monthly_expenses skipped: set MONGO_URI or install mongomock')
+            continue
+        seed_rollups(local_db, rows)
+        seconds, peak, series = measure(lambda: forecasts.monthly_expenses(local_db, USER_ID), repeats)
+        check(expected, series, 'monthly_expenses')
+        report('monthly_expenses (mongomock)', seconds, peak, legacy_s)
+    if client is not None:
+        client.drop_database(DB_NAME)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Per-response JSON serialization of transaction pages.
+
+Times the previous ``jsonify({'transactions': json.loads(json_util.dumps(docs))})``
+round trip against a single pass through ``json_provider.BSONJSONProvider``
+for pages of 1k and 10k Mongo-shaped documents.
+
+    python benchmarks/json_bench.py [repeats]
+"""
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bson import ObjectId, json_util  # noqa: E402
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+import json_provider  # noqa: E402
+
+
+def make_docs(n):
+    start = datetime.datetime(2024, 1, 1)
+    user_id = str(ObjectId())
+    return [{
+        '_id': ObjectId(),
+        'user_id': user_id,
+        'amount': round(10 + (i % 500) * 1.37, 2),
+        'date': start + datetime.timedelta(minutes=37 * i),
+        'category': ('Food', 'Rent', 'Travel', 'Shopping', 'Salary')[i % 5],
+        'description': f'Transaction {i}',
+        'status': 'completed',
+        'type': 'income' if i % 5 == 4 else 'expense',
+    } for i in range(n)]
+
+
+def best_of(fn, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    old_app = Flask('old')
+    old_app.json = DefaultJSONProvider(old_app)
+    new_app = Flask('new')
+    json_provider.init_app(new_app)
+    backend = 'orjson' if json_provider.orjson is not None else 'stdlib json'
+    print(f'provider backend: {backend}')
+
+    for n in (1000, 10000):
+        docs = make_docs(n)
+        with old_app.app_context():
+            def old():
+                return old_app.json.response({'transactions': json.loads(json_util.dumps(docs)), 'total': n}).get_data()
+            old_s = best_of(old, repeats)
+            old_bytes = len(old())
+        with new_app.app_context():
+            def new():
+                return new_app.json.response({'transactions': docs, 'total': n}).get_data()
+            new_s = best_of(new, repeats)
+            new_bytes = len(new())
+        print(f'{n:>6} docs  round-trip {old_s * 1000:8.1f} ms ({old_bytes} B)  '
+              f'provider {new_s * 1000:8.1f} ms ({new_bytes} B)  speedup {old_s / new_s:4.1f}x')
+
+
+if __name__ == '__main__':
+    main()
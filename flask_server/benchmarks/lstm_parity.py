@@ -0,0 +1,97 @@
+"""Parity and speed of NumPy LSTM inference against Keras.
+
+Trains forecast models on synthetic monthly series with
+``forecasting.train_lstm``, then checks that ``forecasting.lstm_forward``
+matches ``model.predict`` on many input windows and that ``predict_lstm``
+matches ``predict_keras``. Exits non-zero on a mismatch. Needs TensorFlow.
+
+``--write-golden PATH`` instead trains one model and stores its archive with
+Keras outputs for fixed inputs; ``tests/test_lstm_parity.py`` checks the
+NumPy forward pass against that file on hosts without TensorFlow.
+
+    python benchmarks/lstm_parity.py [series] [tolerance]
+    python benchmarks/lstm_parity.py --write-golden tests/fixtures/lstm_golden.npz
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np  # noqa: E402
+
+import forecasting  # noqa: E402
+
+
+def make_series(rng, months):
+    trend = np.linspace(800, 1400, months)
+    season = 150 * np.sin(np.arange(months) * 2 * np.pi / 12)
+    return trend + season + rng.normal(0, 60, months)
+
+
+def best_of(fn, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def write_golden(path):
+    """Train one model and save its archive with Keras outputs for fixed inputs."""
+    import tensorflow
+
+    rng = np.random.default_rng(11)
+    tensorflow.keras.utils.set_random_seed(11)
+    y = make_series(rng, 18)
+    archive = forecasting.train_lstm(y)
+    window = int(archive['window'])
+    model = forecasting._build(window, archive['lstm_recurrent_kernel'].shape[0], archive['dense_kernel'].shape[1])
+    model.set_weights([archive[name] for name in forecasting.WEIGHTS])
+    X = rng.uniform(-0.2, 1.2, (64, window, 1))
+    np.savez_compressed(
+        path, **archive, series=y, inputs=X,
+        keras_outputs=model.predict(X, verbose=0)[:, 0],
+        keras_forecast=np.array(forecasting.predict_keras(archive, y)),
+        tensorflow_version=np.array(tensorflow.__version__),
+    )
+    print(f'wrote {path} (TensorFlow {tensorflow.__version__})')
+
+
+def main():
+    if not forecasting.tensorflow_available():
+        sys.exit('TensorFlow is not installed; nothing to compare against')
+    if len(sys.argv) > 2 and sys.argv[1] == '--write-golden':
+        write_golden(sys.argv[2])
+        return
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    tolerance = float(sys.argv[2]) if len(sys.argv) > 2 else 1e-5
+    rng = np.random.default_rng(7)
+    worst = 0.0
+    for n in range(count):
+        y = make_series(rng, 12 + 6 * n)
+        archive = forecasting.train_lstm(y)
+        window = int(archive['window'])
+        model = forecasting._build(window, archive['lstm_recurrent_kernel'].shape[0], archive['dense_kernel'].shape[1])
+        model.set_weights([archive[name] for name in forecasting.WEIGHTS])
+        X = rng.uniform(-0.2, 1.2, (256, window, 1))
+        batch_error = np.abs(model.predict(X, verbose=0)[:, 0] - forecasting.lstm_forward(archive, X)).max()
+        keras_value = forecasting.predict_keras(archive, y)
+        numpy_value = forecasting.predict_lstm(archive, y)
+        scaled_error = abs(keras_value - numpy_value) / max(abs(keras_value), 1.0)
+        worst = max(worst, batch_error, scaled_error)
+        print(f'series {n}: {len(y)} months  batch max |diff| {batch_error:.2e}  '
+              f'forecast keras {keras_value:10.3f} numpy {numpy_value:10.3f}')
+
+    keras_s = best_of(lambda: forecasting.predict_keras(archive, y), 5)
+    numpy_s = best_of(lambda: forecasting.predict_lstm(archive, y), 200)
+    print(f'predict: keras {keras_s * 1000:8.2f} ms  numpy {numpy_s * 1e6:8.1f} us  '
+          f'speedup {keras_s / numpy_s:6.0f}x')
+    if worst > tolerance:
+        sys.exit(f'max difference {worst:.2e} exceeds {tolerance:.0e}')
+    print(f'parity ok (max difference {worst:.2e})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+"""Result cache for expensive per-user reads.
+
+Responses of the dashboard, analytics and forecast endpoints are cached under
+keys that include the user's data version (see ``versions.py``), so a write
+never serves stale results: it changes the key, and ``versions.bump`` also
+drops the user's old entries to free space early.
+
+Tiers: an in-process LRU (bounded by entries and bytes, with a TTL) in front
+of an optional shared store used by every worker on the host, either SQLite
+under ``UPLOAD_FOLDER/cache`` or Redis (``REDIS_URL``, needs the ``redis``
+package). Select with ``RESULT_CACHE_BACKEND`` = memory | sqlite | redis | none.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+DEFAULT_TTL = 300
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def as_dict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'sets': self.sets,
+            'evictions': self.evictions,
+            'errors': self.errors,
+        }
+
+
+class MemoryCache:
+    """Thread-safe LRU with per-entry expiry, bounded by entries and bytes."""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=1024, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.stats = CacheStats()
+        self._entries = OrderedDict()  # key -> (user_id, value, expires)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry[1]
+
+    def set(self, key, user_id, value, ttl):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (user_id, value, time.monotonic() + ttl)
+            self.bytes += len(value)
+            self.stats.sets += 1
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.stats.evictions += 1
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[0] == user_id]:
+                self._drop(key)
+
+    def _drop(self, key):
+        self.bytes -= len(self._entries.pop(key)[1])
+
+    def info(self):
+        return {'backend': self.name, 'entries': len(self._entries), 'bytes': self.bytes,
+                'max_entries': self.max_entries, 'max_bytes': self.max_bytes, **self.stats.as_dict()}
+
+
+class SQLiteCache:
+    """Host-wide cache shared by worker processes through one SQLite file.
+
+    Each thread keeps one connection open. Triggers keep the total size of
+    stored values in ``usage``, so writes do not have to sum the table.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'results.sqlite3')
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, user_id TEXT NOT NULL, '
+            'value BLOB NOT NULL, size INTEGER NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS results_user ON results (user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+        conn.execute('CREATE INDEX IF NOT EXISTS results_expires ON results (expires)')
+        conn.execute('CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires REAL NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY CHECK (id = 1), bytes INTEGER NOT NULL)')
+        conn.execute('INSERT OR IGNORE INTO usage (id, bytes) SELECT 1, COALESCE(SUM(size), 0) FROM results')
+        conn.execute('CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results '
+                     'BEGIN UPDATE usage SET bytes = bytes + NEW.size WHERE id = 1; END')
+        conn.execute('CREATE TRIGGER IF NOT EXISTS results_update AFTER UPDATE OF size ON results '
+                     'BEGIN UPDATE usage SET bytes = bytes + NEW.size - OLD.size WHERE id = 1; END')
+        conn.execute('CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results '
+                     'BEGIN UPDATE usage SET bytes = bytes - OLD.size WHERE id = 1; END')
+
+    def _conn(self):
+        # Connections must not cross a fork, so they are also keyed by process
+        cached = getattr(self._local, 'conn', None)
+        if cached is not None and cached[0] == os.getpid():
+            return cached[1]
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self._local.conn = (os.getpid(), conn)
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute('SELECT value FROM results WHERE key = ? AND expires > ?', (key, now)).fetchone()
+        if row is None:
+            self.stats.misses += 1
+            return None
+        conn.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+        self.stats.hits += 1
+        return bytes(row[0])
+
+    def set(self, key, user_id, value, ttl):
+        now = time.time()
+        conn = self._conn()
+        # An upsert (not REPLACE, whose implicit delete skips triggers) keeps usage exact
+        conn.execute(
+            'INSERT INTO results (key, user_id, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET user_id = excluded.user_id, value = excluded.value, '
+            'size = excluded.size, expires = excluded.expires, accessed = excluded.accessed',
+            (key, user_id, value, len(value), now + ttl, now)
+        )
+        self.stats.sets += 1
+        conn.execute('DELETE FROM results WHERE expires <= ?', (now,))
+        total = conn.execute('SELECT bytes FROM usage WHERE id = 1').fetchone()[0]
+        # Least recently used entries go first
+        while total > self.max_bytes:
+            row = conn.execute('SELECT key, size FROM results ORDER BY accessed LIMIT 1').fetchone()
+            if row is None:
+                break
+            conn.execute('DELETE FROM results WHERE key = ?', (row[0],))
+            total -= row[1]
+            self.stats.evictions += 1
+
+    def invalidate_user(self, user_id):
+        self._conn().execute('DELETE FROM results WHERE user_id = ?', (user_id,))
+
+    def acquire_lease(self, key, ttl):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('DELETE FROM leases WHERE key = ? AND expires <= ?', (key, now))
+        cursor = conn.execute('INSERT OR IGNORE INTO leases (key, expires) VALUES (?, ?)', (key, now + ttl))
+        return cursor.rowcount == 1
+
+    def lease_held(self, key):
+        row = self._conn().execute('SELECT 1 FROM leases WHERE key = ? AND expires > ?', (key, time.time())).fetchone()
+        return row is not None
+
+    def release_lease(self, key):
+        self._conn().execute('DELETE FROM leases WHERE key = ?', (key,))
+
+    def info(self):
+        conn = self._conn()
+        entries = conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        size = conn.execute('SELECT bytes FROM usage WHERE id = 1').fetchone()[0]
+        return {'backend': self.name, 'entries': entries, 'bytes': size,
+                'max_bytes': self.max_bytes, **self.stats.as_dict()}
+
+
+class RedisCache:
+    """Shared cache on a Redis-compatible server; memory is bounded by its maxmemory policy."""
+
+    name = 'redis'
+
+    def __init__(self, url, prefix='fin:results:'):
+        if redis is None:
+            raise RuntimeError('RESULT_CACHE_BACKEND=redis needs the redis package')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.stats = CacheStats()
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return value
+
+    def set(self, key, user_id, value, ttl):
+        members = f'{self.prefix}user:{user_id}'
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, value, ex=int(ttl))
+        pipe.sadd(members, self.prefix + key)
+        pipe.expire(members, int(ttl))
+        pipe.execute()
+        self.stats.sets += 1
+
+    def invalidate_user(self, user_id):
+        members = f'{self.prefix}user:{user_id}'
+        keys = self.client.smembers(members)
+        if keys:
+            self.client.delete(*keys)
+        self.client.delete(members)
+
+    def acquire_lease(self, key, ttl):
+        return bool(self.client.set(f'{self.prefix}lease:{key}', 1, nx=True, px=int(ttl * 1000)))
+
+    def lease_held(self, key):
+        return bool(self.client.exists(f'{self.prefix}lease:{key}'))
+
+    def release_lease(self, key):
+        self.client.delete(f'{self.prefix}lease:{key}')
+
+    def info(self):
+        return {'backend': self.name, **self.stats.as_dict()}
+
+
+class ResultCache:
+    """Local memory tier in front of an optional shared tier.
+
+    Shared-tier failures are counted and otherwise ignored: the cache must
+    never fail a request.
+    """
+
+    def __init__(self, local, shared=None, ttl=DEFAULT_TTL):
+        self.local = local
+        self.shared = shared
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None or self.shared is None:
+            return value
+        try:
+            value = self.shared.get(key)
+        except Exception:
+            self.shared.stats.errors += 1
+            return None
+        if value is not None:
+            user_id = key.split(':', 1)[0]
+            self.local.set(key, user_id, value, self.ttl)
+        return value
+
+    def set(self, key, user_id, value, ttl=None):
+        ttl = ttl or self.ttl
+        self.local.set(key, user_id, value, ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, user_id, value, ttl)
+            except Exception:
+                self.shared.stats.errors += 1
+
+    def invalidate_user(self, user_id):
+        self.local.invalidate_user(user_id)
+        if self.shared is not None:
+            try:
+                self.shared.invalidate_user(user_id)
+            except Exception:
+                self.shared.stats.errors += 1
+
+    def acquire_lease(self, key, ttl):
+        return self.shared.acquire_lease(key, ttl)
+
+    def lease_held(self, key):
+        return self.shared.lease_held(key)
+
+    def release_lease(self, key):
+        self.shared.release_lease(key)
+
+    def info(self):
+        tiers = [self.local.info()]
+        if self.shared is not None:
+            try:
+                tiers.append(self.shared.info())
+            except Exception as e:
+                tiers.append({'backend': self.shared.name, 'error': str(e)})
+        return {'ttl': self.ttl, 'tiers': tiers}
+
+
+def cache_key(user_id, tag):
+    return f'{user_id}:{tag}'
+
+
+def build_cache(config):
+    """Create the cache configured by RESULT_CACHE_* (None when disabled)."""
+    backend = config.get('RESULT_CACHE_BACKEND', 'memory')
+    if backend == 'none':
+        return None
+    local = MemoryCache(
+        max_entries=config.get('RESULT_CACHE_MAX_ENTRIES', 1024),
+        max_bytes=config.get('RESULT_CACHE_MAX_BYTES', 32 * 1024 * 1024),
+    )
+    shared = None
+    if backend == 'sqlite':
+        shared = SQLiteCache(
+            os.path.join(config.get('UPLOAD_FOLDER', 'uploads'), 'cache'),
+            max_bytes=config.get('RESULT_CACHE_SHARED_MAX_BYTES', 256 * 1024 * 1024),
+        )
+    elif backend == 'redis':
+        shared = RedisCache(config.get('REDIS_URL', 'redis://localhost:6379/0'))
+    return ResultCache(local, shared, ttl=config.get('RESULT_CACHE_TTL', DEFAULT_TTL))
+
+
+def get_cache(app):
+    return app.extensions.get('result_cache')
+
+
+def init_app(app):
+    app.extensions['result_cache'] = build_cache(app.config)
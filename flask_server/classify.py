@@ -0,0 +1,90 @@
+"""Canonical amount and expense classification for transactions.
+
+Writers store a numeric ``amount`` plus ``is_expense``/``direction`` on every
+transaction (see ``classify``); the backfill migration applies the same rule
+to older documents, and reports read the stored fields instead of
+re-deriving them.
+"""
+import numpy as np
+
+EXPENSE_CATEGORIES = [
+    'rent', 'bills', 'groceries', 'travel', 'others', 'shopping', 'food',
+    'utilities', 'transport', 'medical', 'entertainment', 'subscriptions',
+    'education', 'emi', 'loan', 'insurance', 'tax', 'fuel', 'misc', 'expense'
+]
+EXPENSE_TYPES = ['expense', 'debit']
+EXPENSE = 'expense'
+INCOME = 'income'
+
+_EXPENSE_CATEGORIES = frozenset(EXPENSE_CATEGORIES)
+_EXPENSE_TYPES = frozenset(EXPENSE_TYPES)
+
+
+def to_amount(value):
+    """Float amount, or None when the value is not numeric."""
+    if isinstance(value, bool):
+        return None
+    try:
+        amount = float(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return None if amount != amount else amount
+
+
+def is_expense(amount, txn_type, category):
+    """Negative amounts, expense/debit types and spending categories are expenses."""
+    if amount is not None and amount < 0:
+        return True
+    if str(txn_type or '').lower() in _EXPENSE_TYPES:
+        return True
+    category = str(category or '').lower()
+    return category in _EXPENSE_CATEGORIES or 'expense' in category
+
+
+def classify(doc):
+    """Set canonical ``amount``, ``is_expense`` and ``direction`` on ``doc`` in place."""
+    amount = to_amount(doc.get('amount'))
+    if amount is not None:
+        doc['amount'] = amount
+    expense = is_expense(amount, doc.get('type'), doc.get('category'))
+    doc['is_expense'] = expense
+    doc['direction'] = EXPENSE if expense else INCOME
+    return doc
+
+
+def stored_is_expense(doc):
+    """The stored classification, falling back to the rule for unmigrated documents."""
+    expense = doc.get('is_expense')
+    if expense is None:
+        expense = is_expense(to_amount(doc.get('amount')), doc.get('type'), doc.get('category'))
+    return expense
+
+
+def _lower(field):
+    return {'$toLower': {'$convert': {'input': field, 'to': 'string', 'onError': '', 'onNull': ''}}}
+
+
+def expense_expr(amount):
+    """Aggregation expression for ``stored_is_expense``; ``amount`` is the numeric amount expression."""
+    category = _lower('$category')
+    return {'$ifNull': ['$is_expense', {'$or': [
+        {'$lt': [amount, 0]},
+        {'$in': [_lower('$type'), EXPENSE_TYPES]},
+        {'$in': [category, EXPENSE_CATEGORIES]},
+        {'$gte': [{'$indexOfCP': [category, 'expense']}, 0]},
+    ]}]}
+
+
+def expense_mask(amounts, types, categories):
+    """Vectorized ``is_expense`` over equally long columns."""
+    import pandas as pd
+
+    amounts = np.asarray(amounts, dtype=float)
+    types = pd.Series(types, dtype=object).fillna('').astype(str).str.lower()
+    categories = pd.Series(categories, dtype=object).fillna('').astype(str).str.lower()
+    return (
+        (amounts < 0)
+        | types.isin(EXPENSE_TYPES).to_numpy()
+        | categories.isin(EXPENSE_CATEGORIES).to_numpy()
+        | categories.str.contains('expense', regex=False).to_numpy()
+    )
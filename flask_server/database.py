@@ -1,12 +1,133 @@
 from flask import current_app, g
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
+import atexit
 import os
-import ssl
+import threading
+import time
+
+# One MongoClient per process. MongoClient is thread-safe and owns its own
+# connection pool, so every request in a worker shares it. The pid is kept so
+# a forked gunicorn worker never reuses sockets inherited from its parent.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counts connection pool events for the shared client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.created = 0
+            self.closed = 0
+            self.checked_out = 0
+            self.checked_in = 0
+            self.checkout_failed = 0
+            self.pool_cleared = 0
+
+    def _inc(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._inc('pool_cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._inc('created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._inc('closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._inc('checkout_failed')
+
+    def connection_checked_out(self, event):
+        self._inc('checked_out')
+
+    def connection_checked_in(self, event):
+        self._inc('checked_in')
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'connectionsCreated': self.created,
+                'connectionsClosed': self.closed,
+                'connectionsOpen': self.created - self.closed,
+                'checkedOut': self.checked_out,
+                'checkedIn': self.checked_in,
+                'inUse': self.checked_out - self.checked_in,
+                'checkoutFailed': self.checkout_failed,
+                'poolCleared': self.pool_cleared,
+            }
+
+
+pool_stats = PoolStats()
+
+
+def _client_options(config):
+    options = {
+        'maxPoolSize': config['MONGO_MAX_POOL_SIZE'],
+        'minPoolSize': config['MONGO_MIN_POOL_SIZE'],
+        'maxIdleTimeMS': config['MONGO_MAX_IDLE_TIME_MS'],
+        'serverSelectionTimeoutMS': config['MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+        'event_listeners': [pool_stats],
+    }
+    if config.get('MONGO_COMPRESSORS'):
+        options['compressors'] = config['MONGO_COMPRESSORS']
+    return options
+
+
+def get_client():
+    """Return the process-wide MongoClient, creating it on first use."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            # After a fork the inherited client must not be used or closed;
+            # just drop the reference and build a fresh one for this process.
+            pool_stats.reset()
+            _client = MongoClient(
+                current_app.config['MONGO_URI'],
+                **_client_options(current_app.config)
+            )
+            _client_pid = pid
+    return _client
+
+
+def close_client():
+    """Close the shared client (on shutdown or before re-creating it)."""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
 
 def get_db():
     if 'db' not in g:
-        # Simple connection without SSL parameters
-        client = MongoClient(current_app.config['MONGO_URI'])
+        client = get_client()
         db = None
         try:
             # Works only if the URI includes a database name (e.g., .../financial_analytics)
@@ -26,7 +147,44 @@ def get_db():
         g.db = db
     return g.db
 
+
+def db_health():
+    """Ping the server and report latency plus pool statistics."""
+    started = time.perf_counter()
+    try:
+        get_client().admin.command('ping')
+        status = 'ok'
+        error = None
+    except Exception as e:
+        status = 'error'
+        error = str(e)
+    result = {
+        'status': status,
+        'latencyMs': round((time.perf_counter() - started) * 1000, 2),
+        'pid': os.getpid(),
+        'maxPoolSize': current_app.config['MONGO_MAX_POOL_SIZE'],
+        'pool': pool_stats.snapshot(),
+    }
+    if error:
+        result['error'] = error
+    return result
+
+
+def _int_env(name, default):
+    return int(os.getenv(name, str(default)))
+
+
 def init_app(app):
-    app.config['MONGO_URI'] = app.config.get('MONGO_URI', 'mongodb://localhost:27017/financial_analytics')
+    app.config['MONGO_URI'] = app.config.get('MONGO_URI') or 'mongodb://localhost:27017/financial_analytics'
     # Optional explicit DB name if URI doesn't include one
     app.config['MONGO_DB_NAME'] = app.config.get('MONGO_DB_NAME', os.getenv('MONGO_DB_NAME', 'financial_analytics'))
+
+    # Pool tuning (per worker process)
+    app.config.setdefault('MONGO_MAX_POOL_SIZE', _int_env('MONGO_MAX_POOL_SIZE', 50))
+    app.config.setdefault('MONGO_MIN_POOL_SIZE', _int_env('MONGO_MIN_POOL_SIZE', 0))
+    app.config.setdefault('MONGO_MAX_IDLE_TIME_MS', _int_env('MONGO_MAX_IDLE_TIME_MS', 60000))
+    app.config.setdefault('MONGO_SERVER_SELECTION_TIMEOUT_MS', _int_env('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+    # Comma separated list, e.g. "zstd,snappy,zlib" (zstd/snappy need extra packages)
+    app.config.setdefault('MONGO_COMPRESSORS', os.getenv('MONGO_COMPRESSORS', ''))
+
+    atexit.register(close_client)
@@ -0,0 +1,97 @@
+"""Downsampling of long chart series that keeps their visual shape.
+
+``lttb`` is Largest-Triangle-Three-Buckets: per bucket it keeps the point
+forming the largest triangle with the previously kept point and the next
+bucket's average, which preserves peaks and troughs. ``minmax`` keeps each
+bucket's minimum and maximum (an envelope), fully vectorized. ``thin``
+applies either to a list of chart points with several value series, keeping
+at most ``max_points`` of them.
+"""
+import numpy as np
+
+METHODS = ('lttb', 'minmax')
+MIN_POINTS = 3
+
+
+def lttb(y, threshold, x=None):
+    """Indices of ``threshold`` points of ``y`` chosen by LTTB."""
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if threshold >= n or threshold < MIN_POINTS:
+        return np.arange(n)
+    x = np.arange(n, dtype=float) if x is None else np.asarray(x, dtype=float)
+    # threshold - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    # Average of the bucket following each bucket (for the last, the final point)
+    starts = edges[1:]
+    counts = np.append(edges[2:], n) - starts
+    avg_x = np.add.reduceat(x, starts) / counts
+    avg_y = np.add.reduceat(y, starts) / counts
+
+    out = np.empty(threshold, dtype=np.int64)
+    out[0] = 0
+    out[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[a] - avg_x[i]) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (avg_y[i] - y[a])
+        )
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+
+def minmax(y, threshold):
+    """Indices of each bucket's minimum and maximum (at most ``threshold``)."""
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if threshold >= n or threshold < MIN_POINTS:
+        return np.arange(n)
+    buckets = threshold // 2
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    bucket = np.repeat(np.arange(buckets), np.diff(edges))
+    firsts = edges[:-1]
+    # Sorting by (bucket, value) puts each bucket's min first and max last
+    order = np.lexsort((y, bucket))
+    lows = order[firsts]
+    highs = order[edges[1:] - 1]
+    return np.unique(np.concatenate([lows, highs]))
+
+
+def thin(points, max_points, keys, method='lttb'):
+    """Keep at most ``max_points`` of ``points``, preserving each series' shape.
+
+    Every series in ``keys`` gets an equal share of the budget and the union
+    of their selections is returned in the original order.
+    """
+    n = len(points)
+    if max_points is None or n <= max_points:
+        return points
+    share = max(max_points // len(keys), MIN_POINTS)
+    selected = []
+    for key in keys:
+        values = np.fromiter((p.get(key) or 0 for p in points), dtype=float, count=n)
+        selected.append(lttb(values, share) if method == 'lttb' else minmax(values, share))
+    keep = np.unique(np.concatenate(selected + [np.array([0, n - 1])]))
+    if len(keep) > max_points:
+        # Shares rounded up to MIN_POINTS; drop evenly spaced extras
+        keep = keep[np.linspace(0, len(keep) - 1, max_points).round().astype(np.int64)]
+    return [points[i] for i in keep.tolist()]
+
+
+def parse_args(args):
+    """(max_points, method) from ``maxPoints``/``downsample``; raises ValueError."""
+    method = args.get('downsample', 'lttb')
+    if method not in METHODS:
+        raise ValueError(f'downsample must be one of {list(METHODS)}')
+    if 'maxPoints' not in args:
+        return None, method
+    try:
+        max_points = int(args['maxPoints'])
+    except ValueError:
+        raise ValueError('maxPoints must be an integer')
+    if max_points < MIN_POINTS:
+        raise ValueError(f'maxPoints must be at least {MIN_POINTS}')
+    return max_points, method
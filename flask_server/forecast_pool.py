@@ -0,0 +1,295 @@
+"""Pool of long-lived forecast worker processes.
+
+LSTM training runs in dedicated processes started with ``spawn``, so web
+workers stay small: each pool process imports TensorFlow once (``initializer``
+warms it up at start) and then serves jobs sent over a pipe. At most
+``workers`` jobs run at a time and up to ``queue_size`` more wait for a free
+process; beyond that ``run`` raises ``PoolSaturated`` (the route answers
+429). A job that exceeds its timeout, or is cancelled, is stopped by
+killing its process, which is then replaced. A process whose resident
+memory exceeds ``max_rss_mb`` after a job exits and is replaced as well. A
+slot whose process fails to start stays empty until the next ``run``
+retries it.
+
+Jobs run with an ``owner`` (the requesting user); ``GET /forecast/jobs``
+lists the caller's running jobs and ``DELETE /forecast/jobs/<id>`` cancels
+one. Each web process has its own pool, so both only see jobs of the process
+that serves them.
+
+Enable with ``FORECAST_WORKERS``; 0 trains in the request thread.
+"""
+import atexit
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+
+import forecasting
+from startup import rss_mb
+
+DEFAULT_QUEUE_SIZE = 8
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_MAX_RSS_MB = 1024
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+class JobTimeout(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _worker_main(conn, max_rss_mb, initializer):
+    if initializer is not None:
+        try:
+            initializer()
+        except Exception:
+            # Jobs will hit (and report) the same problem
+            pass
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        if task is None:
+            return
+        fn, args = task
+        try:
+            reply = (True, fn(*args))
+        except Exception as e:
+            reply = (False, e)
+        rss = rss_mb()
+        try:
+            conn.send((*reply, rss))
+        except Exception as e:
+            # Result or exception could not be pickled
+            conn.send((False, RuntimeError(f'{type(e).__name__}: {e}'), rss))
+        if max_rss_mb and rss > max_rss_mb:
+            return
+
+
+class _Worker:
+    def __init__(self, ctx, max_rss_mb, initializer):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child, max_rss_mb, initializer), daemon=True)
+        self.process.start()
+        child.close()
+        self.jobs = 0
+        self.cancelled = False
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ForecastPool:
+    def __init__(self, workers, queue_size=DEFAULT_QUEUE_SIZE, timeout=DEFAULT_TIMEOUT,
+                 max_rss_mb=DEFAULT_MAX_RSS_MB, initializer=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.max_rss_mb = max_rss_mb
+        self.initializer = initializer
+        self._ctx = multiprocessing.get_context('spawn')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._idle = queue.Queue()
+        self._pool = []
+        self._running = {}  # job id -> (worker, started, owner)
+        self._lock = threading.Lock()
+        self._started = False
+        self._missing = 0  # slots whose process could not be started
+        self.stats = {'completed': 0, 'failed': 0, 'rejected': 0, 'timeouts': 0,
+                      'cancelled': 0, 'crashed': 0, 'recycled': 0, 'spawn_failures': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def start(self):
+        # Processes start on first use (or warm-up); a web worker that never forecasts never spawns them
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._missing = self.workers
+        self._refill()
+
+    def _spawn(self):
+        """Start a process for an empty slot; False (slot stays empty) if that fails."""
+        try:
+            worker = _Worker(self._ctx, self.max_rss_mb, self.initializer)
+        except Exception:
+            self._count('spawn_failures')
+            return False
+        with self._lock:
+            self._missing -= 1
+            self._pool.append(worker)
+        self._idle.put(worker)
+        return True
+
+    def _refill(self):
+        """Retry empty slots; raises when the pool has no process at all."""
+        with self._lock:
+            missing = self._missing
+        for _ in range(missing):
+            if not self._spawn():
+                break
+        with self._lock:
+            if not self._pool:
+                raise RuntimeError('No forecast worker process could be started')
+
+    def _replace(self, worker, kill=True):
+        worker.stop(kill=kill)
+        with self._lock:
+            self._pool = [w for w in self._pool if w is not worker]
+            self._missing += 1
+        # A failed start leaves the slot empty; the next run retries it
+        self._spawn()
+
+    def run(self, fn, *args, timeout=None, owner=None):
+        """``fn(*args)`` in a pool process; ``fn`` must be importable by name.
+
+        ``owner`` tags the job for ``jobs`` and ``cancel``. Raises
+        PoolSaturated, JobTimeout or JobCancelled, or re-raises the exception
+        ``fn`` raised.
+        """
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise PoolSaturated('All forecast workers are busy')
+        try:
+            self.start()
+            self._refill()
+            timeout = timeout or self.timeout
+            deadline = time.monotonic() + timeout
+            try:
+                worker = self._idle.get(timeout=timeout)
+            except queue.Empty:
+                self._count('timeouts')
+                raise JobTimeout(f'No forecast worker became free within {timeout:g}s')
+            job_id = uuid.uuid4().hex[:12]
+            with self._lock:
+                worker.cancelled = False
+                self._running[job_id] = (worker, time.monotonic(), owner)
+            try:
+                return self._execute(worker, job_id, fn, args, deadline, timeout)
+            finally:
+                self._done(job_id)
+        finally:
+            self._slots.release()
+
+    def _done(self, job_id):
+        # Before the worker is handed on, so cancel() cannot reach the next job
+        with self._lock:
+            self._running.pop(job_id, None)
+
+    def _execute(self, worker, job_id, fn, args, deadline, timeout):
+        try:
+            worker.conn.send((fn, args))
+            if not worker.conn.poll(max(deadline - time.monotonic(), 0)):
+                self._count('timeouts')
+                self._done(job_id)
+                self._replace(worker)
+                raise JobTimeout(f'Forecast job {job_id} took longer than {timeout:g}s')
+            ok, value, rss = worker.conn.recv()
+        except (EOFError, OSError):
+            self._done(job_id)
+            cancelled = worker.cancelled
+            self._replace(worker)
+            if cancelled:
+                self._count('cancelled')
+                raise JobCancelled(f'Forecast job {job_id} was cancelled')
+            self._count('crashed')
+            raise RuntimeError('Forecast worker exited unexpectedly')
+
+        worker.jobs += 1
+        self._done(job_id)
+        if worker.cancelled:
+            # Cancelled just after it replied: the result stands, the process is gone
+            self._replace(worker)
+        elif self.max_rss_mb and rss > self.max_rss_mb:
+            # The process exits by itself after replying
+            self._count('recycled')
+            self._replace(worker, kill=False)
+        else:
+            self._idle.put(worker)
+        self._count('completed' if ok else 'failed')
+        if not ok:
+            raise value
+        return value
+
+    def jobs(self, owner):
+        """Running jobs of ``owner`` as ``{job_id: seconds running}``."""
+        now = time.monotonic()
+        with self._lock:
+            return {job_id: round(now - started, 1)
+                    for job_id, (_, started, job_owner) in self._running.items() if job_owner == owner}
+
+    def cancel(self, job_id, owner=None):
+        """Stop a running job (only ``owner``'s, if given); its caller gets JobCancelled."""
+        with self._lock:
+            # Checked and killed under the lock: the job cannot finish and hand
+            # its process to another job in between
+            entry = self._running.get(job_id)
+            if entry is None or (owner is not None and entry[2] != owner):
+                return False
+            worker = entry[0]
+            worker.cancelled = True
+            worker.process.kill()
+        return True
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, []
+        for worker in pool:
+            worker.stop(kill=True)
+
+    def info(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'started': self._started,
+                'alive': sum(1 for w in self._pool if w.process.is_alive()),
+                'idle': self._idle.qsize(),
+                'running': {job_id: round(now - started, 1) for job_id, (_, started, _) in self._running.items()},
+                'queue_size': self.queue_size,
+                'timeout_s': self.timeout,
+                'max_rss_mb': self.max_rss_mb,
+                **self.stats,
+            }
+
+
+def get_pool(app):
+    return app.extensions.get('forecast_pool')
+
+
+def init_app(app):
+    workers = app.config.get('FORECAST_WORKERS', 0)
+    if not workers:
+        app.extensions['forecast_pool'] = None
+        return
+    pool = ForecastPool(
+        workers,
+        queue_size=app.config.get('FORECAST_QUEUE_SIZE', DEFAULT_QUEUE_SIZE),
+        timeout=app.config.get('FORECAST_TIMEOUT', DEFAULT_TIMEOUT),
+        max_rss_mb=app.config.get('FORECAST_WORKER_MAX_RSS_MB', DEFAULT_MAX_RSS_MB),
+        initializer=forecasting.warm_up,
+    )
+    atexit.register(pool.close)
+    app.extensions['forecast_pool'] = pool
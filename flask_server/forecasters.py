@@ -0,0 +1,190 @@
+"""Registry of next-month expense forecasters with backtest-based selection.
+
+A forecaster takes the monthly series (oldest first) and returns the next
+month's value. ``register`` adds one with a relative ``cost``. ``select``
+backtests candidates on rolling origins: for each of the last months it fits
+on the months before it and predicts it (slow models on fewer months, see
+``max_origins``). It then picks the cheapest model whose mean absolute error
+over the months all of them were tested on is within ``tolerance`` of the
+best one. If the final fit of that model fails, the next one in line is used.
+statsmodels is imported on first use (``FORECAST_WARMUP`` loads it after boot).
+
+The LSTM is not a candidate: backtesting it would train TensorFlow models in
+the request process. It runs only as ``model=lstm``, trained in the forecast
+pool and cached in the model store.
+"""
+import warnings
+
+import numpy as np
+
+DEFAULT_CANDIDATES = ('moving_average', 'exponential_smoothing', 'holt_winters', 'arima')
+DEFAULT_TOLERANCE = 0.1
+MAX_ORIGINS = 6
+
+
+class Forecaster:
+    def __init__(self, name, fn, cost, min_points, available, max_origins=None):
+        self.name = name
+        self.fn = fn
+        self.cost = cost
+        self.min_points = min_points
+        self.available = available
+        self.max_origins = max_origins
+
+    def origins(self, y):
+        """Backtest months for this model: ``origins_for(y)``, capped by ``max_origins``."""
+        return min(origins_for(y), self.max_origins or MAX_ORIGINS)
+
+    def __call__(self, y):
+        with warnings.catch_warnings():
+            # statsmodels convergence chatter on short series
+            warnings.simplefilter('ignore')
+            value = float(self.fn(np.asarray(y, dtype=float)))
+        if not np.isfinite(value):
+            raise ValueError(f'{self.name} produced a non-finite forecast')
+        return value
+
+
+FORECASTERS = {}
+
+
+def register(name, cost, min_points=3, available=None, max_origins=None):
+    """Decorator adding a forecaster; ``available`` is a callable gate."""
+    def wrap(fn):
+        FORECASTERS[name] = Forecaster(name, fn, cost, min_points, available or (lambda: True), max_origins)
+        return fn
+    return wrap
+
+
+@register('moving_average', cost=1, min_points=1)
+def moving_average(y, window=3):
+    return y[-window:].mean()
+
+
+@register('exponential_smoothing', cost=2, min_points=4)
+def exponential_smoothing(y):
+    from statsmodels.tsa.holtwinters import SimpleExpSmoothing
+    return SimpleExpSmoothing(y, initialization_method='estimated').fit().forecast(1)[0]
+
+
+@register('holt_winters', cost=3, min_points=6, max_origins=3)
+def holt_winters(y):
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+    # Yearly seasonality needs two full years; otherwise Holt's linear trend
+    if len(y) >= 24:
+        model = ExponentialSmoothing(y, trend='add', seasonal='add', seasonal_periods=12,
+                                     initialization_method='estimated')
+    else:
+        model = ExponentialSmoothing(y, trend='add', initialization_method='estimated')
+    # The brute-force start grid doubles the fit time without changing these forecasts
+    return model.fit(use_brute=False).forecast(1)[0]
+
+
+@register('arima', cost=4, min_points=8, max_origins=3)
+def arima(y):
+    from statsmodels.tsa.arima.model import ARIMA
+    return ARIMA(y, order=(1, 1, 1)).fit().forecast(1)[0]
+
+
+def parse_candidates(value):
+    """Forecaster names from a comma separated string; raises ValueError."""
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in FORECASTERS]
+    if unknown or not names:
+        raise ValueError(f'models must be a comma separated subset of {sorted(FORECASTERS)}')
+    return names
+
+
+def origins_for(y):
+    """Backtest length: a third of the history, at most MAX_ORIGINS months."""
+    return max(1, min(MAX_ORIGINS, len(y) // 3))
+
+
+def errors(forecaster, y, origins):
+    """Absolute errors of one-step forecasts for the last ``origins`` months."""
+    actual = y[-origins:]
+    predicted = np.array([forecaster(y[:len(y) - origins + i]) for i in range(origins)])
+    return np.abs(actual - predicted)
+
+
+def backtest(forecaster, y, origins):
+    """(MAE, MAPE %) of one-step forecasts for the last ``origins`` months."""
+    return _scores(errors(forecaster, y, origins), y)
+
+
+def _scores(errs, y):
+    actual = y[-len(errs):]
+    return float(errs.mean()), float((errs / np.maximum(np.abs(actual), 1e-8)).mean() * 100)
+
+
+def select(y, candidates=DEFAULT_CANDIDATES, tolerance=DEFAULT_TOLERANCE):
+    """Backtest ``candidates`` on ``y`` and forecast with the chosen one.
+
+    Returns (forecast, report) where report names the model and its backtest
+    error. Candidates that are unavailable, lack data or fail (in the
+    backtest or the final fit) are skipped.
+    """
+    y = np.asarray(y, dtype=float)
+    # Every candidate needs min_points months of training data at its first origin
+    usable = [FORECASTERS[name] for name in candidates
+              if FORECASTERS[name].available() and len(y) - FORECASTERS[name].origins(y) >= FORECASTERS[name].min_points]
+    if not usable:
+        raise ValueError('No forecaster can handle this series')
+
+    tested = {}
+    for forecaster in usable:
+        try:
+            tested[forecaster.name] = errors(forecaster, y, forecaster.origins(y))
+        except Exception:
+            continue
+    if not tested:
+        raise ValueError('Every forecaster failed on this series')
+
+    # Compare on the most recent months every candidate was tested on
+    common = min(len(errs) for errs in tested.values())
+    compared = {name: float(errs[-common:].mean()) for name, errs in tested.items()}
+    best = min(compared.values())
+
+    def preference(name):
+        # Within tolerance the cheapest first, then the rest by error
+        if compared[name] <= best * (1 + tolerance):
+            return (0, FORECASTERS[name].cost)
+        return (1, compared[name])
+
+    for name in sorted(tested, key=preference):
+        try:
+            value = FORECASTERS[name](y)
+        except Exception:
+            continue
+        mae, mape = _scores(tested[name], y)
+        report = {
+            'model': name,
+            'backtest': {
+                'mae': mae,
+                'mape': mape,
+                'origins': len(tested[name]),
+                'compared_origins': common,
+                'candidates': compared,
+            },
+        }
+        return value, report
+    raise ValueError('Every forecaster failed on this series')
+
+
+def run(name, y):
+    """Forecast with one named model, with its own backtest for reference."""
+    forecaster = FORECASTERS[name]
+    y = np.asarray(y, dtype=float)
+    origins = forecaster.origins(y)
+    if not forecaster.available():
+        raise ValueError(f'{name} is not available on this server')
+    if len(y) - origins < forecaster.min_points:
+        raise ValueError(f'{name} needs at least {forecaster.min_points + origins} months of data')
+    mae, mape = backtest(forecaster, y, origins)
+    return forecaster(y), {'model': name, 'backtest': {'mae': mae, 'mape': mape, 'origins': origins}}
+
+
+def warm_up():
+    """Import the statsmodels pieces used above."""
+    import statsmodels.tsa.arima.model  # noqa: F401
+    import statsmodels.tsa.holtwinters  # noqa: F401
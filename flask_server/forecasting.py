@@ -0,0 +1,145 @@
+"""LSTM expense forecaster for a monthly series.
+
+``train_lstm`` fits the model with Keras and returns an archive: a dict of
+NumPy arrays with the layer weights (Keras layout, LSTM gates in i, f, c, o
+order), the MinMaxScaler parameters and the window size, which
+``model_store`` persists. ``predict_lstm`` forecasts the month after the
+series from such an archive with a plain NumPy forward pass, so serving a
+trained model needs no TensorFlow. TensorFlow is imported on first use, so
+processes that hand training to the forecast pool never load it.
+"""
+import gc
+import importlib.util
+
+import numpy as np
+
+_tf = None
+
+# Part of the model cache key: changing any value retrains cached models
+LSTM_CONFIG = {'version': 1, 'window': 3, 'units': 20, 'dense': 10, 'epochs': 10, 'batch_size': 1}
+# Archive names of model.get_weights(), in order
+WEIGHTS = (
+    'lstm_kernel', 'lstm_recurrent_kernel', 'lstm_bias',
+    'dense_kernel', 'dense_bias', 'output_kernel', 'output_bias',
+)
+
+
+def tensorflow_available():
+    return importlib.util.find_spec('tensorflow') is not None
+
+
+def _keras():
+    global _tf
+    if _tf is None:
+        import tensorflow
+        _tf = tensorflow
+    return _tf.keras
+
+
+def _build(window, units, dense):
+    keras = _keras()
+    layers = keras.layers
+    # Lightweight model for memory efficiency
+    return keras.Sequential([
+        layers.Input(shape=(window, 1)),
+        layers.LSTM(units, return_sequences=False),
+        layers.Dense(dense),
+        layers.Dense(1)
+    ])
+
+
+def _windows(y_scaled, window):
+    """(samples, window, 1) inputs and next-month targets."""
+    X = np.lib.stride_tricks.sliding_window_view(y_scaled[:-1], window)
+    return X.reshape(len(X), window, 1), y_scaled[window:]
+
+
+def scale(archive, values):
+    return np.asarray(values, dtype=float) * archive['scaler_scale'][0] + archive['scaler_min'][0]
+
+
+def unscale(archive, values):
+    return (np.asarray(values, dtype=float) - archive['scaler_min'][0]) / archive['scaler_scale'][0]
+
+
+def train_lstm(y, config=LSTM_CONFIG):
+    """Train on the monthly series ``y``; raises ValueError if it is too short."""
+    from sklearn.preprocessing import MinMaxScaler
+
+    y = np.asarray(y, dtype=float)
+    # Use 3 months to predict the next one
+    window = min(config['window'], len(y) - 1)
+    scaler = MinMaxScaler()
+    y_scaled = scaler.fit_transform(y.reshape(-1, 1))[:, 0]
+    X, target = _windows(y_scaled, window)
+    if len(X) < 3:
+        raise ValueError('Insufficient data for LSTM training')
+
+    model = _build(window, config['units'], config['dense'])
+    model.compile(optimizer='adam', loss='mse')
+    model.fit(X, target, epochs=config['epochs'], batch_size=config['batch_size'], verbose=0)
+
+    archive = dict(zip(WEIGHTS, model.get_weights()))
+    archive.update(scaler_min=scaler.min_, scaler_scale=scaler.scale_, window=np.array(window))
+    # Clean up memory
+    del model
+    gc.collect()
+    return archive
+
+
+def _sigmoid(z):
+    # tanh form: no overflow warnings for large |z|
+    return 0.5 * (1.0 + np.tanh(0.5 * z))
+
+
+def lstm_forward(archive, X):
+    """Model output for inputs of shape (samples, window, 1), in NumPy.
+
+    Mirrors Keras: LSTM with tanh activation and sigmoid recurrent
+    activation, then two linear Dense layers.
+    """
+    X = np.asarray(X, dtype=float)
+    kernel = archive['lstm_kernel']
+    recurrent = archive['lstm_recurrent_kernel']
+    bias = archive['lstm_bias']
+    units = recurrent.shape[0]
+    h = np.zeros((len(X), units))
+    c = np.zeros((len(X), units))
+    for t in range(X.shape[1]):
+        z = X[:, t, :] @ kernel + h @ recurrent + bias
+        i = _sigmoid(z[:, :units])
+        f = _sigmoid(z[:, units:2 * units])
+        g = np.tanh(z[:, 2 * units:3 * units])
+        o = _sigmoid(z[:, 3 * units:])
+        c = f * c + i * g
+        h = o * np.tanh(c)
+    dense = h @ archive['dense_kernel'] + archive['dense_bias']
+    return (dense @ archive['output_kernel'] + archive['output_bias'])[:, 0]
+
+
+def predict_lstm(archive, y):
+    """Forecast for the month after ``y`` with a trained archive."""
+    window = int(archive['window'])
+    last_sequence = scale(archive, np.asarray(y, dtype=float)[-window:]).reshape(1, window, 1)
+    return float(unscale(archive, lstm_forward(archive, last_sequence)[0]))
+
+
+def predict_keras(archive, y):
+    """``predict_lstm`` through Keras (reference for parity checks)."""
+    window = int(archive['window'])
+    model = _build(window, archive['lstm_recurrent_kernel'].shape[0], archive['dense_kernel'].shape[1])
+    model.set_weights([archive[name] for name in WEIGHTS])
+    last_sequence = scale(archive, np.asarray(y, dtype=float)[-window:]).reshape(1, window, 1)
+    forecast_scaled = model.predict(last_sequence, verbose=0)
+    return float(unscale(archive, forecast_scaled[0, 0]))
+
+
+def warm_up():
+    """Import pandas, scikit-learn and TensorFlow and run one tiny prediction."""
+    import pandas  # noqa: F401
+    import sklearn.preprocessing  # noqa: F401
+    if tensorflow_available():
+        config = LSTM_CONFIG
+        model = _build(config['window'], config['units'], config['dense'])
+        model.predict(np.zeros((1, config['window'], 1)), verbose=0)
+
@@ -0,0 +1,251 @@
+"""Precomputed per-user expense forecasts.
+
+Forecasts only change when a month closes or new data arrives, so results are
+stored in the ``forecasts`` collection (one document per user) together with
+a fingerprint of the monthly series and the forecast settings. ``/forecast``
+serves the stored result while the fingerprint matches, and otherwise
+computes a fresh one and stores it.
+
+``flask --app app forecast-batch -p 4`` (run it nightly) walks all users in
+``_id`` order, computes stale forecasts in a process pool and records its
+position in ``forecast_batches`` after every chunk; an interrupted run resumes
+from there unless ``--restart`` is given.
+"""
+import datetime
+import hashlib
+import itertools
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import numpy as np
+from bson import ObjectId
+
+import forecasters
+import forecasting
+import rollups
+
+FORECASTS = 'forecasts'
+BATCHES = 'forecast_batches'
+MIN_MONTHS = 6
+CHUNK_SIZE = 100
+
+
+def expense_pipeline(selector):
+    """Monthly expense totals from the rollup rows ``selector`` picks, oldest month first."""
+    return [
+        {'$match': {**selector, 'year': {'$ne': None}, 'expenses': {'$gt': 0}}},
+        {'$group': {'_id': {'year': '$year', 'month': '$month'}, 'expenses': {'$sum': '$expenses'}}},
+        {'$sort': {'_id.year': 1, '_id.month': 1}},
+        {'$project': {'_id': 0, 'year': '$_id.year', 'month': '$_id.month', 'expenses': 1}},
+    ]
+
+
+def monthly_expenses(db, user_id):
+    """Monthly expense totals as a pandas Series indexed by month period.
+
+    None when the user has no transactions at all. Reads ``monthly_rollups``
+    (built on first use), so the cost does not grow with the user's history.
+    """
+    import pandas as pd
+
+    selector = rollups.ensure(db, user_id)
+    rows = list(db[rollups.ROLLUPS].aggregate(expense_pipeline(selector)))
+    if not rows:
+        if db[rollups.ROLLUPS].find_one(selector, {'_id': 1}) is None:
+            return None
+        return pd.Series(dtype=float)
+
+    df = pd.DataFrame(rows)
+    months = pd.to_datetime(df[['year', 'month']].assign(day=1)).dt.to_period('M')
+    return pd.Series(df['expenses'].to_numpy(dtype=float), index=pd.PeriodIndex(months, name='month'), name='amount')
+
+
+def settings(config, model=None):
+    """Forecast settings from app config, optionally overriding the model."""
+    model = model or config.get('FORECAST_MODEL', 'auto')
+    if model not in ('auto', 'lstm') and model not in forecasters.FORECASTERS:
+        raise ValueError(f"model must be 'auto' or one of {sorted(forecasters.FORECASTERS)}")
+    result = {'model': model}
+    if model == 'auto':
+        result['candidates'] = forecasters.parse_candidates(
+            config.get('FORECAST_CANDIDATES', ','.join(forecasters.DEFAULT_CANDIDATES)))
+        result['tolerance'] = config.get('FORECAST_TOLERANCE', forecasters.DEFAULT_TOLERANCE)
+    elif model == 'lstm':
+        result['lstm'] = forecasting.LSTM_CONFIG
+    return result
+
+
+def fingerprint(months, values, settings):
+    digest = hashlib.sha1(json.dumps([months, settings], sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(values, dtype='<f8').tobytes())
+    return digest.hexdigest()
+
+
+def compute(values, settings):
+    """Forecast for the month after ``values``; raises ValueError.
+
+    Returns {'expense', 'method', 'message'} plus 'backtest' for the
+    statistical models. Flask-free, so it runs in batch worker processes.
+    """
+    values = np.asarray(values, dtype=float)
+    model = settings['model']
+    if model == 'lstm':
+        if not forecasting.tensorflow_available():
+            return {'expense': forecasters.moving_average(values), 'method': 'moving_average',
+                    'message': 'Simple moving average forecast (TensorFlow not available)'}
+        archive = forecasting.train_lstm(values)
+        return {'expense': forecasting.predict_lstm(archive, values), 'method': 'lstm',
+                'message': 'LSTM forecast generated successfully'}
+    if model == 'auto':
+        value, report = forecasters.select(values, settings['candidates'], settings['tolerance'])
+        message = f"{report['model']} forecast (chosen by backtest)"
+    else:
+        value, report = forecasters.run(model, values)
+        message = f"{report['model']} forecast"
+    return {'expense': value, 'method': report['model'], 'message': message, 'backtest': report['backtest']}
+
+
+def _compute_safely(values, settings):
+    try:
+        return compute(values, settings), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def load(db, user_id, fingerprint):
+    """The stored forecast if it was computed from this series and settings."""
+    return db[FORECASTS].find_one({'_id': user_id, 'fingerprint': fingerprint})
+
+
+def save(db, user_id, fingerprint, result, batch=None):
+    """Store a result ({'month', 'expense', 'method', 'message', ...})."""
+    doc = {
+        **result,
+        'fingerprint': fingerprint,
+        'computed_at': datetime.datetime.utcnow(),
+        'batch': batch,
+    }
+    db[FORECASTS].replace_one({'_id': user_id}, doc, upsert=True)
+    return doc
+
+
+def record(db, user_id, fingerprint, result):
+    """``save`` for request handlers: a failed write never fails the request."""
+    try:
+        return save(db, user_id, fingerprint, result)
+    except Exception:
+        return result
+
+
+def response(history, result):
+    """/forecast response body for a computed or stored result."""
+    body = {
+        'history': history,
+        'forecast': {'month': result['month'], 'expense': float(result['expense'])},
+        'message': result['message'],
+        'method': result['method'],
+    }
+    for key in ('backtest', 'model', 'computed_at'):
+        if result.get(key) is not None:
+            body[key] = result[key]
+    return body
+
+
+def _user_ids(db, after=None):
+    query = {'_id': {'$gt': ObjectId(after)}} if after else {}
+    for doc in db.users.find(query, {'_id': 1}).sort('_id', 1):
+        yield str(doc['_id'])
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_batch(db, settings, processes=1, restart=False, chunk_size=CHUNK_SIZE, log=print):
+    """Compute stale forecasts for every user; returns the run's state document."""
+    state = db[BATCHES].find_one({'_id': 'latest'})
+    if state is None or state['status'] != 'running' or restart:
+        state = {
+            '_id': 'latest', 'status': 'running', 'started_at': datetime.datetime.utcnow(),
+            'cursor': None, 'users': 0, 'computed': 0, 'fresh': 0, 'skipped': 0, 'failed': 0,
+        }
+        db[BATCHES].replace_one({'_id': 'latest'}, state, upsert=True)
+    elif state['cursor']:
+        log(f"Resuming after user {state['cursor']} ({state['users']} users done)")
+    batch = state['started_at'].isoformat()
+
+    executor = None
+    if processes > 1:
+        executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+    start = time.monotonic()
+    seen = 0
+    try:
+        for chunk in _chunks(_user_ids(db, state['cursor']), chunk_size):
+            jobs = []
+            for user_id in chunk:
+                series = monthly_expenses(db, user_id)
+                if series is None or len(series) < MIN_MONTHS:
+                    state['skipped'] += 1
+                    continue
+                months = [str(m) for m in series.index]
+                values = series.to_numpy(dtype=float)
+                fp = fingerprint(months, values, settings)
+                if load(db, user_id, fp) is not None:
+                    state['fresh'] += 1
+                    continue
+                jobs.append((user_id, fp, str(series.index[-1] + 1), values))
+
+            series_values = [job[3] for job in jobs]
+            if executor is not None:
+                results = executor.map(_compute_safely, series_values, itertools.repeat(settings))
+            else:
+                results = map(_compute_safely, series_values, itertools.repeat(settings))
+            for (user_id, fp, month, _), (result, error) in zip(jobs, results):
+                if error is not None:
+                    state['failed'] += 1
+                    log(f'user {user_id}: {error}')
+                    continue
+                save(db, user_id, fp, {**result, 'month': month}, batch=batch)
+                state['computed'] += 1
+
+            # Checkpoint: a restarted run continues after this chunk
+            seen += len(chunk)
+            state['users'] += len(chunk)
+            state['cursor'] = chunk[-1]
+            db[BATCHES].replace_one({'_id': 'latest'}, state)
+            elapsed = time.monotonic() - start
+            log(f"{state['users']} users ({state['computed']} computed, {state['fresh']} fresh, "
+                f"{state['skipped']} skipped, {state['failed']} failed) {seen / elapsed:.1f} users/s")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    elapsed = time.monotonic() - start
+    state.update(status='done', finished_at=datetime.datetime.utcnow(),
+                 users_per_second=round(seen / elapsed, 2) if elapsed else None)
+    db[BATCHES].replace_one({'_id': 'latest'}, state)
+    return state
+
+
+def init_app(app):
+    from database import get_db
+
+    @app.cli.command('forecast-batch')
+    @click.option('--processes', '-p', default=1, show_default=True, help='Worker processes computing forecasts.')
+    @click.option('--restart', is_flag=True, help='Start over instead of resuming an interrupted run.')
+    @click.option('--chunk-size', default=CHUNK_SIZE, show_default=True, help='Users per checkpoint.')
+    def forecast_batch(processes, restart, chunk_size):
+        """Precompute every user's forecast (run nightly)."""
+        state = run_batch(get_db(), settings(app.config), processes=processes, restart=restart,
+                          chunk_size=chunk_size, log=click.echo)
+        click.echo(f"Done: {state['users']} users, {state['computed']} computed, {state['fresh']} fresh, "
+                   f"{state['skipped']} skipped, {state['failed']} failed, "
+                   f"{state['users_per_second']} users/s")
@@ -0,0 +1,459 @@
+"""Streaming ingestion of uploaded transactions.
+
+The upload body is read in fixed-size chunks and parsed incrementally, so
+memory use depends on the chunk and batch sizes, not on the file size.
+Accepted layouts: a JSON array, NDJSON (one object per line), a single
+object, or an object holding the records under a container key such as
+``{"transactions": [...]}``.
+"""
+import datetime
+import hashlib
+import json
+import time
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import classify
+
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 1000
+# A single record larger than this is rejected rather than buffered
+MAX_RECORD_CHARS = 8 * 1024 * 1024
+# Indexes of rejected records kept for reporting
+MAX_REJECTED_ROWS = 20
+CONTAINER_KEYS = ['transactions', 'data', 'items', 'records', 'list']
+
+# Write modes: plain inserts (records carrying a source id are still not
+# inserted twice), or upserts keyed on a per-record fingerprint ('upsert' keeps
+# existing rows untouched, 'update' overwrites changed fields). Fingerprints of
+# records without a source id hash their fields, so identical rows in one
+# upload collapse into one: only do that when the caller asks for it.
+WRITE_MODES = ('insert', 'upsert', 'update')
+DEFAULT_MODE = 'insert'
+SOURCE_ID_KEYS = ['id', 'transactionId', 'transaction_id', 'txnId']
+
+_decoder = json.JSONDecoder()
+_WS = ' \t\r\n'
+
+
+class InvalidPayload(ValueError):
+    """The upload body is not a JSON array, NDJSON or supported object."""
+
+
+class _Reader:
+    """Incremental text buffer over a binary stream."""
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+        self._pending = b''
+
+    def fill(self):
+        """Read another chunk; returns False at end of stream."""
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            if self._pending:
+                raise InvalidPayload('Upload is not valid UTF-8')
+            return False
+        self.bytes_read += len(chunk)
+        data = self._pending + chunk
+        # Keep an incomplete multi-byte sequence for the next chunk
+        try:
+            text = data.decode('utf-8')
+            self._pending = b''
+        except UnicodeDecodeError as e:
+            if e.start < len(data) - 3:
+                raise InvalidPayload('Upload is not valid UTF-8')
+            text = data[:e.start].decode('utf-8')
+            self._pending = data[e.start:]
+        # Drop consumed text so the buffer never grows past one record + chunk
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character (or '' at end of input)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise InvalidPayload(f"Expected '{char}' in upload body")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value, reading more input as needed."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # A number/literal touching the end of the buffer may be cut short
+                if end < len(self.buf) or self.eof or isinstance(value, (dict, list, str)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise InvalidPayload(f'Invalid JSON: {e.msg}')
+            if len(self.buf) - self.pos > MAX_RECORD_CHARS:
+                raise InvalidPayload('Upload record too large')
+            if not self.fill():
+                if self.pos >= len(self.buf):
+                    raise InvalidPayload('Unexpected end of upload body')
+
+
+def _iter_array(reader):
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.pos += 1
+        return
+    while True:
+        yield reader.value()
+        sep = reader.peek()
+        reader.pos += 1
+        if sep == ']':
+            return
+        if sep != ',':
+            raise InvalidPayload("Expected ',' or ']' in JSON array")
+
+
+def _iter_object(reader):
+    """Stream records out of a container key, else yield the object itself."""
+    reader.expect('{')
+    rest = {}
+    streamed = False
+    if reader.peek() == '}':
+        reader.pos += 1
+    else:
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise InvalidPayload('Object keys must be strings')
+            reader.expect(':')
+            if not streamed and key in CONTAINER_KEYS and reader.peek() == '[':
+                streamed = True
+                yield from _iter_array(reader)
+            else:
+                rest[key] = reader.value()
+            sep = reader.peek()
+            reader.pos += 1
+            if sep == '}':
+                break
+            if sep != ',':
+                raise InvalidPayload("Expected ',' or '}' in JSON object")
+    if not streamed:
+        # A lone object is treated as a single transaction
+        yield rest
+
+
+def iter_json_records_from(reader):
+    first = reader.peek()
+    if first == '':
+        raise InvalidPayload('Empty upload body')
+    if first == '[':
+        yield from _iter_array(reader)
+        if reader.peek() != '':
+            raise InvalidPayload('Unexpected data after JSON array')
+        return
+    if first != '{':
+        raise InvalidPayload('Unsupported JSON structure')
+    # Either a single object or NDJSON: one object after another
+    yield from _iter_object(reader)
+    while reader.peek() == '{':
+        yield reader.value()
+    if reader.peek() != '':
+        raise InvalidPayload('Unexpected data after JSON object')
+
+
+def iter_json_records(stream, chunk_size=CHUNK_SIZE, reader=None):
+    """Yield records from a binary stream holding JSON or NDJSON."""
+    reader = reader or _Reader(stream, chunk_size=chunk_size)
+    yield from iter_json_records_from(reader)
+
+
+# Field aliases, in priority order
+AMOUNT_KEYS = ['amount', 'amt', 'value', 'transactionAmount']
+CATEGORY_KEYS = ['category', 'type', 'tag']
+DATE_KEYS = ['date', 'transactionDate', 'timestamp', 'time']
+EXTRA_KEYS = ['status', 'description', 'merchant', 'type']
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def map_field(d, keys):
+    """The first alias whose value is not None or '' (else None)."""
+    for k in keys:
+        if k in d and d[k] not in [None, '']:
+            return d[k]
+    return None
+
+
+def parse_date(value):
+    """ISO string or epoch seconds/milliseconds -> naive UTC datetime, or None."""
+    try:
+        if isinstance(value, (int, float)):
+            # Heuristic: treat > 10^12 as ms, else seconds
+            ts = float(value)
+            return _EPOCH + datetime.timedelta(seconds=ts / 1000.0 if ts > 1e12 else ts)
+        parsed = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return parsed
+
+
+def normalize_record(tx, user_id):
+    """Map an uploaded record onto the transaction schema.
+
+    Returns ``(doc, None)`` or ``(None, reason)`` when the record is rejected.
+    """
+    if not isinstance(tx, dict):
+        return None, 'not an object'
+    date_val = map_field(tx, DATE_KEYS)
+    if date_val is None:
+        return None, 'missing date'
+    amount = map_field(tx, AMOUNT_KEYS)
+    if amount is None:
+        return None, 'missing amount'
+    parsed_date = parse_date(date_val)
+    if parsed_date is None:
+        return None, 'invalid date'
+    amount_val = classify.to_amount(amount)
+    if amount_val is None:
+        return None, 'invalid amount'
+
+    doc = {
+        'user_id': user_id,
+        'amount': amount_val,
+        'category': map_field(tx, CATEGORY_KEYS) or 'uncategorized',
+        'date': parsed_date,
+    }
+    # Preserve optional fields if present
+    for extra in EXTRA_KEYS:
+        if extra in tx:
+            doc[extra] = tx[extra]
+    # Canonical expense classification (same rule as classify.classify)
+    expense = classify.is_expense(amount_val, doc.get('type'), doc['category'])
+    doc['is_expense'] = expense
+    doc['direction'] = classify.EXPENSE if expense else classify.INCOME
+    return doc, None
+
+
+def normalize_batch(records, user_id, with_fingerprint=False, source_ids_only=False):
+    """Normalize a batch of uploaded records.
+
+    Returns ``(docs, rejections)`` where rejections is a list of
+    ``(position in batch, reason)``.
+    """
+    docs = []
+    rejections = []
+    for pos, tx in enumerate(records):
+        doc, reason = normalize_record(tx, user_id)
+        if doc is None:
+            rejections.append((pos, reason))
+            continue
+        if with_fingerprint:
+            source_id = map_field(tx, SOURCE_ID_KEYS)
+            if source_id is not None or not source_ids_only:
+                doc['fingerprint'] = fingerprint(doc, source_id)
+        docs.append(doc)
+    return docs, rejections
+
+
+def fingerprint(doc, source_id=None):
+    """Stable identity for an uploaded record.
+
+    Uses the source system id when the record has one, otherwise a hash of
+    the normalized fields, so re-uploading the same export maps onto the
+    same documents.
+    """
+    if source_id is not None:
+        return f'id:{source_id}'
+    parts = [
+        doc['date'].isoformat(),
+        repr(doc['amount']),
+        str(doc['category']),
+        str(doc.get('type', '')),
+        str(doc.get('description', '')),
+        str(doc.get('merchant', '')),
+    ]
+    return 'h:' + hashlib.sha1('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def write_batch(db, batch, mode):
+    """Write a batch and return (inserted, updated, skipped, collapsed, new_docs).
+
+    In insert mode only documents with a fingerprint (a source id) are
+    deduplicated. ``collapsed`` counts records merged into an identical one in
+    the same batch, ``skipped`` those already stored. ``new_docs`` are the
+    documents that were actually inserted, with ``_id``.
+    """
+    if mode == 'insert':
+        plain = [doc for doc in batch if 'fingerprint' not in doc]
+        if plain:
+            db.transactions.insert_many(plain, ordered=False)
+        if len(plain) == len(batch):
+            return len(plain), 0, 0, 0, plain
+        inserted, updated, skipped, collapsed, new_docs = _upsert_batch(
+            db, [doc for doc in batch if 'fingerprint' in doc], 'upsert')
+        return inserted + len(plain), updated, skipped, collapsed, plain + new_docs
+    return _upsert_batch(db, batch, mode)
+
+
+def _upsert_batch(db, batch, mode):
+    # Collapse repeats inside the batch; the unique index handles the rest
+    unique = {}
+    for doc in batch:
+        unique[doc['fingerprint']] = doc
+    collapsed = len(batch) - len(unique)
+    skipped = 0
+    ops = []
+    op_docs = list(unique.values())
+    for fp, doc in unique.items():
+        key = {'user_id': doc['user_id'], 'fingerprint': fp}
+        if mode == 'update':
+            fields = {k: v for k, v in doc.items() if k not in key}
+            ops.append(UpdateOne(key, {'$set': fields}, upsert=True))
+        else:
+            ops.append(UpdateOne(key, {'$setOnInsert': doc}, upsert=True))
+    try:
+        result = db.transactions.bulk_write(ops, ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as e:
+        # A concurrent upload may have inserted the same fingerprint first
+        details = e.details
+        if any(err.get('code') != 11000 for err in details.get('writeErrors', [])):
+            raise
+        skipped += len(details.get('writeErrors', []))
+    inserted = details.get('nUpserted', 0)
+    updated = details.get('nModified', 0)
+    skipped += details.get('nMatched', 0) - updated
+    new_docs = [dict(op_docs[u['index']], _id=u['_id']) for u in details.get('upserted', [])]
+    return inserted, updated, skipped, collapsed, new_docs
+
+
+def ingest_records(records, user_id, get_db, batch_size=BATCH_SIZE, stats=None, on_batch=None,
+                   mode=DEFAULT_MODE, on_insert=None, before_write=None, row_key=None):
+    """Normalize records and write them in fixed-size batches.
+
+    ``get_db`` is only called once there is something to insert, so parsing
+    still completes (and is counted) when MongoDB is unreachable.
+    Returns a stats dict; ``db_error`` is set if inserting failed.
+
+    ``stats`` resumes from an earlier snapshot: the first ``stats['committed']``
+    records are skipped. ``on_batch(stats)`` is called after every insert with
+    ``committed`` set to the number of records fully handled so far, and
+    ``on_insert(docs)`` with the documents each batch actually inserted.
+    ``before_write()`` runs before each batch is written; an exception from it
+    (or from ``on_batch``) stops the ingestion and propagates.
+
+    With ``row_key``, insert mode gives records without a source id the
+    fingerprint ``'<row_key>:<row index>'``, so a batch written again after a
+    crash (before its progress was saved) skips the rows already stored.
+
+    ``InvalidPayload`` is raised only after the records read before it are
+    written; its ``stats`` attribute holds the final stats.
+    """
+    stats = dict(stats or {})
+    for key in ('received', 'normalized', 'inserted', 'updated', 'skipped', 'collapsed', 'rejected', 'batches',
+                'committed'):
+        stats.setdefault(key, 0)
+    stats.setdefault('rejected_rows', [])
+    skip = stats['committed']
+    started = time.perf_counter()
+    pending = []
+    first_index = skip
+    db = None
+    db_error = None
+
+    def flush():
+        nonlocal db, db_error
+        batch, rejections = normalize_batch(pending, user_id, with_fingerprint=True,
+                                            source_ids_only=(mode == 'insert'))
+        if row_key is not None and mode == 'insert':
+            rejected = {pos for pos, _ in rejections}
+            rows = (first_index + pos for pos in range(len(pending)) if pos not in rejected)
+            for doc, row in zip(batch, rows):
+                doc.setdefault('fingerprint', f'{row_key}:{row}')
+        stats['normalized'] += len(batch)
+        stats['rejected'] += len(rejections)
+        room = MAX_REJECTED_ROWS - len(stats['rejected_rows'])
+        for pos, reason in rejections[:max(room, 0)]:
+            stats['rejected_rows'].append({'row': first_index + pos, 'reason': reason})
+        if db_error is None and batch:
+            if before_write is not None:
+                before_write()
+            try:
+                if db is None:
+                    db = get_db()
+                inserted, updated, skipped, collapsed, new_docs = write_batch(db, batch, mode)
+                stats['inserted'] += inserted
+                stats['updated'] += updated
+                stats['skipped'] += skipped
+                stats['collapsed'] += collapsed
+                stats['batches'] += 1
+            except Exception as e:
+                db_error = str(e)
+            else:
+                if on_insert is not None and new_docs:
+                    on_insert(new_docs)
+        if db_error is None:
+            stats['committed'] = stats['received']
+            if on_batch is not None:
+                on_batch(stats)
+
+    invalid = None
+    try:
+        for index, tx in enumerate(records):
+            if index < skip:
+                continue
+            stats['received'] += 1
+            pending.append(tx)
+            if len(pending) >= batch_size:
+                flush()
+                pending = []
+                first_index = index + 1
+    except InvalidPayload as e:
+        # Records read before the invalid JSON are still written
+        invalid = e
+    if pending:
+        flush()
+
+    stats['elapsed_s'] = round(time.perf_counter() - started, 3)
+    if db_error is not None:
+        stats['db_error'] = db_error
+    if invalid is not None:
+        invalid.stats = stats
+        raise invalid
+    return stats
+
+
+def ingest_stream(stream, user_id, get_db, batch_size=BATCH_SIZE, stats=None, on_batch=None,
+                  mode=DEFAULT_MODE, on_insert=None, before_write=None, row_key=None):
+    """Parse, normalize and insert an upload body with bounded memory."""
+    reader = _Reader(stream)
+    try:
+        stats = ingest_records(
+            iter_json_records(None, reader=reader), user_id, get_db, batch_size,
+            stats=stats, on_batch=on_batch, mode=mode, on_insert=on_insert, before_write=before_write,
+            row_key=row_key
+        )
+    except InvalidPayload as e:
+        if getattr(e, 'stats', None) is not None:
+            e.stats['bytes'] = reader.bytes_read
+        raise
+    stats['bytes'] = reader.bytes_read
+    return stats
@@ -0,0 +1,339 @@
+"""Durable background job queue for transaction uploads.
+
+Uploads are spooled to disk and recorded in a SQLite database under
+``UPLOAD_FOLDER/jobs``; a pool of worker processes claims jobs with a lease,
+normalizes and inserts the records in batches and stores progress after every
+batch. A job whose worker died (lease expired) is picked up again and resumes
+after the last committed batch.
+
+Start workers with ``flask --app app ingest-worker`` or set ``INGEST_WORKERS``
+to have the web app start them itself.
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+
+import click
+
+import ingest
+import rollups
+import snapshots
+import versions
+
+LEASE_SECONDS = 60
+POLL_SECONDS = 1.0
+MAX_ATTEMPTS = 3
+
+
+class LeaseLost(Exception):
+    """Another worker took the job over after this worker's lease expired."""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mode TEXT NOT NULL DEFAULT 'insert',
+    status TEXT NOT NULL,
+    stats TEXT NOT NULL DEFAULT '{}',
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+
+def jobs_dir(config):
+    return os.path.join(config.get('UPLOAD_FOLDER', 'uploads'), 'jobs')
+
+
+class JobStore:
+    """SQLite-backed job table shared by web and worker processes."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, 'jobs.sqlite3')
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            if 'mode' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN mode TEXT NOT NULL DEFAULT 'insert'")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def spool_path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.upload')
+
+    def enqueue(self, user_id, stream, mode=ingest.DEFAULT_MODE):
+        """Copy the upload to disk and queue it. Returns the job id."""
+        job_id = uuid.uuid4().hex
+        path = self.spool_path(job_id)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(stream, f, ingest.CHUNK_SIZE)
+        with closing(self._connect()) as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, user_id, path, mode, status, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, user_id, path, mode, 'queued', time.time())
+            )
+        return job_id
+
+    def claim(self, worker):
+        """Atomically take the oldest queued (or abandoned) job."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND lease_until < ?) "
+                'ORDER BY created_at LIMIT 1',
+                (now,)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            if row['attempts'] >= MAX_ATTEMPTS:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                    ('Gave up after repeated worker failures', now, row['id'])
+                )
+                conn.execute('COMMIT')
+                _remove_spool(row['path'])
+                return self.claim(worker)
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, "
+                'attempts = attempts + 1, started_at = COALESCE(started_at, ?) WHERE id = ?',
+                (worker, now + LEASE_SECONDS, now, row['id'])
+            )
+            conn.execute('COMMIT')
+            return self.get(row['id'])
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def renew(self, job_id, worker):
+        """Extend the lease; False when another worker owns the job now."""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + LEASE_SECONDS, job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def save_progress(self, job_id, worker, stats):
+        """Store a progress snapshot and extend the lease; False if the lease was lost."""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET stats = ?, lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (json.dumps(stats), time.time() + LEASE_SECONDS, job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def finish(self, job_id, status, stats, error=None, worker=None):
+        """Record the outcome and drop the spooled upload.
+
+        With ``worker``, only if that worker still owns the job; returns
+        whether the job was updated.
+        """
+        query = 'UPDATE jobs SET status = ?, stats = ?, error = ?, finished_at = ?, lease_until = NULL WHERE id = ?'
+        params = [status, json.dumps(stats), error, time.time(), job_id]
+        if worker is not None:
+            query += ' AND worker = ?'
+            params.append(worker)
+        with closing(self._connect()) as conn:
+            finished = conn.execute(query, params).rowcount == 1
+        if finished:
+            _remove_spool(self.spool_path(job_id))
+        return finished
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['stats'] = json.loads(job['stats'] or '{}')
+        return job
+
+
+def _remove_spool(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def job_status(job):
+    """Public view of a job for the status endpoint."""
+    stats = job['stats']
+    end = job['finished_at'] or time.time()
+    elapsed = (end - job['started_at']) if job['started_at'] else 0
+    received = stats.get('received', 0)
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'received': received,
+        'normalized': stats.get('normalized', 0),
+        'inserted': stats.get('inserted', 0),
+        'updated': stats.get('updated', 0),
+        'skipped': stats.get('skipped', 0),
+        'collapsed': stats.get('collapsed', 0),
+        'mode': job['mode'],
+        'rejected': stats.get('rejected', 0),
+        'rejected_rows': stats.get('rejected_rows', []),
+        'batches': stats.get('batches', 0),
+        'bytes': stats.get('bytes'),
+        'attempts': job['attempts'],
+        'elapsed_s': round(elapsed, 3),
+        'records_per_s': round(received / elapsed, 1) if elapsed > 0 else None,
+        'error': job['error'],
+    }
+
+
+def run_job(store, job, worker, get_db, batch_size, snapshot_root=None):
+    """Process one claimed job, resuming from its last committed batch."""
+    def before_write():
+        # A worker that stalled past its lease must not write batches the new owner will write again
+        if not store.renew(job['id'], worker):
+            raise LeaseLost(job['id'])
+
+    def on_batch(stats):
+        if not store.save_progress(job['id'], worker, stats):
+            raise LeaseLost(job['id'])
+
+    def rows_overwritten():
+        # Overwritten rows cannot be applied incrementally to rollups or snapshots
+        rollups.invalidate(get_db(), job['user_id'])
+        if snapshot_root:
+            snapshots.mark_stale(snapshots.user_dir(snapshot_root, job['user_id']))
+
+    def on_insert(docs):
+        if snapshot_root:
+            snapshots.append(snapshots.user_dir(snapshot_root, job['user_id']), docs)
+        rollups.record(get_db(), job['user_id'], docs)
+        versions.bump(get_db(), job['user_id'])
+
+    # A retried job may replay a batch an earlier attempt wrote without saving
+    # progress; those rows are skipped, so rebuild rollups/snapshots instead of
+    # relying on on_insert for them
+    resumed = job['attempts'] > 1
+    try:
+        with open(job['path'], 'rb') as f:
+            stats = ingest.ingest_stream(
+                f, job['user_id'], get_db, batch_size,
+                stats=job['stats'], on_batch=on_batch, mode=job['mode'], on_insert=on_insert,
+                before_write=before_write, row_key=f"job:{job['id']}"
+            )
+    except LeaseLost:
+        return
+    except ingest.InvalidPayload as e:
+        stats = getattr(e, 'stats', None) or job['stats']
+        if stats.get('updated') or resumed:
+            rows_overwritten()
+        if 'db_error' in stats:
+            # Retry from the last committed batch, as for a valid body
+            raise RuntimeError(stats['db_error'])
+        # 'partial': the records before the invalid JSON were stored
+        store.finish(job['id'], 'partial' if stats.get('batches') else 'failed', stats, str(e), worker=worker)
+        return
+    if stats.get('updated') or resumed:
+        rows_overwritten()
+    if 'db_error' in stats:
+        # Progress stays at the last committed batch; the job becomes
+        # claimable again once the lease runs out
+        raise RuntimeError(stats['db_error'])
+    store.finish(job['id'], 'completed', stats, worker=worker)
+
+
+def worker_loop(app, worker=None, once=False):
+    """Claim and run jobs until stopped (or until the queue is empty with once=True)."""
+    from database import get_db
+
+    worker = worker or f'{os.uname().nodename}:{os.getpid()}'
+    store = JobStore(jobs_dir(app.config))
+    batch_size = app.config.get('UPLOAD_BATCH_SIZE', ingest.BATCH_SIZE)
+    snapshot_root = snapshots.snapshot_root(app.config)
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    while not stopping:
+        job = store.claim(worker)
+        if job is None:
+            if once:
+                return
+            time.sleep(POLL_SECONDS)
+            continue
+        with app.app_context():
+            try:
+                run_job(store, job, worker, get_db, batch_size, snapshot_root)
+            except Exception as e:
+                app.logger.error(f"Ingest job {job['id']} failed: {e}")
+                time.sleep(POLL_SECONDS)
+
+
+def _worker_main(app):
+    worker_loop(app)
+
+
+def start_worker_pool(app, processes):
+    """Start ingest worker processes; returns the Process objects."""
+    ctx = multiprocessing.get_context('fork')
+    pool = []
+    for _ in range(processes):
+        proc = ctx.Process(target=_worker_main, args=(app,), daemon=True)
+        proc.start()
+        pool.append(proc)
+    return pool
+
+
+def _claim_pool_lock(directory):
+    """Only one web process per host starts the embedded worker pool."""
+    import fcntl
+    os.makedirs(directory, exist_ok=True)
+    handle = open(os.path.join(directory, 'workers.lock'), 'w')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def init_app(app):
+    @app.cli.command('ingest-worker')
+    @click.option('--processes', '-p', default=1, show_default=True, help='Worker processes to run.')
+    def ingest_worker(processes):
+        """Run background workers for queued transaction uploads."""
+        if processes <= 1:
+            worker_loop(app)
+            return
+        pool = start_worker_pool(app, processes)
+        try:
+            for proc in pool:
+                proc.join()
+        except KeyboardInterrupt:
+            for proc in pool:
+                proc.terminate()
+
+    processes = app.config.get('INGEST_WORKERS', 0)
+    if processes:
+        lock = _claim_pool_lock(jobs_dir(app.config))
+        if lock is not None:
+            app.extensions['ingest_pool'] = (lock, start_worker_pool(app, processes))
@@ -0,0 +1,73 @@
+"""App-wide JSON provider that understands BSON and NumPy types.
+
+MongoDB documents can be passed straight to ``jsonify``: ObjectId becomes its
+hex string, datetimes become ISO 8601 UTC strings ending in ``Z`` (naive
+datetimes from PyMongo are UTC), Decimal128/Decimal become floats and NumPy
+scalars/arrays become plain numbers/lists. Everything is encoded in a single
+pass through the public ``dumps``/``default`` provider hooks, using ``orjson``
+when it is installed and the standard library otherwise.
+"""
+import datetime
+import decimal
+
+import numpy as np
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _isoformat(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value.isoformat() + 'Z'
+
+
+def encode_default(o):
+    """Fallback encoder for types the JSON backends do not know."""
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, datetime.datetime):
+        return _isoformat(o)
+    if isinstance(o, datetime.date):
+        return o.isoformat()
+    if isinstance(o, Decimal128):
+        return float(o.to_decimal())
+    if isinstance(o, decimal.Decimal):
+        return float(o)
+    if isinstance(o, np.generic):
+        if isinstance(o, np.datetime64):
+            return None if np.isnat(o) else _isoformat(o.astype('datetime64[us]').item())
+        return o.item()
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+class BSONJSONProvider(DefaultJSONProvider):
+    default = staticmethod(encode_default)
+
+    def dumps(self, obj, **kwargs):
+        """Serialize ``obj``; compact output goes through orjson when available."""
+        if orjson is None or kwargs.get('indent') is not None or kwargs.get('cls') is not None:
+            return super().dumps(obj, **kwargs)
+        sort_keys = kwargs.get('sort_keys', self.sort_keys)
+        option = _ORJSON_OPTIONS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=kwargs.get('default', encode_default), option=option).decode('utf-8')
+
+
+def init_app(app):
+    app.json_provider_class = BSONJSONProvider
+    app.json = BSONJSONProvider(app)
@@ -1,6 +1,12 @@
 from functools import wraps
 from flask import request, jsonify, g, current_app
+from database import get_db
+import cache
+import datetime
+from zoneinfo import ZoneInfo
 import jwt
+import singleflight
+import versions
 
 def token_required(f):
     @wraps(f)
@@ -29,3 +35,112 @@ def token_required(f):
         return f(*args, **kwargs)
 
     return decorated
+
+
+def _etag_dates():
+    """Today in UTC and, for ?tz= requests, in that zone (local windows roll over at local midnight)."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    dates = [now.strftime('%Y-%m-%d')]
+    if 'tz' in request.args:
+        try:
+            dates.append(now.astimezone(ZoneInfo(request.args['tz'])).strftime('%Y-%m-%d'))
+        except Exception:
+            # The view rejects unknown zones
+            pass
+    return dates
+
+
+def conditional_get(f):
+    """Answer 304 when the caller already has this user's current data.
+
+    Must run after ``token_required``. The ETag covers the user's data
+    version (including the global one, see versions.py), the URL (path and
+    query) and the current date (UTC, and local for ``?tz=``), since
+    month-relative panels and default chart windows move with it. Views
+    that fall back to a degraded body set ``g.no_cache``; it is sent without
+    a tag (and not cached).
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if request.method != 'GET':
+            return f(*args, **kwargs)
+        # Read the version before computing: a write racing with this request
+        # leaves the response tagged with the older version, never the reverse
+        try:
+            version = versions.current(get_db(), g.user_id)
+        except Exception:
+            version = None
+        if version is None:
+            # No trustworthy version: serve fresh data without a tag (or cache entry)
+            return f(*args, **kwargs)
+        tag = versions.etag(g.user_id, version, request.full_path, *_etag_dates())
+        g.data_version, g.etag = version, tag
+        if request.if_none_match.contains_weak(tag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code != 200 or g.get('no_cache'):
+                return response
+        response.set_etag(tag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    return decorated
+
+
+def cached_result(ttl=None):
+    """Serve repeated JSON reads from the result cache and coalesce concurrent ones.
+
+    Must run inside ``conditional_get``, whose ETag (user, data version, URL,
+    month) is the cache key, so writes never serve stale results. Identical
+    requests arriving while the result is being computed wait for that
+    computation (see singleflight.py) instead of starting another.
+    """
+    def wrap(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            results = cache.get_cache(current_app)
+            flights = singleflight.get_flights(current_app)
+            tag = g.get('etag')
+            if tag is None:
+                return f(*args, **kwargs)
+            key = cache.cache_key(g.user_id, tag)
+            if results is not None:
+                body = results.get(key)
+                if body is not None:
+                    return current_app.response_class(body, mimetype='application/json')
+
+            def compute():
+                response = current_app.make_response(f(*args, **kwargs))
+                body = response.get_data()
+                no_cache = bool(g.get('no_cache'))
+                if (results is not None and response.status_code == 200 and response.mimetype == 'application/json'
+                        and not no_cache):
+                    results.set(key, g.user_id, body, ttl)
+                # Keep headers the view set itself (e.g. Retry-After)
+                headers = [(name, value) for name, value in response.headers
+                           if name not in ('Content-Type', 'Content-Length')]
+                return response.status_code, body, response.mimetype, headers, no_cache
+
+            def lookup():
+                try:
+                    body = results.shared.get(key)
+                except Exception:
+                    return None
+                return (200, body, 'application/json', [], False) if body is not None else None
+
+            if flights is None:
+                status, body, mimetype, headers, no_cache = compute()
+            elif results is not None and results.shared is not None:
+                status, body, mimetype, headers, no_cache = flights.do(key, compute, shared=results, lookup=lookup)
+            else:
+                status, body, mimetype, headers, no_cache = flights.do(key, compute)
+            # Waiters share the leader's body, so they share its degraded flag too
+            if no_cache:
+                g.no_cache = True
+            # Every caller gets its own response object (after_request hooks mutate headers)
+            return current_app.response_class(body, status=status, mimetype=mimetype, headers=headers)
+
+        return decorated
+
+    return wrap
@@ -0,0 +1,328 @@
+"""Versioned database migrations (indexes and data backfills).
+
+Run from the CLI with ``flask --app app db-migrate`` or automatically at
+start-up when ``MONGO_AUTO_MIGRATE=true``. Applied versions are recorded in
+the ``schema_migrations`` collection so every step runs exactly once.
+"""
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+import classify
+import click
+import rollups
+import versions
+import datetime
+import threading
+import time
+
+MIGRATIONS_COLLECTION = 'schema_migrations'
+
+
+# Index manifest: each entry matches a query shape used by the routes.
+INDEXES_V1 = [
+    # /api/transactions default listing, forecast, export, dashboard summary
+    # (dropped by version 3, whose covering index starts with the same keys)
+    ('transactions', [('user_id', ASCENDING), ('date', DESCENDING)], {'name': 'user_date'}),
+    # category filters, wallet history ($in wallet_add/withdraw sorted by date),
+    # analytics top expenses / month spend
+    ('transactions', [('user_id', ASCENDING), ('category', ASCENDING), ('date', DESCENDING)], {'name': 'user_category_date'}),
+    # status filter on listing and line chart
+    ('transactions', [('user_id', ASCENDING), ('status', ASCENDING), ('date', DESCENDING)], {'name': 'user_status_date'}),
+    # amountMin/amountMax filters and sortBy=amount
+    ('transactions', [('user_id', ASCENDING), ('amount', ASCENDING)], {'name': 'user_amount'}),
+    # auth register/login/verify
+    ('users', [('email', ASCENDING)], {'name': 'email_unique', 'unique': True}),
+]
+
+
+INDEXES_V2 = [
+    # Deduplicating uploads upsert on (user_id, fingerprint); rows written
+    # before fingerprints existed (and wallet rows) are left out of the index
+    ('transactions', [('user_id', ASCENDING), ('fingerprint', ASCENDING)], {
+        'name': 'user_fingerprint_unique',
+        'unique': True,
+        'partialFilterExpression': {'fingerprint': {'$exists': True}},
+    }),
+]
+
+
+def create_indexes(specs):
+    """Build a migration step that creates the given indexes."""
+    def step(db, log):
+        total = len(specs)
+        for i, (collection, keys, options) in enumerate(specs, start=1):
+            log(f"[{i}/{total}] {collection}.{options.get('name')} {keys}")
+            _create_index_with_progress(db, collection, keys, options, log)
+    return step
+
+
+INDEXES_V3 = [
+    # Covers table views (?fields= any of date,amount,category,type,status,_id)
+    # of the default listing, keyset paging on (date, _id) and wallet history;
+    # its (user_id, date) prefix also serves everything user_date did
+    ('transactions', [
+        ('user_id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING),
+        ('amount', ASCENDING), ('category', ASCENDING), ('type', ASCENDING), ('status', ASCENDING),
+    ], {'name': 'user_date_list_covering'}),
+]
+# Made redundant by the covering index; dropping it saves a write per insert
+SUPERSEDED_V3 = ('transactions', ['user_date'])
+
+
+def drop_indexes(collection, names):
+    """Build a migration step that drops the given indexes if they exist."""
+    def step(db, log):
+        existing = db[collection].index_information()
+        for name in names:
+            if name in existing:
+                log(f"    dropping {collection}.{name}")
+                db[collection].drop_index(name)
+    return step
+
+
+def steps(*parts):
+    def step(db, log):
+        for part in parts:
+            part(db, log)
+    return step
+
+
+INDEXES_V4 = [
+    # One materialized row per user/month/category/type/status (rollups.py)
+    ('monthly_rollups', [
+        ('user_id', ASCENDING), ('year', ASCENDING), ('month', ASCENDING),
+        ('category', ASCENDING), ('type', ASCENDING), ('status', ASCENDING),
+    ], {'name': 'user_month_key_unique', 'unique': True}),
+]
+
+
+def backfill_classification(batch_size=1000):
+    """Store canonical amount and is_expense/direction on older transactions.
+
+    Only documents without ``is_expense`` are visited, in _id order, so an
+    interrupted run simply continues where it stopped.
+    """
+    def step(db, log):
+        pending = {'is_expense': {'$exists': False}}
+        total = db.transactions.count_documents(pending)
+        done = 0
+        last_id = None
+        fields = {'amount': 1, 'type': 1, 'category': 1}
+        while True:
+            query = pending if last_id is None else {**pending, '_id': {'$gt': last_id}}
+            batch = list(db.transactions.find(query, fields).sort('_id', ASCENDING).limit(batch_size))
+            if not batch:
+                break
+            ops = []
+            for doc in batch:
+                before = doc.get('amount')
+                classify.classify(doc)
+                changes = {'is_expense': doc['is_expense'], 'direction': doc['direction']}
+                if type(doc.get('amount')) is not type(before):
+                    # Numeric strings and ints become floats
+                    changes['amount'] = doc['amount']
+                ops.append(UpdateOne({'_id': doc['_id']}, {'$set': changes}))
+            db.transactions.bulk_write(ops, ordered=False)
+            done += len(batch)
+            last_id = batch[-1]['_id']
+            log(f"    classified {done}/{total}")
+        # Rollups were built with the old rule; rebuild them on next read
+        rollups.invalidate(db)
+    return step
+
+
+INDEXES_V7 = [
+    # Rollup rows are keyed by build generation too: a rebuild writes its
+    # generation next to the live one before switching over (rollups.py)
+    ('monthly_rollups', [
+        ('user_id', ASCENDING), ('gen', ASCENDING), ('year', ASCENDING), ('month', ASCENDING),
+        ('category', ASCENDING), ('type', ASCENDING), ('status', ASCENDING),
+    ], {'name': 'user_gen_month_key_unique', 'unique': True}),
+]
+SUPERSEDED_V7 = ('monthly_rollups', ['user_month_key_unique'])
+# Created by earlier runs of version 5; no query filters transactions on is_expense
+UNUSED_V8 = ('transactions', ['user_expense_date'])
+
+
+def clear_rollups(db, log):
+    """Drop rollup rows and status; every user rebuilds on next read."""
+    log(f"    clearing {db[rollups.ROLLUPS].count_documents({})} rollup rows")
+    db[rollups.ROLLUPS].delete_many({})
+    db[rollups.STATUS].delete_many({})
+    versions.bump_all(db)
+
+
+# (version, description, step(db, log))
+MIGRATIONS = [
+    (1, 'Create transactions and users indexes', create_indexes(INDEXES_V1)),
+    (2, 'Create unique upload fingerprint index', create_indexes(INDEXES_V2)),
+    (3, 'Create covering index for list views', steps(create_indexes(INDEXES_V3), drop_indexes(*SUPERSEDED_V3))),
+    (4, 'Create monthly rollups index', create_indexes(INDEXES_V4)),
+    (5, 'Backfill canonical amounts and expense classification', backfill_classification()),
+    # Databases that applied version 3 before it dropped user_date
+    (6, 'Drop index superseded by the covering list index', drop_indexes(*SUPERSEDED_V3)),
+    (7, 'Key monthly rollups by build generation',
+     steps(clear_rollups, drop_indexes(*SUPERSEDED_V7), create_indexes(INDEXES_V7))),
+    (8, 'Drop unused expense index', drop_indexes(*UNUSED_V8)),
+]
+
+
+def _index_build_progress(db, collection):
+    """Return (done, total) for an in-flight index build, if visible."""
+    try:
+        ops = db.client.admin.aggregate([
+            {'$currentOp': {}},
+            {'$match': {'command.createIndexes': collection, 'ns': {'$regex': f'^{db.name}\\.'}}},
+        ])
+        for op in ops:
+            progress = op.get('progress') or {}
+            if progress.get('total'):
+                return progress.get('done', 0), progress['total']
+    except Exception:
+        # $currentOp needs extra privileges on shared clusters
+        pass
+    return None
+
+
+def _create_index_with_progress(db, collection, keys, options, log, poll_seconds=2.0):
+    """Create an index, logging build progress while the server works on it."""
+    outcome = {}
+
+    def build():
+        try:
+            outcome['name'] = db[collection].create_index(keys, **options)
+        except Exception as e:
+            outcome['error'] = e
+
+    started = time.perf_counter()
+    worker = threading.Thread(target=build, daemon=True)
+    worker.start()
+    while True:
+        worker.join(poll_seconds)
+        if not worker.is_alive():
+            break
+        progress = _index_build_progress(db, collection)
+        elapsed = time.perf_counter() - started
+        if progress:
+            done, total = progress
+            log(f"    building... {done}/{total} ({done * 100 // max(total, 1)}%) after {elapsed:.1f}s")
+        else:
+            log(f"    building... {elapsed:.1f}s elapsed")
+
+    if 'error' in outcome:
+        raise outcome['error']
+    log(f"    done in {time.perf_counter() - started:.2f}s")
+    return outcome['name']
+
+
+def applied_versions(db):
+    return {doc['_id'] for doc in db[MIGRATIONS_COLLECTION].find({}, {'_id': 1})}
+
+
+def run_migrations(db, log=print, target=None):
+    """Apply pending migrations in order. Returns the list of applied versions."""
+    done = applied_versions(db)
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version in done:
+            continue
+        if target is not None and version > target:
+            break
+        log(f"Applying migration {version}: {description}")
+        started = time.perf_counter()
+        step(db, log)
+        try:
+            db[MIGRATIONS_COLLECTION].insert_one({
+                '_id': version,
+                'description': description,
+                'applied_at': datetime.datetime.utcnow(),
+                'duration_s': round(time.perf_counter() - started, 3),
+            })
+        except DuplicateKeyError:
+            # Another worker finished the same (idempotent) step first
+            pass
+        applied.append(version)
+    if not applied:
+        log('Database is up to date')
+    return applied
+
+
+# Representative query shapes issued by the routes:
+# (label, collection, filter, sort, projection)
+TABLE_VIEW = {'date': 1, 'amount': 1, 'category': 1, 'type': 1, '_id': 0}
+QUERY_SHAPES = [
+    ('transactions list', 'transactions', {'user_id': '__user__'}, [('date', 1)], None),
+    ('transactions table view', 'transactions', {'user_id': '__user__'}, [('date', -1)], TABLE_VIEW),
+    ('transactions by category', 'transactions', {'user_id': '__user__', 'category': 'food'}, [('date', 1)], None),
+    ('transactions by status', 'transactions', {'user_id': '__user__', 'status': 'completed'}, [('date', 1)], None),
+    ('transactions by amount', 'transactions', {'user_id': '__user__', 'amount': {'$gte': 0}}, [('amount', 1)], None),
+    ('wallet history', 'transactions', {'user_id': '__user__', 'category': {'$in': ['wallet_add', 'wallet_withdraw']}}, [('date', -1)], None),
+    ('login by email', 'users', {'email': '__email__'}, None, None),
+]
+
+
+def _plan_stages(plan):
+    """Yield every stage name in an explain plan tree."""
+    if not isinstance(plan, dict):
+        return
+    if 'stage' in plan:
+        yield plan['stage']
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get('inputStages', []):
+        yield from _plan_stages(child)
+
+
+def explain_query_shapes(db, user_id='000000000000000000000000', email='nobody@example.com'):
+    """Explain each known query shape and flag the ones that use a COLLSCAN.
+
+    ``covered`` is true when the plan reads the index only (no FETCH stage).
+    """
+    report = []
+    for label, collection, query, sort, fields in QUERY_SHAPES:
+        query = {
+            k: (user_id if v == '__user__' else email if v == '__email__' else v)
+            for k, v in query.items()
+        }
+        cursor = db[collection].find(query, fields)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain().get('queryPlanner', {}).get('winningPlan', {})
+        stages = list(_plan_stages(plan))
+        report.append({
+            'query': label,
+            'collection': collection,
+            'stages': stages,
+            'collscan': 'COLLSCAN' in stages,
+            'covered': 'IXSCAN' in stages and 'FETCH' not in stages,
+        })
+    return report
+
+
+def init_app(app):
+    from database import get_db
+
+    @app.cli.command('db-migrate')
+    @click.option('--target', type=int, default=None, help='Stop after this version.')
+    def db_migrate(target):
+        """Apply pending index/data migrations."""
+        run_migrations(get_db(), log=click.echo, target=target)
+
+    @app.cli.command('db-explain')
+    @click.option('--user-id', default='000000000000000000000000')
+    def db_explain(user_id):
+        """Explain hot queries and flag any COLLSCAN."""
+        flagged = 0
+        for row in explain_query_shapes(get_db(), user_id=user_id):
+            marker = 'COLLSCAN' if row['collscan'] else 'covered' if row['covered'] else 'ok'
+            flagged += row['collscan']
+            click.echo(f"{marker:9} {row['query']:28} {' <- '.join(row['stages'])}")
+        if flagged:
+            raise SystemExit(1)
+
+    if app.config.get('MONGO_AUTO_MIGRATE'):
+        with app.app_context():
+            try:
+                run_migrations(get_db(), log=app.logger.info)
+            except Exception as e:
+                app.logger.error(f"Startup migrations failed: {e}")
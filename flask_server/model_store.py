@@ -0,0 +1,122 @@
+"""On-disk cache of trained forecast models.
+
+Each model is one ``.npz`` archive under ``UPLOAD_FOLDER/forecast_models``
+named by ``model_key``, a hash of the monthly series it was trained on and
+of the model configuration. An unchanged history reuses its model; new data
+or a config change trains a new one. When the archives together exceed
+``FORECAST_MODEL_CACHE_BYTES`` the least recently used ones are deleted.
+Archives are written to a temporary file and renamed, so every worker on the
+host can share the directory.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def model_key(values, config):
+    digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(values, dtype='<f8').tobytes())
+    return digest.hexdigest()
+
+
+class ModelStore:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'saves': 0, 'evictions': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, key):
+        """The archive stored under ``key`` (dict of arrays), or None."""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                archive = {name: data[name] for name in data.files}
+            # The modification time orders eviction
+            os.utime(path)
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        except Exception:
+            # Truncated or unreadable: drop it and retrain
+            self._count('errors')
+            self._remove(path)
+            return None
+        self._count('hits')
+        return archive
+
+    def save(self, key, archive):
+        """Store an archive; failures are counted, never raised."""
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as handle:
+                np.savez(handle, **archive)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            self._count('errors')
+            if tmp:
+                self._remove(tmp)
+            return
+        self._count('saves')
+        self._evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        # Least recently used first
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            self._count('evictions')
+
+    def info(self):
+        entries = self._entries()
+        with self._lock:
+            stats = dict(self.stats)
+        return {'models': len(entries), 'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes, **stats}
+
+
+def get_store(app):
+    return app.extensions.get('model_store')
+
+
+def init_app(app):
+    app.extensions['model_store'] = ModelStore(
+        os.path.join(app.config.get('UPLOAD_FOLDER', 'uploads'), 'forecast_models'),
+        max_bytes=app.config.get('FORECAST_MODEL_CACHE_BYTES', DEFAULT_MAX_BYTES),
+    )
@@ -0,0 +1,27 @@
+"""Sparse fieldsets: turn a ``fields=`` query parameter into a Mongo projection."""
+import re
+
+FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+MAX_FIELDS = 32
+
+
+def parse_fields(value, required=()):
+    """Projection for a comma separated field list, or None for whole documents.
+
+    ``_id`` is only returned when it is asked for (or required), so MongoDB can
+    answer from an index alone when every projected field is part of it.
+    ``required`` fields are always included, e.g. the keys a cursor is built
+    from. Raises ValueError for malformed names.
+    """
+    if value is None or not value.strip():
+        return None
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    if len(names) > MAX_FIELDS:
+        raise ValueError(f'At most {MAX_FIELDS} fields may be requested')
+    invalid = [name for name in names if not FIELD_NAME.match(name)]
+    if invalid:
+        raise ValueError(f"Invalid field name(s): {', '.join(invalid)}")
+    projection = {name: 1 for name in [*names, *required]}
+    if '_id' not in projection:
+        projection['_id'] = 0
+    return projection
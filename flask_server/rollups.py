@@ -0,0 +1,188 @@
+"""Materialized per-user monthly rollups of transactions.
+
+``monthly_rollups`` holds one row per (user_id, year, month, category, type,
+status) with the revenue, expenses and count of the matching transactions, so
+the dashboard and analytics endpoints read a few dozen rows instead of
+aggregating a user's whole history.
+
+Writers call ``record`` with the documents they inserted. A user's rows are
+only trusted once ``rollup_status`` marks them ready: ``ensure`` builds them
+from ``transactions`` on first read, and anything that cannot be applied
+incrementally (a failed update, upload rows overwritten in ``update`` mode)
+calls ``invalidate`` so the next read rebuilds. ``flask --app app
+rollup-rebuild`` rebuilds everything.
+
+Rows carry the generation of the build that produced them and readers only
+see the user's current one (``ensure`` returns the filter). A rebuild writes
+a new generation next to the live rows and switches to it only if no write
+touched the user while it scanned (``writes`` in ``rollup_status`` counts
+them); otherwise it discards its rows and scans again. So a rebuild never
+drops an increment, never misses rows inserted during its scan, and readers
+never see a half-built set.
+"""
+import datetime
+
+import click
+from flask import current_app
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+
+import classify
+import versions
+
+ROLLUPS = 'monthly_rollups'
+STATUS = 'rollup_status'
+KEY_FIELDS = ('year', 'month', 'category', 'type', 'status')
+
+# Scans retried when writes keep landing during a rebuild
+REBUILD_ATTEMPTS = 3
+
+MONTHS = [None, 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def _year_month(value):
+    if not isinstance(value, datetime.datetime):
+        return None, None
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    return value.year, value.month
+
+
+def month_label(year, month):
+    return f'{MONTHS[month]} {year}'
+
+
+def _row_id(user_id, gen, key):
+    return {'user_id': user_id, 'gen': gen, **dict(zip(KEY_FIELDS, key))}
+
+
+def summarize(docs):
+    """Group transaction documents into {key: [revenue, expenses, count]}."""
+    totals = {}
+    for doc in docs:
+        year, month = _year_month(doc.get('date'))
+        key = (year, month, doc.get('category'), doc.get('type'), doc.get('status'))
+        row = totals.setdefault(key, [0.0, 0.0, 0])
+        amount = classify.to_amount(doc.get('amount')) or 0.0
+        if classify.stored_is_expense(doc):
+            row[1] += abs(amount)
+        else:
+            row[0] += amount
+        row[2] += 1
+    return totals
+
+
+def is_ready(db, user_id):
+    doc = db[STATUS].find_one({'_id': user_id}, {'ready': 1})
+    return bool(doc and doc.get('ready'))
+
+
+def invalidate(db, user_id=None):
+    """Stop trusting a user's (or everyone's) rollups until they are rebuilt.
+
+    The rebuilt numbers can differ from what was served, so this also bumps
+    the data version behind conditional GETs.
+    """
+    # Counting this as a write also stops a rebuild in progress from going live
+    update = {'$set': {'ready': False}, '$inc': {'writes': 1}}
+    if user_id is None:
+        db[STATUS].update_many({}, update)
+        versions.bump_all(db)
+    else:
+        db[STATUS].update_one({'_id': user_id}, update)
+        versions.bump(db, user_id)
+
+
+def apply(db, user_id, docs):
+    """Add freshly inserted documents to the user's rollups."""
+    if not docs:
+        return
+    status = db[STATUS].find_one_and_update(
+        {'_id': user_id}, {'$inc': {'writes': 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    if not status.get('ready'):
+        # Not built yet: the first read builds from the transactions themselves
+        return
+    ops = [
+        UpdateOne(_row_id(user_id, status['gen'], key),
+                  {'$inc': {'revenue': revenue, 'expenses': expenses, 'count': count}}, upsert=True)
+        for key, (revenue, expenses, count) in summarize(docs).items()
+    ]
+    db[ROLLUPS].bulk_write(ops, ordered=False)
+
+
+def record(db, user_id, docs):
+    """Apply inserted documents; never fails the calling request."""
+    try:
+        apply(db, user_id, docs)
+    except Exception as e:
+        current_app.logger.warning(f"Rollup update failed for {user_id}: {e}")
+        try:
+            invalidate(db, user_id)
+        except Exception:
+            pass
+
+
+def _build(db, user_id):
+    """Build a new generation; returns (gen, rows, live)."""
+    status = db[STATUS].find_one_and_update(
+        {'_id': user_id}, {'$inc': {'next_gen': 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    gen = status['next_gen']
+    writes = status.get('writes')
+    # Same rules as the incremental path, applied to a streamed projection
+    cursor = db.transactions.find(
+        {'user_id': user_id}, {'_id': 0, 'date': 1, 'amount': 1, 'category': 1, 'type': 1, 'status': 1, 'is_expense': 1}
+    ).batch_size(5000)
+    ops = []
+    for key, (revenue, expenses, count) in summarize(cursor).items():
+        ops.append(InsertOne({**_row_id(user_id, gen, key), 'revenue': revenue, 'expenses': expenses, 'count': count}))
+    if ops:
+        db[ROLLUPS].bulk_write(ops, ordered=False)
+    # Go live only if nothing was written meanwhile and no newer build went live first
+    live = db[STATUS].update_one(
+        {'_id': user_id, 'writes': writes, '$or': [{'gen': {'$lt': gen}}, {'gen': {'$exists': False}}]},
+        {'$set': {'gen': gen, 'ready': True, 'built_at': datetime.datetime.utcnow()}},
+    ).modified_count == 1
+    if live:
+        db[ROLLUPS].delete_many({'user_id': user_id, 'gen': {'$not': {'$gte': gen}}})
+    return gen, len(ops), live
+
+
+def rebuild(db, user_id):
+    """Recompute a user's rollups from the transactions collection.
+
+    Returns the selector of the built rows (see ``ensure``) and their count.
+    When writes kept arriving through every attempt, the last build is
+    returned without going live; the next read tries again.
+    """
+    for attempt in range(REBUILD_ATTEMPTS):
+        gen, rows, live = _build(db, user_id)
+        if live or attempt == REBUILD_ATTEMPTS - 1:
+            break
+        db[ROLLUPS].delete_many({'user_id': user_id, 'gen': gen})
+    return {'user_id': user_id, 'gen': gen}, rows
+
+
+def ensure(db, user_id):
+    """Filter selecting the user's current rollup rows, building them if needed."""
+    doc = db[STATUS].find_one({'_id': user_id}, {'ready': 1, 'gen': 1})
+    if doc and doc.get('ready'):
+        return {'user_id': user_id, 'gen': doc['gen']}
+    return rebuild(db, user_id)[0]
+
+
+def rows(db, user_id, **filters):
+    """The user's rollup rows (built on demand), optionally filtered by key fields."""
+    return list(db[ROLLUPS].find({**ensure(db, user_id), **filters}, {'_id': 0}))
+
+
+def init_app(app):
+    from database import get_db
+
+    @app.cli.command('rollup-rebuild')
+    @click.option('--user-id', default=None, help='Only rebuild this user.')
+    def rollup_rebuild(user_id):
+        """Rebuild monthly transaction rollups from MongoDB."""
+        db = get_db()
+        for uid in [user_id] if user_id else db.transactions.distinct('user_id'):
+            click.echo(f'{uid}: {rebuild(db, uid)[1]} rows')
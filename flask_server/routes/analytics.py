@@ -1,104 +1,145 @@
-from flask import Blueprint, jsonify, g
+from flask import Blueprint, jsonify, g, request
 from database import get_db
-from middleware import token_required
+from middleware import token_required, conditional_get, cached_result
 from bson.objectid import ObjectId
 import datetime
 from dateutil.relativedelta import relativedelta
+import rollups
+import timeseries
+import downsample
 
 analytics_bp = Blueprint('analytics', __name__)
 
-EXPENSE_CATEGORIES = [
-    'rent', 'bills', 'groceries', 'travel', 'others', 'shopping', 'food', 
-    'utilities', 'transport', 'medical', 'entertainment', 'subscriptions', 
-    'education', 'emi', 'loan', 'insurance', 'tax', 'fuel', 'misc', 'expense'
-]
+PANELS = ['monthlyTrend', 'categoryBreakdown', 'topExpenses', 'spendChange']
 
-@analytics_bp.route('/api/analytics', methods=['GET'])
-@token_required
-def get_analytics_data():
-    db = get_db()
-    user_id = g.user_id
 
-    try:
-        # 1. Monthly Trend
-        monthly_trend_pipeline = [
-            {'$match': {'user_id': user_id}},
+def _from_month(year, month):
+    """Rollup rows for (year, month) and later."""
+    return {'$or': [{'year': {'$gt': year}}, {'year': year, 'month': {'$gte': month}}]}
+
+
+def _is_month(year, month):
+    return {'$and': [{'$eq': ['$year', year]}, {'$eq': ['$month', month]}]}
+
+
+def analytics_facets(panels, today):
+    """One $facet stage computing the requested panels from monthly rollups."""
+    this_month = (today.year, today.month)
+    last = today.replace(day=1) - relativedelta(months=1)
+    facets = {}
+    if 'monthlyTrend' in panels:
+        facets['monthlyTrend'] = [
+            {'$match': {'year': {'$ne': None}}},
             {'$group': {
-                '_id': {'year': {'$year': '$date'}, 'month': {'$month': '$date'}},
-                'revenue': {'$sum': {'$cond': [{'$not': [{'$in': ['$category', EXPENSE_CATEGORIES]}]}, '$amount', 0]}},
-                'expense': {'$sum': {'$cond': [{'$in': ['$category', EXPENSE_CATEGORIES]}, '$amount', 0]}}
+                '_id': {'year': '$year', 'month': '$month'},
+                'revenue': {'$sum': '$revenue'},
+                'expense': {'$sum': '$expenses'}
             }},
-            {'$sort': {'_id.year': 1, '_id.month': 1}},
-            {'$project': {
-                'month': {'$concat': [
-                    {'$let': {'vars': {'months': [None, 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']},
-                              'in': {'$arrayElemAt': ['$$months', '$_id.month']}}},
-                    ' ',
-                    {'$toString': '$_id.year'}
-                ]},
-                'revenue': '$revenue',
-                'expense': '$expense',
-                '_id': 0
-            }}
+            {'$sort': {'_id.year': 1, '_id.month': 1}}
         ]
-        monthly_trend = list(db.transactions.aggregate(monthly_trend_pipeline))
-
-        # 2. Category Breakdown
-        category_breakdown_pipeline = [
-            {'$match': {'user_id': user_id}},
-            {'$group': {'_id': '$category', 'amount': {'$sum': '$amount'}}},
+    if 'categoryBreakdown' in panels:
+        facets['categoryBreakdown'] = [
+            {'$group': {'_id': '$category', 'amount': {'$sum': {'$add': ['$revenue', '$expenses']}}}},
             {'$project': {'category': '$_id', 'amount': '$amount', '_id': 0}}
         ]
-        category_breakdown = list(db.transactions.aggregate(category_breakdown_pipeline))
-
-        # 3. Top Expenses (This Month)
-        today = datetime.datetime.utcnow()
-        start_of_month = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        top_expenses_pipeline = [
-            {'$match': {
-                'user_id': user_id,
-                'date': {'$gte': start_of_month},
-                'category': {'$in': EXPENSE_CATEGORIES}
-            }},
-            {'$group': {'_id': '$category', 'amount': {'$sum': '$amount'}}},
+    if 'topExpenses' in panels:
+        facets['topExpenses'] = [
+            {'$match': {'expenses': {'$gt': 0}, **_from_month(*this_month)}},
+            {'$group': {'_id': '$category', 'amount': {'$sum': '$expenses'}}},
             {'$sort': {'amount': -1}},
             {'$limit': 5},
             {'$project': {'category': '$_id', 'amount': '$amount', '_id': 0}}
         ]
-        top_expenses = list(db.transactions.aggregate(top_expenses_pipeline))
-
-        # 4. Spend Change
-        start_of_last_month = start_of_month - relativedelta(months=1)
-        end_of_last_month = start_of_month - relativedelta(seconds=1)
-        
-        this_month_spend_pipeline = [
-            {'$match': {'user_id': user_id, 'date': {'$gte': start_of_month}, 'category': {'$in': EXPENSE_CATEGORIES}}},
-            {'$group': {'_id': None, 'total': {'$sum': '$amount'}}}
-        ]
-        last_month_spend_pipeline = [
-            {'$match': {'user_id': user_id, 'date': {'$gte': start_of_last_month, '$lte': end_of_last_month}, 'category': {'$in': EXPENSE_CATEGORIES}}},
-            {'$group': {'_id': None, 'total': {'$sum': '$amount'}}}
+    if 'spendChange' in panels:
+        facets['spendChange'] = [
+            {'$match': {'expenses': {'$gt': 0}, **_from_month(last.year, last.month)}},
+            {'$group': {
+                '_id': None,
+                'last': {'$sum': {'$cond': [_is_month(last.year, last.month), '$expenses', 0]}},
+                'this': {'$sum': {'$cond': [_is_month(last.year, last.month), 0, '$expenses']}}
+            }}
         ]
+    return facets
+
+
+def spend_change(this_month_spend, last_month_spend):
+    if last_month_spend > 0:
+        percent_change = ((this_month_spend - last_month_spend) / last_month_spend) * 100
+        return {'percent': round(percent_change), 'more': percent_change > 0}
+    if this_month_spend > 0:
+        return {'percent': 100, 'more': True} # Infinite increase
+    return None
+
+
+@analytics_bp.route('/api/analytics', methods=['GET'])
+@token_required
+@conditional_get
+@cached_result()
+def get_analytics_data():
+    db = get_db()
+    user_id = g.user_id
+
+    # ?panels=monthlyTrend,topExpenses computes only those panels
+    panels = [p.strip() for p in request.args.get('panels', ','.join(PANELS)).split(',') if p.strip()]
+    unknown = [p for p in panels if p not in PANELS]
+    if unknown or not panels:
+        return jsonify({'error': f'panels must be a comma separated subset of {PANELS}'}), 400
+
+    # from/to/granularity/tz narrow and re-bucket the trend (see timeseries.py)
+    window = None
+    if timeseries.is_windowed(request.args):
+        try:
+            window = timeseries.parse_window(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    try:
+        max_points, method = downsample.parse_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        # A single pass over the user's monthly rollups (see rollups.py)
+        selector = rollups.ensure(db, user_id)
+        facet_panels = [p for p in panels if not (window and p == 'monthlyTrend')]
+        result = {}
+        if facet_panels:
+            pipeline = [
+                {'$match': selector},
+                {'$facet': analytics_facets(facet_panels, datetime.datetime.utcnow())}
+            ]
+            result = next(db[rollups.ROLLUPS].aggregate(pipeline), {})
 
-        this_month_result = list(db.transactions.aggregate(this_month_spend_pipeline))
-        last_month_result = list(db.transactions.aggregate(last_month_spend_pipeline))
-        
-        this_month_spend = this_month_result[0]['total'] if this_month_result else 0
-        last_month_spend = last_month_result[0]['total'] if last_month_result else 0
-
-        spend_change = None
-        if last_month_spend > 0:
-            percent_change = ((this_month_spend - last_month_spend) / last_month_spend) * 100
-            spend_change = {'percent': round(percent_change), 'more': percent_change > 0}
-        elif this_month_spend > 0:
-             spend_change = {'percent': 100, 'more': True} # Infinite increase
-
-        return jsonify({
-            'monthlyTrend': monthly_trend,
-            'categoryBreakdown': category_breakdown,
-            'topExpenses': top_expenses,
-            'spendChange': spend_change
-        })
+        body = {}
+        if window and 'monthlyTrend' in panels:
+            body['monthlyTrend'] = [
+                {
+                    'month': point['period'],
+                    'period': point['period'],
+                    'start': point['start'],
+                    'revenue': point['revenue'],
+                    'expense': point['expenses']
+                }
+                for point in timeseries.series(db, user_id, {}, window)
+            ]
+        elif 'monthlyTrend' in panels:
+            body['monthlyTrend'] = [
+                {
+                    'month': rollups.month_label(row['_id']['year'], row['_id']['month']),
+                    'revenue': row['revenue'],
+                    'expense': row['expense']
+                }
+                for row in result.get('monthlyTrend', [])
+            ]
+        if 'monthlyTrend' in body:
+            body['monthlyTrend'] = downsample.thin(body['monthlyTrend'], max_points, ('revenue', 'expense'), method)
+        if 'categoryBreakdown' in panels:
+            body['categoryBreakdown'] = result.get('categoryBreakdown', [])
+        if 'topExpenses' in panels:
+            body['topExpenses'] = result.get('topExpenses', [])
+        if 'spendChange' in panels:
+            totals = (result.get('spendChange') or [{}])[0]
+            body['spendChange'] = spend_change(totals.get('this', 0), totals.get('last', 0))
+        return jsonify(body)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
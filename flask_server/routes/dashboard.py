@@ -1,10 +1,13 @@
 from flask import Blueprint, jsonify, g, request, current_app
 from database import get_db
-from middleware import token_required
+from middleware import token_required, conditional_get, cached_result
 from bson.objectid import ObjectId
 import datetime
 import os
 import json
+import rollups
+import timeseries
+import downsample
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
@@ -14,69 +17,21 @@ def get_dashboard_data():
 
 @dashboard_bp.route('/api/dashboard/summary', methods=['GET'])
 @token_required
+@conditional_get
+@cached_result()
 def get_dashboard_summary():
     user_id = g.user_id
 
-    expense_categories = [
-        'rent', 'bills', 'groceries', 'travel', 'others', 'shopping', 'food', 
-        'utilities', 'transport', 'medical', 'entertainment', 'subscriptions', 
-        'education', 'emi', 'loan', 'insurance', 'tax', 'fuel', 'misc', 'expense'
-    ]
-
-    pipeline = [
-        {'$match': {'user_id': user_id}},
-        # Normalize fields for reliable aggregation
-        {'$addFields': {
-            'amountNum': {
-                '$cond': [
-                    {'$eq': [{'$type': '$amount'}, 'string']},
-                    {'$toDouble': {'$ifNull': ['$amount', 0]}},
-                    {'$ifNull': ['$amount', 0]}
-                ]
-            },
-            'isExpense': {
-                '$cond': [
-                    {'$eq': [{'$toLower': {'$ifNull': ['$type', '']}}, 'expense']},
-                    True,
-                    {'$in': [{'$toLower': {'$ifNull': ['$category', '']}}, expense_categories]}
-                ]
-            }
-        }},
-        {'$group': {
-            '_id': '$user_id',
-            'total_revenue': {
-                '$sum': {
-                    '$cond': [
-                        {'$eq': ['$isExpense', False]},
-                        '$amountNum',
-                        0
-                    ]
-                }
-            },
-            'total_expenses': {
-                '$sum': {
-                    '$cond': [
-                        {'$eq': ['$isExpense', True]},
-                        '$amountNum',
-                        0
-                    ]
-                }
-            },
-            'transaction_count': {'$sum': 1}
-        }}
-    ]
-
-    # Query MongoDB per-user only
+    # Totals come from the materialized monthly rollups (see rollups.py)
     try:
         db = get_db()
-        summary_data = list(db.transactions.aggregate(pipeline))
-        if summary_data:
-            data = summary_data[0]
-            revenue = data.get('total_revenue', 0)
-            expenses = data.get('total_expenses', 0)
+        rows = rollups.rows(db, user_id)
+        if rows:
+            revenue = sum(row['revenue'] for row in rows)
+            expenses = sum(row['expenses'] for row in rows)
             savings = revenue - expenses
             balance = savings # Assuming starting balance is 0
-            count = data.get('transaction_count', 0)
+            count = sum(row['count'] for row in rows)
 
             return jsonify({
                 'revenue': revenue,
@@ -85,8 +40,10 @@ def get_dashboard_summary():
                 'balance': balance,
                 'transactionCount': count
             })
-    except Exception:
-        pass
+    except Exception as e:
+        # Zeros stand in for the real totals: do not tag or cache them
+        current_app.logger.warning(f"Dashboard summary failed for {user_id}: {e}")
+        g.no_cache = True
 
     # Safe defaults if no user data
     return jsonify({
@@ -99,95 +56,55 @@ def get_dashboard_summary():
 
 @dashboard_bp.route('/api/dashboard/line-chart', methods=['GET'])
 @token_required
+@conditional_get
+@cached_result()
 def get_line_chart_data():
     user_id = g.user_id
 
     # Filters
-    filters = {'user_id': user_id}
+    filters = {}
     if 'category' in request.args:
         filters['category'] = request.args['category']
     if 'status' in request.args:
         filters['status'] = request.args['status']
 
-    expense_categories = [
-        'rent', 'bills', 'groceries', 'travel', 'others', 'shopping', 'food', 
-        'utilities', 'transport', 'medical', 'entertainment', 'subscriptions', 
-        'education', 'emi', 'loan', 'insurance', 'tax', 'fuel', 'misc', 'expense'
-    ]
+    # ?maxPoints=N thins long series to N points (LTTB, or ?downsample=minmax)
+    try:
+        max_points, method = downsample.parse_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    pipeline = [
-        # Ensure we have a date field to aggregate on; this avoids issues if some docs miss 'date'
-        {'$match': {**filters, 'date': {'$type': 'date'}}},
-        {'$addFields': {
-            'amountNum': {
-                '$cond': [
-                    {'$eq': [{'$type': '$amount'}, 'string']},
-                    {'$toDouble': {'$ifNull': ['$amount', 0]}},
-                    {'$ifNull': ['$amount', 0]}
-                ]
-            },
-            'isExpense': {
-                '$cond': [
-                    {'$eq': [{'$toLower': {'$ifNull': ['$type', '']}}, 'expense']},
-                    True,
-                    {'$in': [{'$toLower': {'$ifNull': ['$category', '']}}, expense_categories]}
-                ]
-            }
-        }},
-        {'$group': {
-            '_id': {
-                'year': {'$year': '$date'},
-                'month': {'$month': '$date'}
-            },
-            'revenue': {
-                '$sum': {
-                    '$cond': [
-                        {'$eq': ['$isExpense', False]},
-                        '$amountNum',
-                        0
-                    ]
-                }
-            },
-            'expenses': {
-                '$sum': {
-                    '$cond': [
-                        {'$eq': ['$isExpense', True]},
-                        '$amountNum',
-                        0
-                    ]
-                }
-            }
-        }},
-        {'$sort': {'_id.year': 1, '_id.month': 1}},
-        {'$project': {
-            'month': {
-                '$let': {
-                    'vars': {
-                        'months_in_year': [None, 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-                    },
-                    'in': {
-                        '$concat': [
-                            {'$$arrayElemAt': ['$$months_in_year', '$_id.month']},
-                            ' ',
-                            {'$toString': '$_id.year'}
-                        ]
-                    }
-                }
-            },
-            'revenue': '$revenue',
-            'expenses': '$expenses',
-            '_id': 0
-        }}
-    ]
+    # ?from=&to=&granularity=day|week|month|quarter&tz= returns only that
+    # window, bucketed server-side with empty buckets zero-filled
+    if timeseries.is_windowed(request.args):
+        try:
+            window = timeseries.parse_window(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        try:
+            points = timeseries.series(get_db(), user_id, filters, window)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        points = downsample.thin(points, max_points, ('revenue', 'expenses'), method)
+        return jsonify([{'month': point['period'], **point} for point in points])
 
-    # DB only per-user
+    # Monthly totals from the rollups; undated transactions are left out
     try:
         db = get_db()
-        chart_data = list(db.transactions.aggregate(pipeline))
-        if chart_data:
-            return jsonify(chart_data)
-    except Exception:
-        pass
+        months = {}
+        for row in rollups.rows(db, user_id, year={'$ne': None}, **filters):
+            totals = months.setdefault((row['year'], row['month']), [0, 0])
+            totals[0] += row['revenue']
+            totals[1] += row['expenses']
+        if months:
+            points = [
+                {'month': rollups.month_label(year, month), 'revenue': revenue, 'expenses': expenses}
+                for (year, month), (revenue, expenses) in sorted(months.items())
+            ]
+            return jsonify(downsample.thin(points, max_points, ('revenue', 'expenses'), method))
+    except Exception as e:
+        current_app.logger.warning(f"Line chart failed for {user_id}: {e}")
+        g.no_cache = True
 
     # Safe fallback: last 6 months zeros for a new/empty user
     now = datetime.datetime.utcnow()
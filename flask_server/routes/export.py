@@ -1,17 +1,46 @@
-from flask import Blueprint, Response, g
+from flask import Blueprint, Response, g, request, current_app
 from database import get_db
 from middleware import token_required
+import snapshots
 import csv
 import io
 
 export_bp = Blueprint('export', __name__)
 
+# Define the headers, ensuring consistent order
+EXPORT_HEADER = ['_id', 'user_id', 'amount', 'date', 'category', 'description', 'status', 'type']
+
+
+def stream_csv(rows):
+    """Yield CSV text row by row so large exports are never held in memory."""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=EXPORT_HEADER, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if output.tell() > 64 * 1024:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue()
+
+
 @export_bp.route('/api/export/transactions', methods=['GET'])
 @token_required
 def export_transactions():
-    db = get_db()
     user_id = g.user_id
 
+    # ?source=snapshot streams from the memory-mapped per-user snapshot
+    if request.args.get('source') == 'snapshot':
+        snap = snapshots.open_snapshot(current_app.config, user_id)
+        if snap is not None and snap.rows:
+            return Response(
+                stream_csv(snap.iter_rows(user_id)),
+                mimetype='text/csv',
+                headers={'Content-Disposition': 'attachment;filename=transactions.csv'}
+            )
+
+    db = get_db()
     transactions_cursor = db.transactions.find({'user_id': user_id})
     transactions_list = list(transactions_cursor)
 
@@ -20,10 +49,8 @@ def export_transactions():
 
     # Use an in-memory string buffer
     output = io.StringIO()
-    
-    # Define the headers, ensuring consistent order
-    header = ['_id', 'user_id', 'amount', 'date', 'category', 'description', 'status', 'type']
-    writer = csv.DictWriter(output, fieldnames=header, extrasaction='ignore')
+
+    writer = csv.DictWriter(output, fieldnames=EXPORT_HEADER, extrasaction='ignore')
 
     # Write header
     writer.writeheader()
@@ -1,42 +1,74 @@
-from flask import Blueprint, jsonify, current_app
+from flask import Blueprint, jsonify, current_app, request
 from flask import g
 from bson import ObjectId
 from datetime import datetime, timedelta
-import pandas as pd
 import numpy as np
 import os
 import json
-from sklearn.preprocessing import MinMaxScaler
-from middleware import token_required
+from middleware import token_required, conditional_get, cached_result
+import classify
+import forecast_pool
+import forecasters
+import forecasting
+import forecasts
+import model_store
+import snapshots
 
-# TensorFlow for LSTM
-try:
-    import tensorflow as tf
-    from tensorflow import keras
-    from tensorflow.keras import layers
-    TENSORFLOW_AVAILABLE = True
-except ImportError:
-    tf = None
-    TENSORFLOW_AVAILABLE = False
+TENSORFLOW_AVAILABLE = forecasting.tensorflow_available()
 
 get_db = None  # Will be set by the app
+# Forecasts are slow to compute; cached results stay valid until the data changes
+FORECAST_CACHE_TTL = 3600
 forecast_bp = Blueprint('forecast', __name__)
 
 def init_app(db_func):
     global get_db
     get_db = db_func
 
+def monthly_expenses_from_snapshot(snap):
+    """Monthly expense totals computed straight from snapshot columns."""
+    import pandas as pd
+
+    df = pd.DataFrame({
+        'date': snap.dates(),
+        'amount': snap.amounts(),
+        'category': snap.labels('category'),
+        'type': snap.labels('type'),
+    }).dropna(subset=['date', 'amount'])
+    df = df[classify.expense_mask(df['amount'], df['type'], df['category'])]
+    return df['amount'].abs().groupby(df['date'].dt.to_period('M')).sum()
+
 @forecast_bp.route('/forecast/test', methods=['GET'])
 def test_forecast():
     """Test endpoint to check LSTM availability"""
+    pool = forecast_pool.get_pool(current_app)
     return jsonify({
         'status': 'ok',
         'tensorflow_available': TENSORFLOW_AVAILABLE,
         'message': 'Forecast service is running',
         'lstm_ready': TENSORFLOW_AVAILABLE,
+        'forecasters': sorted(name for name, f in forecasters.FORECASTERS.items() if f.available()),
+        'model_cache': model_store.get_store(current_app).info(),
+        'workers': pool.info() if pool else None,
         'endpoint': '/forecast'
     })
 
+@forecast_bp.route('/forecast/jobs', methods=['GET'])
+@token_required
+def list_forecast_jobs():
+    """Training jobs of the current user running in this worker's forecast pool."""
+    pool = forecast_pool.get_pool(current_app)
+    return jsonify({'jobs': pool.jobs(g.user_id) if pool else {}})
+
+@forecast_bp.route('/forecast/jobs/<job_id>', methods=['DELETE'])
+@token_required
+def cancel_forecast_job(job_id):
+    """Stop a training job; the forecast request waiting on it answers 504."""
+    pool = forecast_pool.get_pool(current_app)
+    if pool is None or not pool.cancel(job_id, owner=g.user_id):
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job_id': job_id, 'status': 'cancelled'})
+
 @forecast_bp.route('/forecast/demo', methods=['GET'])
 def demo_forecast():
     """Demo endpoint with sample data for testing"""
@@ -108,6 +140,8 @@ def public_forecast():
 
 @forecast_bp.route('/forecast', methods=['GET'])
 @token_required
+@conditional_get
+@cached_result(FORECAST_CACHE_TTL)
 def get_forecast():
     try:
         print("🔍 Forecast endpoint called...")
@@ -121,173 +155,139 @@ def get_forecast():
                 'history': [],
                 'forecast': None
             }), 500
-        # Per-user transactions only; no global file fallback to avoid leaking data
-        db = get_db()
         user_id = g.user_id
-        transactions = list(db.transactions.find({
-            'user_id': user_id
-        }, {
-            'date': 1,
-            'amount': 1,
-            '_id': 0,
-            'category': 1,
-            'type': 1
-        }))
-
-        print(f"📊 Found {len(transactions)} transactions for user {user_id}")
-        
-        if not transactions:
-            return jsonify({
-                'history': [],
-                'forecast': None,
-                'message': 'No transactions yet for forecasting. Please upload your transaction data first.',
-                'debug': {
-                    'user_id': str(user_id),
-                    'transaction_count': 0,
-                    'tensorflow_available': TENSORFLOW_AVAILABLE
-                }
-            })
+        db = get_db()
+        # ?source=snapshot reads the memory-mapped per-user snapshot instead of MongoDB
+        snap = None
+        if request.args.get('source') == 'snapshot':
+            snap = snapshots.open_snapshot(current_app.config, user_id)
+        if snap is not None and snap.rows:
+            monthly_expenses = monthly_expenses_from_snapshot(snap)
+        else:
+            # Per-user transactions only; no global file fallback to avoid leaking data
+            monthly_expenses = forecasts.monthly_expenses(db, user_id)
 
-        # Normalize and filter transactions into a DataFrame
-        # Prefer expenses: negative amounts, or type 'debit', or category 'expense'
-        normalized = []
-        for tx in transactions:
-            amt = tx.get('amount')
-            dt = tx.get('date')
-            cat = str(tx.get('category', '')).lower()
-            ttype = str(tx.get('type', '')).lower()
-            # parse date to ISO
-            try:
-                date_val = pd.to_datetime(dt)
-            except Exception:
-                continue
-            try:
-                amt_val = float(amt)
-            except Exception:
-                continue
-            is_expense = (amt_val < 0) or (ttype == 'debit') or ('expense' in cat)
-            normalized.append({'date': date_val, 'amount': amt_val, 'is_expense': is_expense})
+            if monthly_expenses is None:
+                return jsonify({
+                    'history': [],
+                    'forecast': None,
+                    'message': 'No transactions yet for forecasting. Please upload your transaction data first.',
+                    'debug': {
+                        'user_id': str(user_id),
+                        'transaction_count': 0,
+                        'tensorflow_available': TENSORFLOW_AVAILABLE
+                    }
+                })
 
-        if not normalized:
-            return jsonify({
-                'history': [],
-                'forecast': None,
-                'message': 'No valid transactions found for forecasting'
-            })
+            if monthly_expenses.empty:
+                return jsonify({
+                    'history': [],
+                    'forecast': None,
+                    'message': 'No valid transactions found for forecasting'
+                })
 
-        df = pd.DataFrame(normalized)
-        df['date'] = pd.to_datetime(df['date'])
-        df['month'] = df['date'].dt.to_period('M')
-        
-        # Keep only expense rows
-        df = df[df['is_expense']]
-        # Use absolute values for expenses
-        df['amount'] = df['amount'].abs()
-        
-        # Group by month and sum expenses
-        monthly_expenses = df.groupby('month')['amount'].sum()
-        
-        if len(monthly_expenses) < 6:  # Need at least 6 data points for LSTM
+        if len(monthly_expenses) < forecasts.MIN_MONTHS:  # Need at least 6 data points
             return jsonify({
                 'history': [{'month': str(m), 'expense': float(v)} for m, v in monthly_expenses.items()],
                 'forecast': None,
                 'message': 'Need at least 6 months of data for LSTM forecasting'
             })
-        
-        # Check if TensorFlow is available - if not, use simple forecasting
-        if not TENSORFLOW_AVAILABLE:
+
+        y = monthly_expenses.astype(float).values
+        history = [{'month': str(m), 'expense': float(v)} for m, v in monthly_expenses.items()]
+        next_month = str(monthly_expenses.index[-1] + 1)
+
+        # ?model=auto backtests the configured models and uses the cheapest accurate
+        # one; ?model=<name> forces one (see forecasters.py)
+        try:
+            settings = forecasts.settings(current_app.config, request.args.get('model'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Results of the nightly batch (or an earlier request) are served while the
+        # series and settings are unchanged (see forecasts.py)
+        fingerprint = forecasts.fingerprint([h['month'] for h in history], y, settings)
+        stored = forecasts.load(db, user_id, fingerprint)
+        if stored is not None:
+            return jsonify(forecasts.response(history, stored))
+        # Only results for the configured model are stored
+        store_result = 'model' not in request.args
+
+        if settings['model'] != 'lstm':
+            try:
+                result = forecasts.compute(y, settings)
+            except ValueError as e:
+                return jsonify({'error': str(e), 'history': history, 'forecast': None}), 500
+            result['month'] = next_month
+            if store_result:
+                result = forecasts.record(db, user_id, fingerprint, result)
+            return jsonify(forecasts.response(history, result))
+
+        # Trained models are cached on disk per series and config (see model_store.py)
+        store = model_store.get_store(current_app)
+        key = model_store.model_key(y, forecasting.LSTM_CONFIG)
+        archive = store.load(key)
+
+        # Training needs TensorFlow - without it (and no trained model) use simple forecasting
+        if archive is None and not TENSORFLOW_AVAILABLE:
             print("⚠️ TensorFlow not available, using simple moving average forecast")
             # Simple moving average forecast (last 3 months average)
             recent_values = monthly_expenses.tail(min(3, len(monthly_expenses))).values
             forecast_value = float(np.mean(recent_values))
-            next_month = monthly_expenses.index[-1] + 1
-            
+
             return jsonify({
-                'history': [{'month': str(m), 'expense': float(v)} for m, v in monthly_expenses.items()],
+                'history': history,
                 'forecast': {
-                    'month': str(next_month),
+                    'month': next_month,
                     'expense': forecast_value
                 },
                 'message': 'Simple moving average forecast (TensorFlow not available)',
                 'method': 'moving_average'
             })
-        
-        # Convert to numeric values for LSTM
-        y = monthly_expenses.astype(float).values
-        
+
+        # With FORECAST_WORKERS training runs in the forecast pool (see forecast_pool.py)
+        pool = forecast_pool.get_pool(current_app)
         try:
-            # Prepare data for LSTM
-            scaler = MinMaxScaler()
-            y_scaled = scaler.fit_transform(y.reshape(-1, 1))
-            
-            # Create sequences for LSTM (use 3 months to predict next month)
-            WINDOW_SIZE = min(3, len(y_scaled) - 1)
-            X, y_target = [], []
-            
-            for i in range(WINDOW_SIZE, len(y_scaled)):
-                X.append(y_scaled[i-WINDOW_SIZE:i, 0])
-                y_target.append(y_scaled[i, 0])
-            
-            X = np.array(X)
-            y_target = np.array(y_target)
-            
-            if len(X) < 3:
-                return jsonify({
-                    'error': 'Insufficient data for LSTM training',
-                    'history': [{'month': str(m), 'expense': float(v)} for m, v in monthly_expenses.items()],
-                    'forecast': None
-                }), 500
-            
-            # Reshape for LSTM [samples, time steps, features]
-            X = X.reshape((X.shape[0], X.shape[1], 1))
-            
-            # Build lightweight LSTM model for memory efficiency
-            model = keras.Sequential([
-                layers.Input(shape=(WINDOW_SIZE, 1)),
-                layers.LSTM(20, return_sequences=False),  # Reduced from 50 to 20, removed second LSTM
-                layers.Dense(10),                         # Reduced from 25 to 10
-                layers.Dense(1)
-            ])
-            
-            model.compile(optimizer='adam', loss='mse')
-            
-            # Train model (with minimal epochs for memory efficiency)
-            model.fit(X, y_target, epochs=10, batch_size=1, verbose=0)
-            
-            # Forecast next month
-            last_sequence = y_scaled[-WINDOW_SIZE:].reshape(1, WINDOW_SIZE, 1)
-            forecast_scaled = model.predict(last_sequence, verbose=0)
-            forecast_value = scaler.inverse_transform(forecast_scaled)[0][0]
-            
-            # Clean up memory
-            del model, X, y_target, y_scaled, last_sequence, forecast_scaled
-            import gc
-            gc.collect()
-            
-            next_month = monthly_expenses.index[-1] + 1
-            
-            # Prepare response
-            history = [{
-                'month': str(month),
-                'expense': float(amount)
-            } for month, amount in monthly_expenses.items()]
-            
+            cached = archive is not None
+            if not cached:
+                if pool is not None:
+                    archive = pool.run(forecasting.train_lstm, y, owner=user_id)
+                else:
+                    archive = forecasting.train_lstm(y)
+                store.save(key, archive)
+            # Pure NumPy forward pass: serving never imports TensorFlow
+            forecast_value = forecasting.predict_lstm(archive, y)
+
+            result = {
+                'month': next_month,
+                'expense': float(forecast_value),
+                'message': 'LSTM forecast generated successfully',
+                'method': 'lstm',
+                'model': {'key': key[:12], 'cached': cached}
+            }
+            if store_result:
+                result = forecasts.record(db, user_id, fingerprint, result)
+            return jsonify(forecasts.response(history, result))
+
+        except forecast_pool.PoolSaturated as e:
+            response = jsonify({'error': str(e), 'status': 'busy', 'forecast': None})
+            response.headers['Retry-After'] = '5'
+            return response, 429
+        except (forecast_pool.JobTimeout, forecast_pool.JobCancelled) as e:
+            return jsonify({'error': str(e), 'forecast': None}), 504
+        except ValueError as e:
             return jsonify({
+                'error': str(e),
                 'history': history,
-                'forecast': {
-                    'month': str(next_month),
-                    'expense': float(forecast_value)
-                },
-                'message': 'LSTM forecast generated successfully'
-            })
-            
+                'forecast': None
+            }), 500
         except Exception as e:
             return jsonify({
                 'error': f'Error in forecasting: {str(e)}',
-                'history': [{'month': str(m), 'expense': float(v)} for m, v in monthly_expenses.items()],
+                'history': history,
                 'forecast': None
             }), 500
-            
+
     except Exception as e:
         print(f"❌ Critical error in forecast endpoint: {str(e)}")
         import traceback
@@ -2,12 +2,73 @@ from flask import Blueprint, jsonify, g, request, current_app
 from database import get_db
 from middleware import token_required
 from bson import json_util, ObjectId
-import json
-import os
+import ingest
+import jobs
+import projection
+import rollups
+import snapshots
+import versions
+import base64
 import datetime
+import time
 
 transactions_bp = Blueprint('transactions', __name__)
 
+# Fields clients may sort on; keyset cursors are (sort value, _id) pairs
+SORTABLE_FIELDS = ['date', 'amount', 'category', 'status', 'type', 'description', 'merchant']
+
+# Short-lived cache for the optional includeTotal count of cursor pages, so
+# paging does not recount every time; offset pages always count exactly
+COUNT_CACHE_TTL = 30
+COUNT_CACHE_MAX = 1024
+_count_cache = {}
+
+
+def cached_count(db, filters):
+    key = json_util.dumps(filters, sort_keys=True)
+    now = time.monotonic()
+    hit = _count_cache.get(key)
+    if hit and hit[1] > now:
+        return hit[0]
+    total = db.transactions.count_documents(filters)
+    if len(_count_cache) >= COUNT_CACHE_MAX:
+        _count_cache.clear()
+    _count_cache[key] = (total, now + COUNT_CACHE_TTL)
+    return total
+
+
+def encode_cursor(sort_by, sort_dir, doc, direction):
+    """Opaque continuation token for the position of ``doc`` in the sort order."""
+    payload = {'s': sort_by, 'o': sort_dir, 'v': doc.get(sort_by), 'id': doc['_id'], 'd': direction}
+    return base64.urlsafe_b64encode(json_util.dumps(payload).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Position encoded by ``encode_cursor``; ValueError for anything else."""
+    padded = token + '=' * (-len(token) % 4)
+    position = json_util.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    if (not isinstance(position, dict) or not {'s', 'o', 'id'} <= position.keys()
+            or position.get('d') not in ('next', 'prev')):
+        raise ValueError('Invalid cursor')
+    return position
+
+
+def keyset_filter(field, value, oid, op):
+    """Documents strictly after (value, oid) in the given comparison direction.
+
+    Missing/null sort values order before everything else in MongoDB, so they
+    are handled explicitly.
+    """
+    if value is None:
+        if op == '$gt':
+            return {'$or': [{field: None, '_id': {'$gt': oid}}, {field: {'$ne': None}}]}
+        return {field: None, '_id': {'$lt': oid}}
+    clauses = [{field: {op: value}}, {field: value, '_id': {op: oid}}]
+    if op == '$lt':
+        clauses.append({field: None})
+    return {'$or': clauses}
+
+
 @transactions_bp.route('/api/transactions', methods=['GET'])
 @token_required
 def get_transactions():
@@ -42,13 +103,23 @@ def get_transactions():
     sort_by = request.args.get('sortBy', 'date')
     sort_dir = 1 if request.args.get('sortDir', 'asc') == 'asc' else -1
 
+    # Keyset pagination: ?cursor= (empty for the first page) or ?pagination=cursor
+    if 'cursor' in request.args or request.args.get('pagination') == 'cursor':
+        return get_transactions_keyset(db, filters, sort_by, sort_dir, page_size)
+
+    # Sparse fieldsets: ?fields=date,amount,category,type
     try:
-        transactions_cursor = db.transactions.find(filters).sort(sort_by, sort_dir).skip(skip).limit(page_size)
+        fields = projection.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        transactions_cursor = db.transactions.find(filters, fields).sort(sort_by, sort_dir).skip(skip).limit(page_size)
         transactions = list(transactions_cursor)
         total_transactions = db.transactions.count_documents(filters)
 
         return jsonify({
-            'transactions': json.loads(json_util.dumps(transactions)),
+            'transactions': transactions,
             'total': total_transactions,
             'page': page,
             'pageSize': page_size
@@ -56,118 +127,185 @@ def get_transactions():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+def get_transactions_keyset(db, filters, sort_by, sort_dir, page_size):
+    """Cursor-paginated listing; cost is independent of how deep the page is."""
+    if sort_by not in SORTABLE_FIELDS:
+        return jsonify({'error': f'sortBy must be one of {SORTABLE_FIELDS} for cursor pagination'}), 400
+
+    # Cursors are built from the sort value and _id, so those are always returned
+    try:
+        fields = projection.parse_fields(request.args.get('fields'), required=(sort_by, '_id'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    token = request.args.get('cursor')
+    direction = 'next'
+    query = filters
+    if token:
+        try:
+            position = decode_cursor(token)
+        except Exception:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        if position['s'] != sort_by or position['o'] != sort_dir:
+            return jsonify({'error': 'Cursor does not match sortBy/sortDir'}), 400
+        direction = position['d']
+        # Walking backwards flips the comparison and the sort, results are reversed below
+        ascending = (sort_dir == 1) == (direction == 'next')
+        op = '$gt' if ascending else '$lt'
+        query = {'$and': [filters, keyset_filter(sort_by, position.get('v'), position['id'], op)]}
+
+    scan_dir = sort_dir if direction == 'next' else -sort_dir
+    try:
+        docs = list(
+            db.transactions.find(query, fields)
+            .sort([(sort_by, scan_dir), ('_id', scan_dir)])
+            .limit(page_size + 1)
+        )
+        has_more = len(docs) > page_size
+        docs = docs[:page_size]
+        if direction == 'prev':
+            docs.reverse()
+
+        next_cursor = prev_cursor = None
+        if docs:
+            # Moving back always leaves something ahead; moving forward leaves something behind
+            if direction == 'prev' or has_more:
+                next_cursor = encode_cursor(sort_by, sort_dir, docs[-1], 'next')
+            if (direction == 'next' and token) or (direction == 'prev' and has_more):
+                prev_cursor = encode_cursor(sort_by, sort_dir, docs[0], 'prev')
+
+        body = {
+            'transactions': docs,
+            'pageSize': page_size,
+            'nextCursor': next_cursor,
+            'prevCursor': prev_cursor,
+            'hasMore': next_cursor is not None,
+        }
+        # Exact totals are optional (and cached) since they require a full count
+        if request.args.get('includeTotal', 'false').lower() == 'true':
+            body['total'] = cached_count(db, filters)
+        return jsonify(body)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def rows_overwritten(user_id):
+    # Overwritten rows cannot be applied incrementally to rollups or snapshots
+    rollups.invalidate(get_db(), user_id)
+    snapshots.invalidate(user_id)
+
+
+def upload_progress(mode, stats):
+    return {
+        'mode': mode,
+        'received': stats['received'],
+        'inserted': stats['inserted'],
+        'updated': stats['updated'],
+        'skipped': stats['skipped'],
+        'collapsed': stats['collapsed'],
+        'rejected': stats['rejected'],
+        'rejected_rows': stats['rejected_rows'],
+        'batches': stats['batches'],
+        'bytes': stats['bytes'],
+        'elapsed_s': stats.get('elapsed_s'),
+    }
+
+
 @transactions_bp.route('/api/transactions/upload', methods=['POST'])
 @token_required
 def upload_transactions():
     # Do not connect to DB up-front to avoid failures when Mongo is unreachable.
     user_id = getattr(g, 'user_id', None)
 
-    # Parse JSON safely; if Content-Type missing, try raw data
-    data = None
-    try:
-        data = request.get_json(silent=True)
-        if data is None and request.data:
-            data = json.loads(request.data.decode('utf-8'))
-    except Exception as e:
-        # Still proceed to save raw text if present, but report issue
-        data = None
-
-    if data is None:
-        return jsonify({'message': 'Missing or invalid JSON payload. Ensure Content-Type: application/json and a valid JSON body.'}), 400
-
-    # Accept array or search common container keys
-    payload_list = None
-    if isinstance(data, list):
-        payload_list = data
-    elif isinstance(data, dict):
-        for key in ['transactions', 'data', 'items', 'records', 'list']:
-            if key in data and isinstance(data[key], list):
-                payload_list = data[key]
-                break
-        if payload_list is None:
-            # If dict looks like a single transaction, wrap it
-            payload_list = [data]
-    else:
-        return jsonify({'message': 'Unsupported JSON structure'}), 400
-
-    # 1) Save raw uploaded JSON to a single file for forecasting (always)
-    try:
-        upload_folder = current_app.config.get('UPLOAD_FOLDER', 'uploads')
-        os.makedirs(upload_folder, exist_ok=True)
-        json_path = os.path.join(upload_folder, 'transactions.json')
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(payload_list, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return jsonify({'message': 'Failed to write uploaded file', 'error': str(e)}), 500
-
-    # 2) Heuristically normalize transactions for DB (optional)
-    def map_field(d: dict, keys):
-        for k in keys:
-            if k in d and d[k] not in [None, '']:
-                return d[k]
-        return None
-
-    new_transactions = []
-    for tx in payload_list:
-        if not isinstance(tx, dict):
-            continue
-        amount = map_field(tx, ['amount', 'amt', 'value', 'transactionAmount'])
-        category = map_field(tx, ['category', 'type', 'tag']) or 'uncategorized'
-        date_val = map_field(tx, ['date', 'transactionDate', 'timestamp', 'time'])
-        if date_val is None or amount is None:
-            continue
-        # Parse date: support ISO, or numeric epoch (sec/ms)
-        parsed_date = None
-        try:
-            if isinstance(date_val, (int, float)):
-                # Heuristic: treat > 10^12 as ms, else seconds
-                ts = float(date_val)
-                if ts > 1e12:
-                    parsed_date = datetime.datetime.fromtimestamp(ts/1000.0)
-                else:
-                    parsed_date = datetime.datetime.fromtimestamp(ts)
-            else:
-                parsed_date = datetime.datetime.fromisoformat(str(date_val).replace('Z', '+00:00'))
-        except Exception:
-            continue
-        # Parse amount -> float
+    # insert: append everything (except source ids already stored);
+    # upsert/update: dedupe on a per-record fingerprint
+    mode = request.args.get('mode', current_app.config.get('INGEST_MODE', ingest.DEFAULT_MODE))
+    if mode not in ingest.WRITE_MODES:
+        return jsonify({'message': f'mode must be one of {list(ingest.WRITE_MODES)}'}), 400
+
+    # Background mode: spool the body, queue it and return the job id at once
+    async_arg = request.args.get('async')
+    if async_arg is not None and async_arg.lower() in ('1', 'true', 'yes') or (
+            async_arg is None and current_app.config.get('INGEST_ASYNC')):
         try:
-            amount_val = float(amount)
-        except Exception:
-            continue
+            store = jobs.JobStore(jobs.jobs_dir(current_app.config))
+            job_id = store.enqueue(user_id, request.stream, mode)
+        except Exception as e:
+            return jsonify({'message': 'Failed to queue upload', 'error': str(e)}), 500
+        return jsonify({
+            'message': 'Upload queued for processing',
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/api/transactions/upload/{job_id}'
+        }), 202
 
-        doc = {
-            'user_id': user_id,
-            'amount': amount_val,
-            'category': category,
-            'date': parsed_date,
-        }
-        # Preserve optional fields if present
-        for extra in ['status', 'description', 'merchant', 'type']:
-            if extra in tx:
-                doc[extra] = tx[extra]
-        new_transactions.append(doc)
+    # The body is parsed incrementally from the request stream and written in
+    # batches; inserted rows are also appended to the user's columnar snapshot
+    # and monthly rollups.
+    def on_insert(docs):
+        snapshots.record(user_id, docs)
+        rollups.record(get_db(), user_id, docs)
+        versions.bump(get_db(), user_id)
 
-    # 3) Try DB insert, but do not fail the request if DB is down
+    batch_size = current_app.config.get('UPLOAD_BATCH_SIZE', ingest.BATCH_SIZE)
     try:
-        if new_transactions:
-            db = get_db()
-            db.transactions.insert_many(new_transactions)
-            return jsonify({
-                'message': 'Transactions uploaded successfully',
-                'saved_to_file': True,
-                'normalized_for_db': len(new_transactions)
-            }), 201
-        else:
-            return jsonify({
-                'message': 'Saved uploaded data to file for forecasting. No records were normalized for DB (field mapping/date parsing might not match).',
-                'saved_to_file': True,
-                'normalized_for_db': 0
-            }), 201
-    except Exception as db_err:
+        stats = ingest.ingest_stream(
+            request.stream, user_id, get_db, batch_size, mode=mode, on_insert=on_insert
+        )
+    except ingest.InvalidPayload as e:
+        stats = getattr(e, 'stats', None)
+        if stats and stats['batches']:
+            # The records before the invalid JSON are stored: report a partial upload
+            if stats['updated']:
+                rows_overwritten(user_id)
+            body = {
+                'message': 'Upload stopped at invalid JSON; records before it were saved.',
+                'error': str(e),
+                'normalized_for_db': stats['normalized'],
+                'progress': upload_progress(mode, stats)
+            }
+            if 'db_error' in stats:
+                body['message'] = (f"Upload stopped at invalid JSON; only the first {stats['committed']} "
+                                   'records were saved before the database became unavailable.')
+                body['db_error'] = stats['db_error']
+            return jsonify(body), 207
+        body = {
+            'message': 'Missing or invalid JSON payload. Ensure Content-Type: application/json and a valid JSON body.',
+            'error': str(e),
+        }
+        if stats:
+            body['progress'] = stats
+        return jsonify(body), 400
+
+    progress = upload_progress(mode, stats)
+    normalized = stats['normalized']
+    if stats['updated']:
+        rows_overwritten(user_id)
+
+    if 'db_error' in stats:
+        return jsonify({
+            'message': 'Could not save transactions: database unavailable.',
+            'normalized_for_db': normalized,
+            'progress': progress,
+            'db_error': stats['db_error']
+        }), 503
+    if normalized:
         return jsonify({
-            'message': 'Transactions saved to file for forecasting. Skipped DB insert due to connection issue.',
-            'saved_to_file': True,
-            'normalized_for_db': len(new_transactions),
-            'db_error': str(db_err)
+            'message': 'Transactions uploaded successfully',
+            'normalized_for_db': normalized,
+            'progress': progress
         }), 201
+    return jsonify({
+        'message': 'No records were normalized for DB (field mapping/date parsing might not match).',
+        'normalized_for_db': 0,
+        'progress': progress
+    }), 201
+
+
+@transactions_bp.route('/api/transactions/upload/<job_id>', methods=['GET'])
+@token_required
+def get_upload_job(job_id):
+    job = jobs.JobStore(jobs.jobs_dir(current_app.config)).get(job_id)
+    if job is None or job['user_id'] != g.user_id:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(jobs.job_status(job))
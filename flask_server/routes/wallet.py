@@ -3,7 +3,12 @@ from database import get_db
 from middleware import token_required
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
+import classify
 import datetime
+import projection
+import rollups
+import snapshots
+import versions
 
 wallet_bp = Blueprint('wallet', __name__)
 
@@ -53,18 +58,17 @@ def get_wallet_history(user_id):
         ObjectId(user_id)  # validate id
     except (InvalidId, TypeError):
         return jsonify({'error': 'Invalid user id'}), 400
+    try:
+        fields = projection.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     wallet_txns_cursor = db.transactions.find({
         'user_id': user_id,
         'category': {'$in': ['wallet_add', 'wallet_withdraw']}
-    }).sort('date', -1)
-
-    transactions_list = []
-    for txn in wallet_txns_cursor:
-        txn['_id'] = str(txn['_id'])
-        transactions_list.append(txn)
+    }, fields).sort('date', -1)
 
-    return jsonify({'transactions': transactions_list})
+    return jsonify({'transactions': list(wallet_txns_cursor)})
 
 # New: history for current user (no user_id in path)
 @wallet_bp.route('/api/wallet/history', methods=['GET'])
@@ -76,15 +80,15 @@ def get_wallet_history_me():
         ObjectId(user_id)
     except (InvalidId, TypeError):
         return jsonify({'error': 'Invalid user id'}), 400
+    try:
+        fields = projection.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     wallet_txns_cursor = db.transactions.find({
         'user_id': user_id,
         'category': {'$in': ['wallet_add', 'wallet_withdraw']}
-    }).sort('date', -1)
-    transactions_list = []
-    for txn in wallet_txns_cursor:
-        txn['_id'] = str(txn['_id'])
-        transactions_list.append(txn)
-    return jsonify({'transactions': transactions_list})
+    }, fields).sort('date', -1)
+    return jsonify({'transactions': list(wallet_txns_cursor)})
 
 # Add money to wallet
 @wallet_bp.route('/api/wallet/<user_id>/add', methods=['POST'])
@@ -111,7 +115,7 @@ def add_to_wallet(user_id):
     if result.matched_count == 0:
         return jsonify({'error': 'User not found'}), 404
 
-    db.transactions.insert_one({
+    txn = {
         'user_id': user_id,
         'amount': amount,
         'category': 'wallet_add',
@@ -119,7 +123,12 @@ def add_to_wallet(user_id):
         'description': 'Added to wallet',
         'status': 'completed',
         'type': 'income'
-    })
+    }
+    classify.classify(txn)
+    db.transactions.insert_one(txn)
+    snapshots.record(user_id, [txn])
+    rollups.record(db, user_id, [txn])
+    versions.bump(db, user_id)
 
     user = db.users.find_one({'_id': oid})
     return jsonify({'walletBalance': user.get('wallet_balance')})
@@ -141,7 +150,7 @@ def add_to_wallet_me():
     result = db.users.update_one({'_id': oid}, {'$inc': {'wallet_balance': amount}})
     if result.matched_count == 0:
         return jsonify({'error': 'User not found'}), 404
-    db.transactions.insert_one({
+    txn = {
         'user_id': user_id,
         'amount': amount,
         'category': 'wallet_add',
@@ -149,7 +158,12 @@ def add_to_wallet_me():
         'description': 'Added to wallet',
         'status': 'completed',
         'type': 'income'
-    })
+    }
+    classify.classify(txn)
+    db.transactions.insert_one(txn)
+    snapshots.record(user_id, [txn])
+    rollups.record(db, user_id, [txn])
+    versions.bump(db, user_id)
     user = db.users.find_one({'_id': oid})
     return jsonify({'walletBalance': user.get('wallet_balance')})
 
@@ -181,7 +195,7 @@ def withdraw_from_wallet(user_id):
 
     db.users.update_one({'_id': oid}, {'$inc': {'wallet_balance': -amount}})
 
-    db.transactions.insert_one({
+    txn = {
         'user_id': user_id,
         'amount': amount,
         'category': 'wallet_withdraw',
@@ -189,7 +203,12 @@ def withdraw_from_wallet(user_id):
         'description': 'Withdrawn from wallet',
         'status': 'completed',
         'type': 'expense'
-    })
+    }
+    classify.classify(txn)
+    db.transactions.insert_one(txn)
+    snapshots.record(user_id, [txn])
+    rollups.record(db, user_id, [txn])
+    versions.bump(db, user_id)
 
     updated_user = db.users.find_one({'_id': oid})
     return jsonify({'walletBalance': updated_user.get('wallet_balance')})
@@ -214,7 +233,7 @@ def withdraw_from_wallet_me():
     if user.get('wallet_balance', 0) < amount:
         return jsonify({'error': 'Insufficient funds'}), 400
     db.users.update_one({'_id': oid}, {'$inc': {'wallet_balance': -amount}})
-    db.transactions.insert_one({
+    txn = {
         'user_id': user_id,
         'amount': amount,
         'category': 'wallet_withdraw',
@@ -222,6 +241,11 @@ def withdraw_from_wallet_me():
         'description': 'Withdrawn from wallet',
         'status': 'completed',
         'type': 'expense'
-    })
+    }
+    classify.classify(txn)
+    db.transactions.insert_one(txn)
+    snapshots.record(user_id, [txn])
+    rollups.record(db, user_id, [txn])
+    versions.bump(db, user_id)
     updated_user = db.users.find_one({'_id': oid})
     return jsonify({'walletBalance': updated_user.get('wallet_balance')})
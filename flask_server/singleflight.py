@@ -0,0 +1,129 @@
+"""Coalescing of concurrent identical requests ("single flight").
+
+Within a worker, callers asking for a key that is already being computed wait
+for that computation and receive its result (or its exception) instead of
+starting their own. Across workers the leader also takes a short lease in the
+shared result cache; leaders in other workers then poll the shared cache for
+the result instead of computing it again. Waiting is bounded by ``timeout``,
+after which the caller computes the value itself.
+"""
+import threading
+import time
+
+DEFAULT_TIMEOUT = 60.0
+POLL_SECONDS = 0.05
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, timeout=DEFAULT_TIMEOUT, poll_seconds=POLL_SECONDS):
+        self.timeout = timeout
+        self.poll_seconds = poll_seconds
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {'leaders': 0, 'collapsed': 0, 'shared_waits': 0, 'shared_hits': 0, 'timeouts': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def do(self, key, fn, shared=None, lookup=None):
+        """Return ``fn()``, sharing one in-flight call per key.
+
+        ``shared`` (an object with acquire_lease/lease_held/release_lease) and
+        ``lookup`` (returns the finished value from the shared store, or None)
+        enable coalescing with other workers.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats['leaders'] += 1
+            else:
+                self.stats['collapsed'] += 1
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                self._count('timeouts')
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._lead(key, fn, shared, lookup)
+            return call.result
+        except Exception as e:
+            call.error = e
+            self._count('errors')
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _lead(self, key, fn, shared, lookup):
+        if shared is None or lookup is None:
+            return fn()
+        try:
+            acquired = shared.acquire_lease(key, self.timeout)
+        except Exception:
+            return fn()
+        if acquired:
+            try:
+                # A leader that finished just before we took the lease has already published
+                value = lookup()
+                if value is not None:
+                    self._count('shared_hits')
+                    return value
+                return fn()
+            finally:
+                try:
+                    shared.release_lease(key)
+                except Exception:
+                    pass
+
+        # Another worker is computing: wait for its result to be published
+        self._count('shared_waits')
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_seconds)
+            value = lookup()
+            if value is not None:
+                self._count('shared_hits')
+                return value
+            try:
+                if not shared.lease_held(key):
+                    break
+            except Exception:
+                break
+        else:
+            self._count('timeouts')
+        # The leader may have published between our last lookup and its lease ending
+        value = lookup()
+        if value is not None:
+            self._count('shared_hits')
+            return value
+        # The other worker failed, did not cache its result, or took too long
+        return fn()
+
+    def info(self):
+        with self._lock:
+            return {'in_flight': len(self._calls), 'timeout_s': self.timeout, **self.stats}
+
+
+def get_flights(app):
+    return app.extensions.get('single_flight')
+
+
+def init_app(app):
+    app.extensions['single_flight'] = SingleFlight(timeout=app.config.get('SINGLE_FLIGHT_TIMEOUT', DEFAULT_TIMEOUT))
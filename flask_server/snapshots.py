@@ -0,0 +1,342 @@
+"""Per-user append-only columnar snapshots of transactions.
+
+Each user gets a directory under ``UPLOAD_FOLDER/snapshots`` holding one
+binary file per column plus a small ``manifest.json`` with the committed row
+count. Readers memory-map the column files (no parsing, no copies), and
+writers append under a file lock and only then publish the new row count, so
+a crashed append is simply ignored and trimmed by the next writer.
+
+A snapshot only becomes ``complete`` when ``flask --app app
+snapshot-rebuild`` has filled it from MongoDB; until then readers fall back to
+MongoDB and writes do not start one. Ingestion and wallet writes append the
+rows they insert to complete snapshots. Uploads that overwrite existing rows
+mark the snapshot stale, and readers fall back to MongoDB until the next
+rebuild.
+"""
+import datetime
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+
+import click
+import numpy as np
+from bson import ObjectId
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+VERSION = 1
+MISSING_CODE = -1
+
+# name -> kind; 'dict' columns are int32 codes into a per-user value list,
+# 'str' columns are an int64 end-offset file plus a UTF-8 blob
+COLUMNS = {
+    '_id': 'oid',
+    'date': 'datetime',
+    'amount': 'float',
+    'category': 'dict',
+    'type': 'dict',
+    'status': 'dict',
+    'description': 'str',
+}
+_DTYPES = {
+    'oid': np.dtype('S12'),
+    'datetime': np.dtype('<i8'),  # microseconds since the epoch, NaT as int64 min
+    'float': np.dtype('<f8'),
+    'dict': np.dtype('<i4'),
+    'str': np.dtype('<i8'),
+}
+_NAT = np.iinfo(np.int64).min
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def snapshot_root(config):
+    return os.path.join(config.get('UPLOAD_FOLDER', 'uploads'), 'snapshots')
+
+
+def user_dir(root, user_id):
+    return os.path.join(root, secure_filename(str(user_id)) or '_')
+
+
+def _manifest_path(directory):
+    return os.path.join(directory, 'manifest.json')
+
+
+def load_manifest(directory):
+    try:
+        with open(_manifest_path(directory), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {
+            'version': VERSION,
+            'rows': 0,
+            'columns': COLUMNS,
+            'dicts': {name: [] for name, kind in COLUMNS.items() if kind == 'dict'},
+            'str_bytes': {name: 0 for name, kind in COLUMNS.items() if kind == 'str'},
+        }
+
+
+def _write_manifest(directory, manifest):
+    tmp = _manifest_path(directory) + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, _manifest_path(directory))
+
+
+@contextmanager
+def _locked(directory):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'w') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _append_file(path, committed_bytes, data):
+    """Append bytes after the committed length, dropping any torn tail."""
+    with open(path, 'ab') as f:
+        if f.tell() != committed_bytes:
+            f.truncate(committed_bytes)
+            f.seek(committed_bytes)
+        f.write(data)
+
+
+def _to_micros(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        delta = value - _EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+    return _NAT
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def append(directory, docs):
+    """Append inserted transaction documents to a user's complete snapshot (0 if it has none)."""
+    if not docs:
+        return 0
+    with _locked(directory):
+        manifest = load_manifest(directory)
+        # Rows appended to a snapshot that lacks the user's history would read as all of it
+        if not manifest.get('complete') or manifest.get('stale'):
+            return 0
+        return _append(directory, docs)
+
+
+def _already_stored(directory, manifest, docs):
+    """Documents a rebuild already read from MongoDB (inserted while it ran)."""
+    through = manifest.get('rebuilt_through')
+    if not through or not manifest['rows']:
+        return set()
+    through = ObjectId(through)
+    candidates = [doc['_id'].binary for doc in docs if isinstance(doc.get('_id'), ObjectId) and doc['_id'] <= through]
+    if not candidates:
+        return set()
+    ids = np.memmap(os.path.join(directory, '_id.bin'), dtype='S12', mode='r', shape=(manifest['rows'],))
+    # Compare raw 12-byte values ('S' scalars would drop trailing zero bytes)
+    stored = ids.view(np.uint8).reshape(-1, 12)
+    return {c for c in candidates if (stored == np.frombuffer(c, dtype=np.uint8)).all(axis=1).any()}
+
+
+def _append(directory, docs):
+    manifest = load_manifest(directory)
+    duplicates = _already_stored(directory, manifest, docs)
+    if duplicates:
+        docs = [doc for doc in docs if not isinstance(doc.get('_id'), ObjectId) or doc['_id'].binary not in duplicates]
+    if not docs:
+        return 0
+    rows = manifest['rows']
+    for name, kind in COLUMNS.items():
+        path = os.path.join(directory, f'{name}.bin')
+        itemsize = _DTYPES[kind].itemsize
+        values = [doc.get(name) for doc in docs]
+        if kind == 'oid':
+            data = np.array([v.binary if isinstance(v, ObjectId) else b'' for v in values], dtype='S12')
+        elif kind == 'datetime':
+            data = np.array([_to_micros(v) for v in values], dtype='<i8')
+        elif kind == 'float':
+            data = np.array([_to_float(v) for v in values], dtype='<f8')
+        elif kind == 'dict':
+            lookup = manifest['dicts'][name]
+            index = {v: i for i, v in enumerate(lookup)}
+            codes = []
+            for v in values:
+                if v is None:
+                    codes.append(MISSING_CODE)
+                    continue
+                v = str(v)
+                if v not in index:
+                    index[v] = len(lookup)
+                    lookup.append(v)
+                codes.append(index[v])
+            data = np.array(codes, dtype='<i4')
+        else:
+            blob = bytearray()
+            ends = []
+            start = manifest['str_bytes'][name]
+            for v in values:
+                if v is not None:
+                    blob += str(v).encode('utf-8')
+                ends.append(start + len(blob))
+            _append_file(os.path.join(directory, f'{name}.dat'), start, bytes(blob))
+            manifest['str_bytes'][name] = start + len(blob)
+            data = np.array(ends, dtype='<i8')
+        _append_file(path, rows * itemsize, data.tobytes())
+    manifest['rows'] = rows + len(docs)
+    _write_manifest(directory, manifest)
+    return len(docs)
+
+
+def mark_stale(directory):
+    """Stop serving a snapshot whose rows were overwritten in MongoDB."""
+    if not os.path.exists(_manifest_path(directory)):
+        return
+    with _locked(directory):
+        manifest = load_manifest(directory)
+        manifest['stale'] = True
+        _write_manifest(directory, manifest)
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a user's snapshot."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest = load_manifest(directory)
+        self.rows = self.manifest['rows']
+
+    def column(self, name):
+        """Raw column array (memory-mapped, zero-copy)."""
+        kind = COLUMNS[name]
+        dtype = _DTYPES[kind]
+        if self.rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.directory, f'{name}.bin'), dtype=dtype, mode='r', shape=(self.rows,))
+
+    def dates(self):
+        """Dates as datetime64[us] (a view on the mapped int64 column)."""
+        return self.column('date').view('datetime64[us]')
+
+    def amounts(self):
+        return self.column('amount')
+
+    def labels(self, name):
+        """Decoded values of a dictionary column as an object array (None for missing)."""
+        lookup = np.array(self.manifest['dicts'][name] + [None], dtype=object)
+        codes = self.column(name)
+        return lookup[np.where(codes == MISSING_CODE, len(lookup) - 1, codes)]
+
+    def strings(self, name):
+        """Iterate a string column lazily."""
+        ends = self.column(name)
+        if self.rows == 0:
+            return
+        if not self.manifest['str_bytes'][name]:
+            yield from ('' for _ in range(self.rows))
+            return
+        data = np.memmap(os.path.join(self.directory, f'{name}.dat'), dtype=np.uint8, mode='r',
+                         shape=(int(self.manifest['str_bytes'][name]),))
+        start = 0
+        for end in ends:
+            yield bytes(data[start:end]).decode('utf-8')
+            start = int(end)
+
+    def iter_rows(self, user_id):
+        """Yield transaction dicts in insertion order (for export)."""
+        # Raw 12-byte ObjectIds ('S' scalars would drop trailing zero bytes)
+        ids = self.column('_id').view(np.uint8).reshape(-1, 12)
+        dates = self.dates()
+        amounts = self.amounts()
+        labels = {name: self.labels(name) for name, kind in COLUMNS.items() if kind == 'dict'}
+        descriptions = self.strings('description')
+        for i in range(self.rows):
+            oid = ids[i].tobytes()
+            stamp = dates[i]
+            yield {
+                '_id': str(ObjectId(oid)) if any(oid) else '',
+                'user_id': user_id,
+                'amount': float(amounts[i]),
+                'date': None if np.isnat(stamp) else stamp.item(),
+                'category': labels['category'][i],
+                'type': labels['type'][i],
+                'status': labels['status'][i],
+                'description': next(descriptions),
+            }
+
+
+def open_snapshot(config, user_id):
+    """Return the user's Snapshot, or None unless a complete, current one exists."""
+    directory = user_dir(snapshot_root(config), user_id)
+    if not os.path.exists(_manifest_path(directory)):
+        return None
+    snap = Snapshot(directory)
+    if snap.manifest.get('stale') or not snap.manifest.get('complete'):
+        return None
+    return snap
+
+
+def record(user_id, docs):
+    """Append freshly inserted documents; never fails the calling request."""
+    try:
+        append(user_dir(snapshot_root(current_app.config), user_id), docs)
+    except Exception as e:
+        current_app.logger.warning(f"Snapshot append failed for {user_id}: {e}")
+
+
+def invalidate(user_id):
+    """``mark_stale`` for request handlers; never fails the calling request."""
+    try:
+        mark_stale(user_dir(snapshot_root(current_app.config), user_id))
+    except Exception as e:
+        current_app.logger.warning(f"Snapshot invalidation failed for {user_id}: {e}")
+
+
+def rebuild(db, root, user_id=None, batch_size=5000, log=print):
+    """Regenerate snapshots from MongoDB (all users, or one).
+
+    The user's lock is held throughout, so concurrent appends wait and then
+    skip documents the rebuild already read.
+    """
+    user_ids = [user_id] if user_id else db.transactions.distinct('user_id')
+    for uid in user_ids:
+        directory = user_dir(root, uid)
+        with _locked(directory):
+            for name in os.listdir(directory):
+                if name != '.lock':
+                    os.remove(os.path.join(directory, name))
+            rows = 0
+            last_id = None
+            batch = []
+            for doc in db.transactions.find({'user_id': uid}).sort('_id', 1).batch_size(batch_size):
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    rows += _append(directory, batch)
+                    last_id = batch[-1]['_id']
+                    batch = []
+            if batch:
+                rows += _append(directory, batch)
+                last_id = batch[-1]['_id']
+            manifest = load_manifest(directory)
+            if isinstance(last_id, ObjectId):
+                manifest['rebuilt_through'] = str(last_id)
+            manifest['complete'] = True
+            _write_manifest(directory, manifest)
+        log(f'{uid}: {rows} rows')
+
+
+def init_app(app):
+    from database import get_db
+
+    @app.cli.command('snapshot-rebuild')
+    @click.option('--user-id', default=None, help='Only rebuild this user.')
+    def snapshot_rebuild(user_id):
+        """Rebuild per-user columnar snapshots from MongoDB."""
+        rebuild(get_db(), snapshot_root(app.config), user_id=user_id, log=click.echo)
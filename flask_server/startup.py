@@ -0,0 +1,130 @@
+"""Worker boot cost: startup profile and optional forecast warm-up.
+
+Heavy ML libraries (TensorFlow, scikit-learn, pandas, statsmodels) are imported
+on first use, so a worker can serve ``/api/auth/login`` right after boot.
+``flask --app app startup-profile`` imports the app in a fresh interpreter
+with ``-X importtime`` and reports the boot time, the import time per top-level
+package and the resident memory after boot. ``--max-seconds`` and
+``--max-rss-mb`` make it fail when a change pulls heavy imports back into
+startup.
+
+With ``FORECAST_WARMUP`` a background thread loads the forecasting stack after
+boot (or starts the forecast pool, whose processes warm themselves up), so the
+first forecast does not pay for it.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import click
+
+# Modules that should not be loaded by merely importing the app
+HEAVY_MODULES = ('tensorflow', 'keras', 'sklearn', 'scipy', 'pandas', 'statsmodels')
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+from startup import HEAVY_MODULES, rss_mb
+print(json.dumps({{'seconds': seconds, 'rss_mb': rss_mb(),
+                  'heavy_modules': [m for m in HEAVY_MODULES if m in sys.modules]}}))
+"""
+
+
+def rss_mb():
+    """Resident memory of this process in MB."""
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def parse_importtime(text):
+    """{top-level package: self import seconds} from ``-X importtime`` output."""
+    packages = {}
+    for line in text.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0.0) + int(own) / 1e6
+    return packages
+
+
+def profile(module='app', cwd=None):
+    """Boot ``module`` in a new interpreter and measure it."""
+    cwd = cwd or os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE.format(module=module)],
+        cwd=cwd, capture_output=True, text=True, check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed')
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    packages = parse_importtime(result.stderr)
+    report['packages'] = dict(sorted(packages.items(), key=lambda item: -item[1]))
+    return report
+
+
+def info():
+    """Memory and loaded heavy modules of this worker."""
+    return {'rss_mb': round(rss_mb(), 1), 'heavy_modules': [m for m in HEAVY_MODULES if m in sys.modules]}
+
+
+def warm_up(app):
+    """Load the forecasting stack in a background thread."""
+    import forecast_pool
+
+    def run():
+        start = time.perf_counter()
+        pool = forecast_pool.get_pool(app)
+        try:
+            import forecasters
+            forecasters.warm_up()
+            if pool is not None:
+                pool.start()
+            else:
+                import forecasting
+                forecasting.warm_up()
+        except Exception as e:
+            app.logger.warning('Forecast warm-up failed: %s', e)
+            return
+        app.logger.info('Forecast warm-up finished in %.1fs', time.perf_counter() - start)
+
+    thread = threading.Thread(target=run, name='forecast-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def init_app(app):
+    @app.cli.command('startup-profile')
+    @click.option('--top', default=15, show_default=True, help='Packages to list.')
+    @click.option('--max-seconds', type=float, default=None, help='Fail if booting takes longer.')
+    @click.option('--max-rss-mb', type=float, default=None, help='Fail if memory after boot is higher.')
+    @click.option('--json', 'as_json', is_flag=True, help='Print the report as JSON.')
+    def startup_profile(top, max_seconds, max_rss_mb, as_json):
+        """Measure import time and memory of a fresh worker."""
+        report = profile()
+        if as_json:
+            click.echo(json.dumps(report, indent=2))
+        else:
+            click.echo(f"boot: {report['seconds']:.2f}s, rss: {report['rss_mb']:.0f} MB")
+            click.echo(f"heavy modules loaded: {', '.join(report['heavy_modules']) or 'none'}")
+            for package, seconds in list(report['packages'].items())[:top]:
+                click.echo(f'  {seconds * 1000:8.1f} ms  {package}')
+        failures = []
+        if max_seconds is not None and report['seconds'] > max_seconds:
+            failures.append(f"boot took {report['seconds']:.2f}s > {max_seconds}s")
+        if max_rss_mb is not None and report['rss_mb'] > max_rss_mb:
+            failures.append(f"rss {report['rss_mb']:.0f} MB > {max_rss_mb} MB")
+        if failures:
+            raise click.ClickException('; '.join(failures))
+
+    if app.config.get('FORECAST_WARMUP'):
+        warm_up(app)
@@ -0,0 +1,84 @@
+"""NumPy LSTM inference (forecasting.lstm_forward) against Keras.
+
+The golden file holds a trained archive plus Keras outputs for fixed inputs
+(written by ``benchmarks/lstm_parity.py --write-golden``), so parity is
+checked without TensorFlow. It must be written with the TensorFlow version
+pinned in requirements.txt. Where TensorFlow is installed the forward pass
+is also compared with ``model.predict`` directly.
+
+    cd flask_server && python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import forecasting  # noqa: E402
+
+GOLDEN = os.path.join(os.path.dirname(__file__), 'fixtures', 'lstm_golden.npz')
+REQUIREMENTS = os.path.join(os.path.dirname(__file__), '..', 'requirements.txt')
+TOLERANCE = 1e-5
+
+
+def load_golden():
+    with np.load(GOLDEN) as data:
+        return {name: data[name] for name in data.files}
+
+
+def pinned_tensorflow():
+    with open(REQUIREMENTS) as f:
+        for line in f:
+            name, _, version = line.strip().partition('==')
+            if name in ('tensorflow', 'tensorflow-cpu'):
+                return version
+    return None
+
+
+class GoldenParityTest(unittest.TestCase):
+    def setUp(self):
+        self.golden = load_golden()
+
+    def test_written_with_pinned_tensorflow(self):
+        self.assertEqual(str(self.golden['tensorflow_version']), pinned_tensorflow())
+
+    def test_forward_matches_keras_outputs(self):
+        outputs = forecasting.lstm_forward(self.golden, self.golden['inputs'])
+        np.testing.assert_allclose(outputs, self.golden['keras_outputs'], rtol=0, atol=TOLERANCE)
+
+    def test_forecast_matches_keras_forecast(self):
+        forecast = forecasting.predict_lstm(self.golden, self.golden['series'])
+        expected = float(self.golden['keras_forecast'])
+        self.assertLessEqual(abs(forecast - expected) / max(abs(expected), 1.0), TOLERANCE)
+
+
+@unittest.skipUnless(forecasting.tensorflow_available(), 'TensorFlow is not installed')
+class KerasParityTest(unittest.TestCase):
+    def model_for(self, archive):
+        window = int(archive['window'])
+        model = forecasting._build(window, archive['lstm_recurrent_kernel'].shape[0], archive['dense_kernel'].shape[1])
+        model.set_weights([archive[name] for name in forecasting.WEIGHTS])
+        return model
+
+    def test_forward_matches_predict_for_golden_weights(self):
+        golden = load_golden()
+        X = np.random.default_rng(3).uniform(-0.2, 1.2, (128, int(golden['window']), 1))
+        expected = self.model_for(golden).predict(X, verbose=0)[:, 0]
+        np.testing.assert_allclose(forecasting.lstm_forward(golden, X), expected, rtol=0, atol=TOLERANCE)
+
+    def test_forward_matches_predict_for_trained_model(self):
+        rng = np.random.default_rng(5)
+        y = np.linspace(800, 1400, 15) + rng.normal(0, 60, 15)
+        archive = forecasting.train_lstm(y)
+        X = rng.uniform(-0.2, 1.2, (128, int(archive['window']), 1))
+        expected = self.model_for(archive).predict(X, verbose=0)[:, 0]
+        np.testing.assert_allclose(forecasting.lstm_forward(archive, X), expected, rtol=0, atol=TOLERANCE)
+        keras_value = forecasting.predict_keras(archive, y)
+        self.assertLessEqual(
+            abs(forecasting.predict_lstm(archive, y) - keras_value) / max(abs(keras_value), 1.0), TOLERANCE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Per-user data versions for conditional GETs.
+
+Every write that changes a user's transactions bumps a counter in the
+``data_versions`` collection. Read endpoints decorated with
+``middleware.conditional_get`` derive a strong ETag from it and answer
+``304 Not Modified`` after a single ``_id`` lookup when nothing changed; the
+same tag keys the result cache (``middleware.cached_result``).
+
+Changes that alter everyone's numbers at once (migrations, rollup rule
+changes) bump a global version that is part of every tag. A user whose bump
+failed is marked ``unversioned``: conditional GETs skip ETags (and with them
+the cache) for that user until the next read repairs the counter.
+"""
+import hashlib
+
+from flask import current_app
+from pymongo import ReturnDocument
+
+import cache
+
+VERSIONS = 'data_versions'
+# Change when response formats change so clients do not keep stale bodies
+ETAG_SCHEMA = 1
+# Document bumped when every user's data changes
+GLOBAL = '*'
+
+
+def current(db, user_id):
+    """The version tagging the user's data, or None while it cannot be trusted."""
+    docs = {doc['_id']: doc for doc in db[VERSIONS].find({'_id': {'$in': [user_id, GLOBAL]}})}
+    doc = docs.get(user_id) or {}
+    if doc.get('unversioned'):
+        # A write went unrecorded; moving past every version handed out before it repairs that
+        doc = db[VERSIONS].find_one_and_update(
+            {'_id': user_id, 'unversioned': True},
+            {'$inc': {'version': 1}, '$unset': {'unversioned': ''}},
+            return_document=ReturnDocument.AFTER,
+        ) or db[VERSIONS].find_one({'_id': user_id})
+        if doc.get('unversioned'):
+            return None
+    return f"{docs.get(GLOBAL, {}).get('version', 0)}.{doc.get('version', 0)}"
+
+
+def bump(db, user_id):
+    """Record that the user's data changed; never fails the calling request."""
+    try:
+        db[VERSIONS].update_one({'_id': user_id}, {'$inc': {'version': 1}}, upsert=True)
+    except Exception as e:
+        current_app.logger.warning(f"Data version bump failed for {user_id}: {e}")
+        try:
+            db[VERSIONS].update_one({'_id': user_id}, {'$set': {'unversioned': True}}, upsert=True)
+        except Exception as e:
+            current_app.logger.error(f"Could not mark {user_id} unversioned; cached reads may be stale: {e}")
+    # Old entries are unreachable under the new version; free them now
+    results = cache.get_cache(current_app)
+    if results is not None:
+        results.invalidate_user(user_id)
+
+
+def bump_all(db):
+    """Record that every user's data changed (old cache entries become unreachable)."""
+    db[VERSIONS].update_one({'_id': GLOBAL}, {'$inc': {'version': 1}}, upsert=True)
+
+
+def etag(user_id, version, *parts):
+    """Strong ETag for one representation of the user's data at ``version``."""
+    key = '\x1f'.join(str(p) for p in (ETAG_SCHEMA, user_id, version, *parts))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()